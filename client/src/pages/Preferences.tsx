@@ -9,6 +9,7 @@ import {
 import Navbar from "@/components/NavBar";
 import {Loading} from "@/components/Loading";
 import {toast} from "sonner";
+import {useAuth} from "@/context/AuthContext";
 
 const genreOptions = [
   "Action",
@@ -41,6 +42,7 @@ const moodOptions = [
 
 export const Preferences: React.FC = () => {
   const navigate = useNavigate();
+  const {user} = useAuth();
 
   const [selectedMood, setSelectedMood] = useState<string>("");
   const [freeTime, setFreeTime] = useState<string>("90");
@@ -103,10 +105,13 @@ export const Preferences: React.FC = () => {
 
     setIsLoading(true);
     try {
+      // Personalized ranking is only applied to requests signed with the user's ID token
+      const token = user ? await user.getIdToken() : null;
       const response = await fetch("https://rec-movie.onrender.com/recommend", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          ...(token ? {Authorization: `Bearer ${token}`} : {}),
         },
         body: JSON.stringify({
           mood: valid.selectedMood?.toLowerCase(),
@@ -122,6 +127,7 @@ export const Preferences: React.FC = () => {
               : null,
           selected_genres: valid.genres,
           number_recommended: Number(valid.movieCount),
+          user_id: user?.uid,
         }),
       });
 
@@ -147,6 +153,7 @@ export const Preferences: React.FC = () => {
           state: {
             preferences: valid,
             movies: result.recommended_movies,
+            cursor: result.cursor,
           },
         });
       }
@@ -45,6 +45,9 @@ const Results = () => {
   const [isSaving, setIsSaving] = useState(false);
   const [isLoading, setIsLoading] = useState(false);
   const [prev_ids, setPrevIds] = useState<number[]>([]);
+  const [cursor, setCursor] = useState<string | null>(
+    location.state?.cursor ?? null
+  );
   const [movies, setMovies] = useState<Movie[]>(() =>
     (location.state?.movies || []).map((m: MovieResponse) =>
       parseMovie(m.content, m.id)
@@ -125,6 +128,22 @@ const Results = () => {
       // Save to Firestore
       await addDoc(recommendationsRef, recommendationData);
 
+      // Personalizes future recommendations, the history itself is already saved.
+      // The API only accepts updates signed with the user's own ID token.
+      Promise.resolve()
+        .then(() => user.getIdToken())
+        .then((token) =>
+          fetch(`https://rec-movie.onrender.com/users/${user.uid}/history`, {
+            method: "POST",
+            headers: {
+              "Content-Type": "application/json",
+              Authorization: `Bearer ${token}`,
+            },
+            body: JSON.stringify({movie_ids: movies.map((movie) => movie.id)}),
+          })
+        )
+        .catch((error) => console.error("Error updating taste profile:", error));
+
       toast.success("Saved to history!", {
         description: "Your recommendations have been saved successfully.",
       });
@@ -148,10 +167,13 @@ const Results = () => {
   const handleGetNewRecommendations = async () => {
     setIsLoading(true);
     try {
+      // Personalized ranking is only applied to requests signed with the user's ID token
+      const token = user ? await user.getIdToken() : null;
       const response = await fetch("https://rec-movie.onrender.com/recommend", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
+          ...(token ? {Authorization: `Bearer ${token}`} : {}),
         },
         body: JSON.stringify({
           mood: preferences.selectedMood?.toLowerCase(),
@@ -169,12 +191,15 @@ const Results = () => {
           selected_genres: preferences.genres,
           number_recommended: Number(preferences.movieCount),
           previous_ids: prev_ids,
+          cursor,
+          user_id: user?.uid,
         }),
       });
 
       console.log(prev_ids);
 
       const result = await response.json();
+      setCursor(result.cursor ?? null);
 
       if (result.recommended_movies.length == 0) {
         setIsLoading(false);
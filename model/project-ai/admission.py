@@ -0,0 +1,125 @@
+import os
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from deadlines import CANCEL_POLL_INTERVAL
+from metrics import metrics
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+# "reject" answers 429/503 when overloaded, "degrade" falls back to the local ranker
+LLM_OVERLOAD_MODE = os.getenv("LLM_OVERLOAD_MODE", "reject")
+
+
+class Overloaded(Exception):
+    def __init__(self, message, retry_after, status_code=503):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+class AdmissionController:
+    """
+    Limits concurrent LLM calls to `max_concurrency`, with at most
+    `max_queue` requests waiting up to `queue_timeout` seconds for a slot.
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, name="llm"):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        # Smoothed time a request holds a slot, used for Retry-After
+        self._service_time = 1.0
+
+    def retry_after(self):
+        backlog = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(self._service_time * backlog))
+
+    def hold(self, deadline=None):
+        """
+        Takes a slot and returns the callable that gives it back. Waits at
+        most queue_timeout, and no longer than the request's deadline.
+        """
+        started = time.monotonic()
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.max_queue:
+                    metrics.incr(f"{self.name}.admission.rejected")
+                    raise Overloaded("Too many requests waiting for ranking", self.retry_after(), 429)
+                self.waiting += 1
+
+            admitted = False
+            try:
+                end = started + self.queue_timeout
+                while not admitted:
+                    timeout = end - time.monotonic()
+                    if deadline is not None:
+                        # Raises Cancelled once the request is cancelled or its deadline passes
+                        deadline.check("admission")
+                        timeout = min(timeout, CANCEL_POLL_INTERVAL)
+                    if timeout <= 0:
+                        break
+                    admitted = self._slots.acquire(timeout=timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+
+            if not admitted:
+                metrics.incr(f"{self.name}.admission.timed_out")
+                raise Overloaded("Timed out waiting for a ranking slot", self.retry_after(), 503)
+
+        metrics.observe(f"{self.name}.admission.queue_wait", time.monotonic() - started)
+        return self._held()
+
+    def try_hold(self):
+        """A slot's release callable when one is free right now, None otherwise"""
+        if not self._slots.acquire(blocking=False):
+            return None
+        return self._held()
+
+    def _held(self):
+        with self._lock:
+            self.in_flight += 1
+        held_from = time.monotonic()
+
+        def release():
+            held = time.monotonic() - held_from
+            with self._lock:
+                self.in_flight -= 1
+                self._service_time = 0.8 * self._service_time + 0.2 * held
+            self._slots.release()
+
+        return release
+
+    @contextmanager
+    def admit(self, deadline=None):
+        release = self.hold(deadline)
+        try:
+            yield
+        finally:
+            release()
+
+    def run(self, deadline, func, *args):
+        """
+        Runs func on the deadline's pool inside a slot. The request stops
+        waiting when it is cancelled, but the slot is only given back once
+        func has returned, so abandoned calls still count against the limit.
+        """
+        release = self.hold(deadline)
+        try:
+            future = deadline.submit(func, *args)
+        except BaseException:
+            release()
+            raise
+        future.add_done_callback(lambda _: release())
+        return deadline.wait(future)
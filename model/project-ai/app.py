@@ -1,12 +1,60 @@
 import os
-from fastapi import FastAPI
+import hmac
+import asyncio
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, FastAPI, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 
+import main
 from main import recommend_movies
+from admission import Overloaded
+from deadlines import DEADLINE, REQUEST_TIMEOUT, Cancelled, Deadline
+from metrics import metrics
+from http_cache import cached_json, make_etag
+from cache_warmer import WARMER_ENABLED
+from data_version import RELOAD_WATCH, ReloadInProgress
+from firebase_auth import verified_uid
+from prefetch import PREFETCH_ENABLED
+from profiling import list_profiles, profile_request, read_profile_report, should_profile
 
-app = FastAPI(title="Movie Recommendation API", version="1.0.0")
+# Upper bound on ids per bulk movie lookup
+MAX_BULK_IDS = 100
+# Upper bound on autocomplete suggestions per keystroke
+MAX_AUTOCOMPLETE = 25
+
+# Seconds between checks for a client that went away
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Token for the /admin endpoints, which are disabled when it is not set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Attach (or build) the catalog without blocking startup,
+    # requests use the dynamic SQL path until it is ready
+    threading.Thread(target=main.load_catalog, daemon=True).start()
+    if WARMER_ENABLED:
+        # Precompute popular rankings so the first users after a deploy hit the cache
+        main.cache_warmer.start()
+    if RELOAD_WATCH:
+        # Swap in a new database file moved into place without a restart
+        main.database_watcher.start()
+    yield
+    main.cache_warmer.stop()
+    main.database_watcher.stop()
+    # Write out the events still queued
+    main.event_log.stop()
+
+
+app = FastAPI(title="Movie Recommendation API", version="1.0.0", lifespan=lifespan)
 
 # CORS configuration - allow your frontend
 allowed_origins = [
@@ -34,6 +82,13 @@ class Preferences(BaseModel):
     selected_genres: Optional[List[str]] = None
     number_recommended: Optional[int] = 3
     previous_ids: Optional[List[int]] = None
+    cursor: Optional[str] = None
+    user_id: Optional[str] = None
+
+class HistoryEntry(BaseModel):
+    movie_ids: List[int]
+    # Negative for movies the user removed or disliked
+    weight: float = 1.0
 
 @app.get("/")
 def read_root():
@@ -45,6 +100,13 @@ def read_root():
         "endpoints": {
             "/": "API information",
             "/health": "Health check",
+            "/metrics": "Service metrics",
+            "/movies/{id}": "Movie details by ID",
+            "/movies?ids=1,2,3": "Movie details for several IDs",
+            "/similar/{id}": "Movies similar to a movie",
+            "/autocomplete?prefix=": "Movie titles starting with a prefix",
+            "/facets": "Movie counts per genre, language, country, era and length under the selected filters",
+            "/users/{id}/history": "Record movies a user kept, personalizing their recommendations (POST)",
             "/recommend": "Get movie recommendations (POST)"
         }
     }
@@ -54,21 +116,280 @@ def health_check():
     """Health check endpoint"""
     return {"status": "ok", "service": "movie-recommendation-api"}
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Counters, stage timings and gauges of this worker"""
+    return metrics.snapshot()
+
+def catalog_unavailable():
+    return JSONResponse(
+        status_code=503,
+        content={"error": "Catalog is still loading"},
+        headers={"Retry-After": "5"},
+    )
+
+@app.get("/movies/{movie_id}")
+def get_movie(movie_id: int, request: Request):
+    """
+    Movie details from the catalog, cacheable by browsers and CDNs
+    
+    Returns:
+        JSON movie record, 304 when the ETag still matches
+    """
+    catalog = main.catalog
+    if catalog is None:
+        return catalog_unavailable()
+
+    row = int(catalog.rows_for_ids([movie_id])[0])
+    if row < 0:
+        return JSONResponse(status_code=404, content={"error": f"Movie {movie_id} not found"})
+
+    return cached_json(request, catalog.record(row), make_etag(catalog.version, movie_id))
+
+@app.get("/movies")
+def get_movies(ids: str, request: Request):
+    """
+    Movie details for a comma separated list of IDs (history views)
+    
+    Returns:
+        JSON with the movies in request order and the IDs that were not found
+    """
+    catalog = main.catalog
+    if catalog is None:
+        return catalog_unavailable()
+
+    try:
+        movie_ids = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "ids must be a comma separated list of integers"})
+
+    if len(movie_ids) > MAX_BULK_IDS:
+        return JSONResponse(status_code=400, content={"error": f"At most {MAX_BULK_IDS} ids per request"})
+
+    rows = catalog.rows_for_ids(movie_ids)
+    movies = [catalog.record(int(row)) for row in rows if row >= 0]
+    missing = [movie_id for movie_id, row in zip(movie_ids, rows) if row < 0]
+
+    content = {"movies": movies, "missing": missing}
+    return cached_json(request, content, make_etag(catalog.version, *movie_ids))
+
+@app.get("/autocomplete")
+def autocomplete(prefix: str, request: Request, limit: int = 10):
+    """
+    Most popular movies whose title starts with the prefix (case and accent insensitive)
+    
+    Returns:
+        JSON with up to `limit` suggestions, 304 when the ETag still matches
+    """
+    catalog = main.catalog
+    if catalog is None:
+        return catalog_unavailable()
+
+    limit = max(1, min(limit, MAX_AUTOCOMPLETE))
+    started = time.monotonic()
+    rows = catalog.autocomplete(prefix, limit)
+    metrics.observe("autocomplete.latency", time.monotonic() - started)
+
+    suggestions = [catalog.suggestion(row) for row in rows]
+    content = {"prefix": prefix, "suggestions": suggestions}
+    return cached_json(request, content, make_etag(catalog.version, "autocomplete", prefix, limit))
+
+@app.get("/facets")
+def facets(
+    request: Request,
+    mood: Optional[str] = None,
+    language: Optional[str] = None,
+    country: Optional[str] = None,
+    era: Optional[str] = None,
+    preferred_length: Optional[int] = None,
+    selected_genres: Optional[List[str]] = Query(None),
+):
+    """
+    Movie counts per facet value under the selected filters. Each facet is
+    counted with the other filters applied, so a zero count (left out of
+    the response) is a combination that would return no movies.
+    
+    Returns:
+        JSON with the total and the counts per value, 304 when the ETag still matches
+    """
+    facet_index = main.facet_index
+    if facet_index is None:
+        return catalog_unavailable()
+
+    filters = {
+        "mood": mood,
+        "language": language,
+        "country": country,
+        "era": era,
+        "preferred_length": preferred_length,
+        "selected_genres": selected_genres,
+    }
+    started = time.monotonic()
+    content = facet_index.counts(filters)
+    metrics.observe("facets.latency", time.monotonic() - started)
+
+    etag = make_etag(facet_index.version, "facets", *(f"{name}={value}" for name, value in filters.items()))
+    return cached_json(request, content, etag)
+
+@app.get("/similar/{movie_id}")
+def similar_movies_api(movie_id: int, limit: int = main.SIMILAR_LIMIT):
+    """
+    Movies most similar to the given one, from the precomputed neighbour table
+    
+    Returns:
+        JSON with the similar movies, best match first
+    """
+    try:
+        result = main.similar_movies(movie_id, limit)
+    except sqlite3.OperationalError as e:
+        print(f"Error: {e}")
+        return JSONResponse(status_code=503, content={"error": "Similar movies are not available"})
+
+    if not result["similar_movies"]:
+        return JSONResponse(status_code=404, content={"error": f"No similar movies for {movie_id}"})
+    return result
+
+@app.post("/users/{user_id}/history")
+def record_history(user_id: str, entry: HistoryEntry, request: Request):
+    """
+    Movies a user saved to their history, folded into their taste vector.
+    Requires the user's Firebase ID token (Authorization: Bearer) or X-Admin-Token.
+    
+    Returns:
+        JSON with how many movies were applied and the user's interaction count
+    """
+    forbidden = user_forbidden(request, user_id)
+    if forbidden:
+        return forbidden
+    if main.catalog is None:
+        return catalog_unavailable()
+    if len(entry.movie_ids) > MAX_BULK_IDS:
+        return JSONResponse(status_code=400, content={"error": f"At most {MAX_BULK_IDS} ids per request"})
+
+    applied = main.record_history(user_id, entry.movie_ids, entry.weight)
+    return {"applied": applied, "interactions": main.profile_store.interactions(user_id)}
+
+async def cancel_on_disconnect(request: Request, deadline: Deadline):
+    while not deadline.cancelled:
+        if await request.is_disconnected():
+            print("CANCELLED -> Client disconnected")
+            deadline.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+def run_recommendation(payload_dict, previous_ids, cursor, profiled, deadline):
+    # Profiles this thread only, the LLM call, hedges and partition scans on other pools show up as waits
+    with profile_request("recommend", profiled) as profile:
+        result = recommend_movies(payload_dict, previous_ids, cursor=cursor, deadline=deadline)
+    return result, profile["id"]
+
 @app.post("/recommend")
-def recommend_movies_api(payload: Preferences):
+async def recommend_movies_api(payload: Preferences, request: Request, response: Response,
+                               background_tasks: BackgroundTasks):
     """
     Get movie recommendations based on user preferences
     
+    Send back the `cursor` of a previous response (together with
+    `previous_ids`) to get more results from the same candidate list.
+    With profiling enabled, `X-Profile: 1` profiles the request and the
+    response carries the profile id in `X-Profile-Id`. Requests are
+    abandoned after REQUEST_TIMEOUT seconds (504) or as soon as the
+    client disconnects. With prefetching enabled, the next page is
+    computed after the response is sent.
+    
     Returns:
-        JSON with recommended movies
+        JSON with recommended movies and a cursor for follow-up requests
     """
     print(f"Received request: {payload}")
     payload_dict = payload.dict()
     previous_ids = payload_dict.pop("previous_ids", None)
-    
+    cursor = payload_dict.pop("cursor", None)
+    if payload_dict.get("user_id") and user_forbidden(request, payload_dict["user_id"]) is not None:
+        # Taste vectors are private, a user_id without the user's ID token is served as anonymous
+        payload_dict["user_id"] = None
+    profiled = should_profile(request.headers.get("x-profile"))
+
+    deadline = Deadline(REQUEST_TIMEOUT)
+    watcher = asyncio.create_task(cancel_on_disconnect(request, deadline))
     try:
-        result = recommend_movies(payload_dict, previous_ids)
+        result, profile_id = await run_in_threadpool(
+            run_recommendation, payload_dict, previous_ids, cursor, profiled, deadline)
+        if profile_id:
+            response.headers["X-Profile-Id"] = profile_id
+        if PREFETCH_ENABLED:
+            background_tasks.add_task(main.prefetcher.schedule, payload_dict, previous_ids, result)
         return result
+    except Cancelled as e:
+        # 499 is only seen in logs, the client is gone
+        return JSONResponse(
+            status_code=504 if e.reason == DEADLINE else 499,
+            content={"error": str(e), "recommended_movies": []},
+        )
+    except Overloaded as e:
+        print(f"Overloaded: {e}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"error": str(e), "recommended_movies": []},
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         print(f"Error: {e}")
-        return {"error": str(e), "recommended_movies": []}
\ No newline at end of file
+        return {"error": str(e), "recommended_movies": []}
+    finally:
+        watcher.cancel()
+
+def admin_forbidden(request: Request):
+    token = request.headers.get("x-admin-token", "")
+    if ADMIN_TOKEN and hmac.compare_digest(token, ADMIN_TOKEN):
+        return None
+    return JSONResponse(status_code=403, content={"error": "Forbidden"})
+
+def user_forbidden(request: Request, user_id: str):
+    # Only the user themselves (or an admin) may change their data
+    if admin_forbidden(request) is None:
+        return None
+    uid = verified_uid(request.headers.get("authorization"))
+    if uid is None:
+        return JSONResponse(status_code=401, content={"error": "A valid ID token is required"})
+    if not hmac.compare_digest(uid, user_id):
+        return JSONResponse(status_code=403, content={"error": "Forbidden"})
+    return None
+
+@app.get("/admin/profiles")
+def admin_profiles(request: Request, limit: int = 20):
+    """Recent request profiles, newest first (requires X-Admin-Token)"""
+    forbidden = admin_forbidden(request)
+    if forbidden:
+        return forbidden
+    return {"profiles": list_profiles(limit=limit)}
+
+@app.get("/admin/profiles/{profile_id}")
+def admin_profile(profile_id: str, request: Request):
+    """CPU and allocation report of one profile (requires X-Admin-Token)"""
+    forbidden = admin_forbidden(request)
+    if forbidden:
+        return forbidden
+    report = read_profile_report(profile_id)
+    if report is None:
+        return JSONResponse(status_code=404, content={"error": f"Profile {profile_id} not found"})
+    return PlainTextResponse(report)
+
+@app.post("/admin/reload")
+def admin_reload(request: Request):
+    """Rebuilds the catalog from the current database file and swaps it in (requires X-Admin-Token)"""
+    forbidden = admin_forbidden(request)
+    if forbidden:
+        return forbidden
+    previous = main.data_version
+    try:
+        reloaded = main.reload_data()
+    except ReloadInProgress as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
+    except Exception as e:
+        print(f"❌ Data reload failed: {e}")
+        return JSONResponse(status_code=500, content={"error": f"Reload failed: {e}"})
+    return {
+        "reloaded": reloaded,
+        "version": main.data_version.version,
+        "previous": previous.version if previous is not None else None,
+    }
@@ -0,0 +1,96 @@
+import os
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from result_cache import result_key
+
+# Off by default: every worker re-ranks its popular preferences through the LLM each interval, traffic or not
+WARMER_ENABLED = os.getenv("WARMER_ENABLED", "false").lower() == "true"
+WARMER_TOP_N = int(os.getenv("WARMER_TOP_N", "20"))
+WARMER_INTERVAL = int(os.getenv("WARMER_INTERVAL", "600"))
+WARMER_CONCURRENCY = int(os.getenv("WARMER_CONCURRENCY", "2"))
+# Optional JSON list of Preferences payloads that are always warmed
+WARM_PRESETS_FILE = os.getenv("WARM_PRESETS_FILE")
+
+
+def load_presets(path):
+    if not path or not os.path.exists(path):
+        return []
+    try:
+        with open(path) as f:
+            presets = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read warm presets {path}: {e}")
+        return []
+    return [p for p in presets if isinstance(p, dict)]
+
+
+class CacheWarmer:
+    """
+    Precomputes rankings for the configured presets and the most requested
+    preference combinations, at startup and then every `interval` seconds.
+
+    `warm` computes and stores one payload, `sources` are callables
+    returning lists of payloads (presets first, then popularity order).
+    """
+
+    def __init__(self, warm, sources, result_cache, top_n=WARMER_TOP_N,
+                 interval=WARMER_INTERVAL, concurrency=WARMER_CONCURRENCY):
+        self.warm = warm
+        self.sources = sources
+        self.result_cache = result_cache
+        self.top_n = top_n
+        self.interval = interval
+        self.concurrency = concurrency
+        self._stop = threading.Event()
+        self._thread = None
+
+    def payloads(self):
+        """Distinct payloads to warm, at most top_n"""
+        seen, payloads = set(), []
+        for source in self.sources:
+            for payload in source():
+                key = result_key(payload)
+                if key not in seen:
+                    seen.add(key)
+                    payloads.append(payload)
+        return payloads[:self.top_n]
+
+    def _warm_one(self, payload):
+        try:
+            self.warm(payload)
+            metrics.incr("warmer.warmed")
+        except Exception as e:
+            metrics.incr("warmer.failed")
+            print(f"❌ Warming {payload} failed: {e}")
+
+    def run_once(self):
+        started = time.monotonic()
+        # Entries that outlive the next run do not need another AI call yet
+        due = [p for p in self.payloads()
+               if (self.result_cache.ttl_left(result_key(p)) or 0) <= self.interval]
+        if due:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                list(pool.map(self._warm_one, due))
+        metrics.observe("warmer.run", time.monotonic() - started)
+        print(f"WARMER -> Warmed {len(due)} preference combinations")
+        return len(due)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Cache warmer run failed: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
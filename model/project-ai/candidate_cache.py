@@ -0,0 +1,132 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+CANDIDATE_CACHE_TTL = int(os.getenv("CANDIDATE_CACHE_TTL", "900"))
+CANDIDATE_CACHE_MAX_MB = float(os.getenv("CANDIDATE_CACHE_MAX_MB", "64"))
+
+
+def retrieval_key(request_json):
+    # Only the fields that change the SQL query / filter pass belong here,
+    # number_recommended and previous_ids are applied after retrieval.
+    genres = request_json.get("selected_genres") or []
+    return (
+        request_json.get("mood"),
+        request_json.get("preferred_length"),
+        request_json.get("language"),
+        request_json.get("country"),
+        request_json.get("era"),
+        bool(request_json.get("popularity", True)),
+        tuple(sorted(genres)),
+    )
+
+
+class CandidateEntry:
+    __slots__ = ("key", "frame", "complete", "size", "expires_at", "ranking", "version")
+
+    def __init__(self, key, frame, complete, size, expires_at, version=None):
+        self.key = key
+        # Data version the candidates were retrieved from
+        self.version = version
+        self.frame = frame
+        # False when the frame is only the top of a longer candidate list
+        self.complete = complete
+        self.size = size
+        self.expires_at = expires_at
+        # AI ordering of the top candidates, when the whole window was ranked at once
+        self.ranking = None
+
+
+class CandidateCache:
+    """
+    Keeps the filtered, ordered candidate list of a recommendation session
+    behind an opaque cursor so "more results" requests can skip retrieval.
+
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the total frame size goes over `max_bytes`.
+    """
+
+    def __init__(self, ttl=CANDIDATE_CACHE_TTL, max_bytes=int(CANDIDATE_CACHE_MAX_MB * 1024**2)):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+    def put(self, key, frame, complete=True, version=None):
+        size = int(frame.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return None
+
+        cursor = secrets.token_urlsafe(16)
+        entry = CandidateEntry(key, frame, complete, size, time.monotonic() + self.ttl, version)
+
+        with self._lock:
+            self._entries[cursor] = entry
+            self._bytes += size
+            self._evict()
+
+        return cursor
+
+    def get(self, cursor, key, version=None):
+        if not cursor:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(cursor)
+            if entry is None:
+                return None
+
+            if entry.expires_at <= time.monotonic():
+                self._remove(cursor)
+                return None
+
+            # A cursor is only valid for the preferences it was issued for
+            if entry.key != key:
+                return None
+
+            # Candidates of a replaced data version, put by a request that spanned the reload
+            if entry.version != version:
+                self._remove(cursor)
+                return None
+
+            entry.expires_at = time.monotonic() + self.ttl
+            self._entries.move_to_end(cursor)
+            return entry
+
+    def set_ranking(self, cursor, ranking):
+        with self._lock:
+            entry = self._entries.get(cursor)
+            if entry is not None:
+                entry.ranking = list(ranking)
+
+    def discard(self, cursor):
+        with self._lock:
+            if cursor in self._entries:
+                self._remove(cursor)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, cursor):
+        entry = self._entries.pop(cursor)
+        self._bytes -= entry.size
+
+    def _evict(self):
+        now = time.monotonic()
+        for cursor in [c for c, e in self._entries.items() if e.expires_at <= now]:
+            self._remove(cursor)
+
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
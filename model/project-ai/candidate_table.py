@@ -0,0 +1,195 @@
+import os
+import time
+import numpy as np
+from filter_utils import MOOD_TO_GENRES, wanted_genre_set
+from sql_utils import runtime_range
+from catalog import MAX_GENRE_BITS
+
+MATERIALIZED_TOP_N = int(os.getenv("MATERIALIZED_TOP_N", "100"))
+MATERIALIZED_LANGUAGES = int(os.getenv("MATERIALIZED_LANGUAGES", "3"))
+
+# Free time options offered on the Preferences page
+LENGTH_BUCKETS = [60, 90, 120, 150, 180]
+
+ERAS = ["old", "actual", "new"]
+
+
+def era_mask(year, era):
+    # Mirrors the year conditions of build_sql_query, NULL years never match
+    if era == "old":
+        return year <= 1990
+    if era == "actual":
+        return (year > 1990) & (year <= 2020)
+    if era == "new":
+        return year > 2020
+    return np.ones(len(year), dtype=bool)
+
+
+class CandidateTable:
+    """
+    Ordered top-N candidate ids for common mood/genre/era/language/length
+    combinations, stored as one flat id array plus a dict of slices.
+    """
+
+    def __init__(self, entries, ids, genre_bits, all_genres, languages):
+        self.entries = entries
+        self.ids = ids
+        self.genre_bits = genre_bits
+        self.all_genres = all_genres
+        self.languages = languages
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes
+
+    def make_key(self, request_json):
+        if request_json.get("country"):
+            return None
+
+        preferred_length = request_json.get("preferred_length") or None
+        if preferred_length is not None and preferred_length not in LENGTH_BUCKETS:
+            return None
+
+        language = request_json.get("language") or None
+        if language is not None and language not in self.languages:
+            return None
+
+        era = request_json.get("era")
+        if era not in ERAS:
+            era = None
+
+        wanted = wanted_genre_set(request_json.get("mood"), request_json.get("selected_genres"))
+        # Genres that no movie has can never match, they only matter when
+        # nothing else is wanted (then the genre filter removes every row)
+        known = {g for g in wanted if g in self.all_genres}
+        if wanted and not known:
+            return None
+
+        bits = 0
+        for genre in known:
+            if genre not in self.genre_bits:
+                return None
+            bits |= self.genre_bits[genre]
+
+        mainstream = bool(request_json.get("popularity", True))
+        return bits, preferred_length, language, era, mainstream
+
+    def lookup(self, request_json):
+        """Returns (ordered ids, complete) or None when the combination is not materialized"""
+        key = self.make_key(request_json)
+        if key is None or key not in self.entries:
+            return None
+
+        start, stop, complete = self.entries[key]
+        return self.ids[start:stop], complete
+
+    def to_arrays(self):
+        """Flat arrays for the catalog files plus the json-able part"""
+        keys = list(self.entries)
+        languages = sorted(self.languages)
+        lang_codes = {lang: i for i, lang in enumerate(languages)}
+        arrays = {
+            "candidates_ids": self.ids,
+            "candidates_bits": np.array([k[0] for k in keys], dtype=np.int64),
+            "candidates_length": np.array([k[1] or 0 for k in keys], dtype=np.int16),
+            "candidates_language": np.array([-1 if k[2] is None else lang_codes[k[2]] for k in keys], dtype=np.int16),
+            "candidates_era": np.array([0 if k[3] is None else ERAS.index(k[3]) + 1 for k in keys], dtype=np.int8),
+            "candidates_mainstream": np.array([k[4] for k in keys], dtype=bool),
+            "candidates_slices": np.array([self.entries[k] for k in keys], dtype=np.int32).reshape(-1, 3),
+        }
+        return arrays, {"languages": languages, "genre_bits": self.genre_bits}
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """Rebuilds the lookup dict from the arrays stored in a catalog"""
+        meta = catalog.meta.get("candidates")
+        if meta is None:
+            return None
+
+        languages = meta["languages"]
+        entries = {}
+        columns = zip(catalog.candidates_bits.tolist(), catalog.candidates_length.tolist(),
+                      catalog.candidates_language.tolist(), catalog.candidates_era.tolist(),
+                      catalog.candidates_mainstream.tolist(), catalog.candidates_slices.tolist())
+        for bits, length, lang, era, mainstream, (start, stop, complete) in columns:
+            key = (bits, length or None, None if lang < 0 else languages[lang],
+                   None if era == 0 else ERAS[era - 1], mainstream)
+            entries[key] = (start, stop, bool(complete))
+
+        return cls(entries, catalog.candidates_ids, meta["genre_bits"], set(catalog.genres), set(languages))
+
+
+def build_candidate_table(catalog, top_n=MATERIALIZED_TOP_N, n_languages=MATERIALIZED_LANGUAGES):
+    started = time.perf_counter()
+
+    has_genres = np.diff(catalog.genre_offsets) > 0
+    row_bits = np.asarray(catalog.genre_bits)
+    genre_bits = {genre: 1 << code for code, genre in enumerate(catalog.genres)
+                  if code < MAX_GENRE_BITS}
+
+    ids = np.asarray(catalog.ids)
+    popularity = np.asarray(catalog.popularity, dtype=np.float64)
+    runtime = np.asarray(catalog.runtime, dtype=np.float64)
+    year = np.asarray(catalog.year, dtype=np.float64)
+    language_codes = np.asarray(catalog.language_codes)
+
+    # Language vocabulary is ordered by movie count, most common first
+    languages = list(catalog.languages[:n_languages])
+
+    # Every mood alone, every genre alone and every mood plus one extra genre
+    genre_sets = set()
+    moods = [None] + list(MOOD_TO_GENRES)
+    for mood in moods:
+        for extra in [None] + list(genre_bits):
+            wanted = wanted_genre_set(mood, [extra] if extra else None) & set(genre_bits)
+            genre_sets.add(sum(genre_bits[g] for g in wanted))
+
+    entries = {}
+    chunks = []
+    offset = 0
+
+    for preferred_length in [None] + LENGTH_BUCKETS:
+        if preferred_length is None:
+            length_mask = np.ones(len(ids), dtype=bool)
+        else:
+            min_time, max_time = runtime_range(preferred_length)
+            length_mask = (runtime >= min_time) & (runtime <= max_time)
+
+        for lang in [None] + languages:
+            if lang is None:
+                lang_mask = length_mask
+            else:
+                lang_mask = length_mask & (language_codes == catalog.languages.index(lang))
+
+            for era in [None] + ERAS:
+                rows = np.flatnonzero(has_genres & lang_mask & era_mask(year, era))
+                slice_bits = row_bits[rows]
+
+                for bits in genre_sets:
+                    selected = rows if bits == 0 else rows[(slice_bits & bits) != 0]
+
+                    for mainstream in (True, False):
+                        if selected.size:
+                            pop = popularity[selected]
+                            if mainstream:
+                                chosen = selected[pop >= np.nanquantile(pop, 0.7)]
+                            else:
+                                chosen = selected[pop <= np.nanquantile(pop, 0.3)]
+                        else:
+                            chosen = selected
+
+                        top = ids[chosen[:top_n]]
+                        chunks.append(top)
+                        key = (bits, preferred_length, lang, era, mainstream)
+                        entries[key] = (offset, offset + len(top), len(chosen) <= top_n)
+                        offset += len(top)
+
+    flat = np.concatenate(chunks).astype(np.int32) if chunks else np.empty(0, dtype=np.int32)
+    table = CandidateTable(entries, flat, genre_bits, set(catalog.genres), set(languages))
+
+    print(f"CANDIDATES -> Materialized {len(table)} combinations "
+          f"({table.nbytes / 1024**2:.2f} MB) in {time.perf_counter() - started:.1f}s")
+    return table
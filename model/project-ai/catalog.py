@@ -0,0 +1,343 @@
+"""
+Columnar, memory-mapped copy of the movies table.
+
+The catalog is written once as plain .npy files (numeric columns, encoded
+genre/country/language/director data and utf-8 string blobs with offsets)
+and every worker attaches to it with np.load(mmap_mode="r"). The arrays live
+in the OS page cache, so running more uvicorn/gunicorn workers does not add
+another copy of the data per process.
+
+Build it as a prestart step before forking workers:
+
+    python catalog.py && gunicorn -w 4 -k uvicorn.workers.UvicornWorker app:app
+
+Workers that start without a built catalog build it themselves, the first
+one to finish publishes it and the others reuse that copy.
+"""
+import os
+import json
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import numpy as np
+import pandas as pd
+from filter_utils import safe_parse_list
+from mood_affinity import MOODS, affinity_matrix, mood_column
+from taste_profiles import taste_features
+from overview_store import OverviewStore
+from sql_utils import MOVIE_COLUMNS, RETRIEVAL_COLUMNS
+from title_index import build_title_index, search_prefix
+
+DB_PATH = "datasets/movie_dataset.db"
+CATALOG_DIR = os.getenv("CATALOG_DIR", "datasets/catalog")
+# Bumped when the set of arrays changes, so catalogs built by older code are rebuilt
+CATALOG_FORMAT = 4
+
+STRING_COLUMNS = ["title", "overview", "poster_path", "release_date"]
+
+# The genre bitmask is an int64, so only the most common genres get a bit
+MAX_GENRE_BITS = 63
+
+
+def read_movies(conn):
+    store = OverviewStore.open(conn)
+    columns = MOVIE_COLUMNS if store is None else RETRIEVAL_COLUMNS
+    # Same ordering as build_sql_query so row slices keep the SQL candidate order
+    query = f"SELECT {columns} FROM movies ORDER BY popularity DESC, imdb_rating DESC"
+    movies = pd.read_sql_query(query, conn)
+    if store is not None:
+        movies = store.attach(conn, movies)
+    return movies
+
+
+def file_version(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _encode_strings(values):
+    encoded = [("" if v is None or v is pd.NA or (isinstance(v, float) and np.isnan(v)) else str(v)).encode("utf-8")
+               for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8).copy()
+    return blob, offsets
+
+
+def _vocabulary(values):
+    counts = pd.Series(values, dtype=object).value_counts()
+    # Most common first, ties by name so rebuilds give the same codes
+    return sorted(counts.index, key=lambda v: (-counts[v], v))
+
+
+def _encode_lists(lists, vocab):
+    index = {value: code for code, value in enumerate(vocab)}
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(items) for items in lists], out=offsets[1:])
+    codes = np.fromiter((index[item] for items in lists for item in items), dtype=np.int16, count=int(offsets[-1]))
+    return codes, offsets
+
+
+def encode_catalog(frame):
+    genres = frame["genres"].astype(object).apply(safe_parse_list).tolist()
+    countries = frame["production_countries"].astype(object).apply(safe_parse_list).tolist()
+
+    genre_vocab = _vocabulary([g for items in genres for g in items])
+    country_vocab = _vocabulary([c for items in countries for c in items])
+    language_vocab = _vocabulary(frame["original_language"].dropna().tolist())
+    director_vocab = _vocabulary(frame["director"].dropna().tolist())
+
+    arrays = {
+        "ids": frame["id"].to_numpy(dtype=np.int64),
+        "popularity": frame["popularity"].to_numpy(dtype=np.float32),
+        "imdb_rating": frame["imdb_rating"].to_numpy(dtype=np.float32),
+        "runtime": pd.to_numeric(frame["runtime"]).to_numpy(dtype=np.float32, na_value=np.nan),
+        "year": pd.to_numeric(frame["year"]).to_numpy(dtype=np.float32, na_value=np.nan),
+    }
+
+    language_index = {value: code for code, value in enumerate(language_vocab)}
+    arrays["language_codes"] = np.array([language_index.get(v, -1) for v in frame["original_language"]],
+                                        dtype=np.int16)
+
+    director_index = {value: code for code, value in enumerate(director_vocab)}
+    arrays["director_codes"] = np.array([director_index.get(v, -1) for v in frame["director"]], dtype=np.int32)
+    arrays["director_vocab_blob"], arrays["director_vocab_offsets"] = _encode_strings(director_vocab)
+
+    arrays["genre_codes"], arrays["genre_offsets"] = _encode_lists(genres, genre_vocab)
+    arrays["country_codes"], arrays["country_offsets"] = _encode_lists(countries, country_vocab)
+
+    genre_index = {value: code for code, value in enumerate(genre_vocab)}
+    genre_bits = np.zeros(len(genres), dtype=np.int64)
+    for row, items in enumerate(genres):
+        for genre in items:
+            code = genre_index[genre]
+            if code < MAX_GENRE_BITS:
+                genre_bits[row] |= np.int64(1) << np.int64(code)
+    arrays["genre_bits"] = genre_bits
+
+    # Per-mood affinity from genres, overview keywords and rating, used to order candidates
+    arrays["mood_affinity"] = affinity_matrix(genres, frame["overview"].tolist(), frame["imdb_rating"].tolist())
+    # Hashed genre/language/era/director/word features that user taste vectors are scored against
+    years = pd.to_numeric(frame["year"]).astype("float64").tolist()
+    arrays["taste_features"] = taste_features(genres, frame["original_language"].tolist(), years,
+                                              frame["director"].tolist(), frame["overview"].tolist())
+
+    for column in STRING_COLUMNS:
+        arrays[f"{column}_blob"], arrays[f"{column}_offsets"] = _encode_strings(frame[column].tolist())
+
+    # Title prefix search for autocomplete
+    arrays["title_keys"], arrays["title_key_rows"] = build_title_index(frame["title"].tolist())
+
+    # id -> row lookup through binary search on the sorted ids
+    order = np.argsort(arrays["ids"], kind="stable")
+    arrays["id_sorted"] = arrays["ids"][order]
+    arrays["id_rows"] = order.astype(np.int64)
+
+    meta = {
+        "rows": len(frame),
+        "genres": genre_vocab,
+        "countries": country_vocab,
+        "languages": language_vocab,
+        "moods": MOODS,
+    }
+    return arrays, meta
+
+
+class Catalog:
+    """Read-only view over the catalog arrays, either in memory or memory-mapped"""
+
+    def __init__(self, arrays, meta, path=None):
+        self.arrays = arrays
+        self.meta = meta
+        self.path = path
+        self.version = meta.get("version")
+        self.genres = meta["genres"]
+        self.countries = meta["countries"]
+        self.languages = meta["languages"]
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def __getattr__(self, name):
+        arrays = self.__dict__.get("arrays", {})
+        if name in arrays:
+            return arrays[name]
+        raise AttributeError(name)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def rows_for_ids(self, ids):
+        """Row positions for the given ids, -1 for ids not in the catalog"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.id_sorted):
+            return np.full(len(ids), -1, dtype=np.int64)
+
+        pos = np.searchsorted(self.id_sorted, ids).clip(0, len(self.id_sorted) - 1)
+        return np.where(self.id_sorted[pos] == ids, self.id_rows[pos], -1)
+
+    def mood_affinity_of(self, ids, mood):
+        """float32 affinity of each id to a mood, None for unknown moods, -1 for ids not in the catalog"""
+        column = mood_column(mood, self.meta.get("moods", []))
+        if column is None:
+            return None
+        rows = self.rows_for_ids(ids)
+        if not len(self):
+            return np.full(len(rows), -1, dtype=np.float32)
+        scores = np.asarray(self.mood_affinity[rows.clip(0), column], dtype=np.float32)
+        return np.where(rows >= 0, scores, np.float32(-1))
+
+    def taste_scores(self, ids, taste):
+        """Dot product of each id's taste features with a user vector, 0 for ids not in the catalog"""
+        rows = self.rows_for_ids(ids)
+        if not len(self):
+            return np.zeros(len(rows), dtype=np.float32)
+        scores = np.asarray(self.taste_features[rows.clip(0)] @ np.asarray(taste, dtype=np.float32))
+        return np.where(rows >= 0, scores, np.float32(0))
+
+    def _string(self, blob, offsets, index):
+        return bytes(blob[offsets[index]:offsets[index + 1]]).decode("utf-8")
+
+    def text(self, column, row):
+        return self._string(self.arrays[f"{column}_blob"], self.arrays[f"{column}_offsets"], row)
+
+    def genres_of(self, row):
+        codes = self.genre_codes[self.genre_offsets[row]:self.genre_offsets[row + 1]]
+        return [self.genres[c] for c in codes]
+
+    def countries_of(self, row):
+        codes = self.country_codes[self.country_offsets[row]:self.country_offsets[row + 1]]
+        return [self.countries[c] for c in codes]
+
+    def language_of(self, row):
+        code = self.language_codes[row]
+        return self.languages[code] if code >= 0 else None
+
+    def director_of(self, row):
+        code = self.director_codes[row]
+        if code < 0:
+            return None
+        return self._string(self.director_vocab_blob, self.director_vocab_offsets, code)
+
+    def autocomplete(self, prefix, limit=10):
+        """Rows of the most popular movies whose title starts with prefix"""
+        return search_prefix(self.title_keys, self.title_key_rows, prefix, limit)
+
+    def suggestion(self, row):
+        """Short record for autocomplete results"""
+        year = float(self.year[row])
+        poster_path = self.text("poster_path", row)
+        return {
+            "id": int(self.ids[row]),
+            "title": self.text("title", row),
+            "year": None if np.isnan(year) else int(year),
+            "poster": f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None,
+        }
+
+    def record(self, row):
+        runtime = float(self.runtime[row])
+        year = float(self.year[row])
+        poster_path = self.text("poster_path", row)
+        return {
+            "id": int(self.ids[row]),
+            "title": self.text("title", row),
+            "overview": self.text("overview", row),
+            "genres": self.genres_of(row),
+            "production_countries": self.countries_of(row),
+            "popularity": round(float(self.popularity[row]), 2),
+            "imdb_rating": round(float(self.imdb_rating[row]), 2),
+            "runtime": None if np.isnan(runtime) else int(runtime),
+            "year": None if np.isnan(year) else int(year),
+            "original_language": self.language_of(row),
+            "director": self.director_of(row),
+            "release_date": self.text("release_date", row),
+            "poster": f"https://image.tmdb.org/t/p/w500{poster_path}" if poster_path else None,
+        }
+
+
+def catalog_from_connection(conn):
+    arrays, meta = encode_catalog(read_movies(conn))
+    return Catalog(arrays, meta)
+
+
+def save_arrays(arrays, path):
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def load_arrays(path, names):
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in names}
+
+
+def build_catalog(db_path=DB_PATH, catalog_dir=CATALOG_DIR, materialize=True):
+    """
+    Writes the catalog for the database at db_path (unless that version is
+    already built) and points catalog_dir/CURRENT at it. Returns its path.
+    """
+    from candidate_table import build_candidate_table
+
+    version = file_version(db_path)
+    os.makedirs(catalog_dir, exist_ok=True)
+    build = f"{version}-f{CATALOG_FORMAT}"
+    target = os.path.join(catalog_dir, build)
+
+    if not os.path.exists(os.path.join(target, "meta.json")):
+        print(f"CATALOG -> Building catalog {version} from {db_path}...")
+        conn = sqlite3.connect(db_path)
+        try:
+            arrays, meta = encode_catalog(read_movies(conn))
+        finally:
+            conn.close()
+        meta["version"] = version
+
+        if materialize:
+            table = build_candidate_table(Catalog(arrays, meta))
+            table_arrays, meta["candidates"] = table.to_arrays()
+            arrays.update(table_arrays)
+
+        meta["arrays"] = sorted(arrays)
+        tmp = tempfile.mkdtemp(dir=catalog_dir, prefix=".build-")
+        save_arrays(arrays, tmp)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Another worker published the same version first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    pointer = os.path.join(catalog_dir, f".CURRENT-{os.getpid()}")
+    with open(pointer, "w") as f:
+        f.write(build)
+    os.replace(pointer, os.path.join(catalog_dir, "CURRENT"))
+    return target
+
+
+def open_catalog(path):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = load_arrays(path, meta["arrays"])
+    catalog = Catalog(arrays, meta, path)
+    print(f"CATALOG -> Attached catalog {catalog.version} ({len(catalog)} movies, "
+          f"{catalog.nbytes / 1024**2:.2f} MB mapped)")
+    return catalog
+
+
+def current_catalog_path(catalog_dir=CATALOG_DIR):
+    try:
+        with open(os.path.join(catalog_dir, "CURRENT")) as f:
+            return os.path.join(catalog_dir, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    path = build_catalog()
+    catalog = open_catalog(path)
+    print(f"Catalog ready at {path}")
@@ -1,6 +1,7 @@
 import pandas as pd
 import sqlite3
 import os
+from overview_store import migrate as migrate_overviews
 
 # Read the CSV with optimized dtypes
 print("Reading CSV with optimized data types...")
@@ -52,6 +53,11 @@ data_without_combined = data.drop(columns=['combined'], errors='ignore')
 
 data_without_combined.to_sql('movies', conn, if_exists='replace', index=True, index_label='id')
 
+# Move overviews to their own table, zlib compressed with a shared dictionary,
+# retrieval only reads them for the final candidates
+print("Compressing overviews into movie_overviews...")
+migrate_overviews(conn)
+
 # Create indexes for faster queries
 print("Creating indexes...")
 conn.execute('CREATE INDEX IF NOT EXISTS idx_year ON movies(year)')
@@ -86,4 +92,5 @@ print(f"CSV size:      {os.path.getsize('datasets/movie_dataset.csv') / 1024**2:
 print(f"Database size: {os.path.getsize(db_path) / 1024**2:.2f} MB")
 print(f"Space saved:   {(os.path.getsize('datasets/movie_dataset.csv') - os.path.getsize(db_path)) / 1024**2:.2f} MB")
 print(f"\nNote: 'combined' column excluded to save space.")
-print(f"It will be reconstructed on-the-fly when needed.")
\ No newline at end of file
+print(f"It will be reconstructed on-the-fly when needed.")
+print(f"Overviews are stored compressed in the movie_overviews table.")
\ No newline at end of file
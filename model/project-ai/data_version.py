@@ -0,0 +1,197 @@
+"""
+Everything the service derives from one movie database file (catalog,
+materialized candidates, facet bitmaps, overview store, partitions) kept
+behind a single reference that is swapped when the data is refreshed.
+
+Requests pin the version that was active when they started and read its
+database through a hard link inside its catalog directory, so replacing
+datasets/movie_dataset.db does not change what they see. A replaced
+version is released once the last request pinned to it has finished, and
+its catalog build (with the pinned database) is deleted unless it is still
+the current build.
+
+Workers sharing one catalog directory should reload together (RELOAD_WATCH)
+since a released build is deleted for all of them.
+
+Refresh the data by moving a new database file into place (an atomic
+rename, not a copy over the old file) and either wait for the watcher
+(RELOAD_WATCH=true) or call POST /admin/reload.
+"""
+import os
+import gc
+import shutil
+import threading
+
+from catalog import current_catalog_path
+from metrics import metrics
+
+# Poll the database file and reload when it changes
+RELOAD_WATCH = os.getenv("RELOAD_WATCH", "false").lower() == "true"
+RELOAD_POLL_INTERVAL = float(os.getenv("RELOAD_POLL_INTERVAL", "30"))
+
+# Hard link of the database kept inside each catalog build
+PINNED_DB_NAME = "movies.db"
+
+
+class ReloadInProgress(Exception):
+    pass
+
+
+class DataVersion:
+    """One database file and the indexes built from it, reference counted by requests"""
+
+    def __init__(self, db_path, version, catalog=None, candidate_table=None, facet_index=None,
+                 overview_store=None, movie_partitions=None, build_dir=None):
+        self.db_path = db_path
+        # Catalog build this version owns, deleted with it
+        self.build_dir = build_dir
+        self.version = version
+        self.catalog = catalog
+        self.candidate_table = candidate_table
+        self.facet_index = facet_index
+        self.overview_store = overview_store
+        self.movie_partitions = movie_partitions
+        self.active = 0
+        self.retired = False
+        self.released = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.active += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+            drained = self.retired and self.active == 0
+        if drained:
+            self._free()
+
+    def retire(self):
+        """Marks the version replaced, it is freed as soon as no request uses it"""
+        with self._lock:
+            self.retired = True
+            drained = self.active == 0
+        if drained:
+            self._free()
+        else:
+            print(f"RELOAD -> Draining data version {self.version} ({self.active} requests in flight)")
+
+    def _free(self):
+        with self._lock:
+            if self.released:
+                return
+            self.released = True
+        if self.movie_partitions is not None:
+            self.movie_partitions.close()
+        # Dropping the last references unmaps the catalog arrays
+        self.catalog = self.candidate_table = self.facet_index = None
+        self.overview_store = self.movie_partitions = None
+        gc.collect()
+        if self.build_dir is not None:
+            remove_build(self.build_dir)
+        metrics.incr("reload.released")
+        print(f"RELOAD -> Released data version {self.version}")
+
+
+def remove_build(build_dir):
+    """Deletes a replaced catalog build and its pinned database, unless it is the current build again"""
+    current = current_catalog_path(os.path.dirname(build_dir))
+    if current is not None and os.path.realpath(current) == os.path.realpath(build_dir):
+        return False
+    # Open mappings and connections keep the unlinked files readable until they are closed
+    shutil.rmtree(build_dir, ignore_errors=True)
+    metrics.incr("reload.builds_removed")
+    print(f"RELOAD -> Removed catalog build {build_dir}")
+    return True
+
+
+def snapshot_database(db_path, directory):
+    """
+    Hard link of db_path under a private name in directory, taken before the
+    build so the catalog and the pinned file are made from the same file
+    even if a new one is moved in meanwhile. None when linking is not
+    possible, e.g. across filesystems.
+    """
+    os.makedirs(directory, exist_ok=True)
+    staged = os.path.join(directory, f".db-{os.getpid()}-{threading.get_ident()}")
+    try:
+        os.link(db_path, staged)
+    except OSError as e:
+        print(f"❌ Could not snapshot database {db_path}: {e}")
+        return None
+    return staged
+
+
+def pin_database(staged, directory):
+    """Moves a snapshot into its catalog build, returns the path requests read from"""
+    pinned = os.path.join(directory, PINNED_DB_NAME)
+    if os.path.exists(pinned):
+        # Pinned by another worker, same content since the build is keyed by its hash
+        os.remove(staged)
+    else:
+        os.replace(staged, pinned)
+    return pinned
+
+
+def file_signature(path):
+    """Cheap change check for the watcher, None while the file is missing"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class DatabaseWatcher:
+    """
+    Calls `reload()` when the database file changes. A change is only acted
+    on once the file looked the same on two polls in a row, so a file that
+    is still being written is not loaded half way.
+    """
+
+    def __init__(self, path, reload, interval=RELOAD_POLL_INTERVAL):
+        self.path = path
+        self.reload = reload
+        self.interval = interval
+        self._seen = file_signature(path)
+        self._pending = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """Checks the file once, True when a reload was triggered"""
+        signature = file_signature(self.path)
+        if signature is None or signature == self._seen:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            # Changed since the last poll, wait for it to settle
+            self._pending = signature
+            return False
+
+        previous, self._seen = self._seen, signature
+        self._pending = None
+        try:
+            self.reload()
+        except ReloadInProgress:
+            # Try again on the next poll
+            self._seen = previous
+            return False
+        except Exception as e:
+            print(f"❌ Data reload failed: {e}")
+            return False
+        return True
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from metrics import metrics
+
+# Seconds a /recommend request may take end to end before it is abandoned
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+# SQLite virtual machine steps between cancellation checks of a running query
+SQLITE_CHECK_STEPS = int(os.getenv("SQLITE_CHECK_STEPS", "10000"))
+# How often a blocked wait looks for a cancellation
+CANCEL_POLL_INTERVAL = 0.1
+# Keep above LLM_MAX_CONCURRENCY: abandoned model calls hold a worker until they return
+CANCEL_WORKERS = int(os.getenv("CANCEL_WORKERS", "16"))
+
+DEADLINE = "deadline"
+DISCONNECTED = "disconnected"
+
+# Blocking calls that can be abandoned run here instead of on the request thread
+_pool = ThreadPoolExecutor(max_workers=CANCEL_WORKERS)
+
+
+class Cancelled(Exception):
+    def __init__(self, reason):
+        super().__init__("Request deadline exceeded" if reason == DEADLINE else "Client disconnected")
+        self.reason = reason
+
+
+class Deadline:
+    """
+    Deadline and cancellation signal of one request, checked between
+    pipeline stages and inside long SQLite queries and model calls.
+    """
+
+    def __init__(self, timeout=REQUEST_TIMEOUT):
+        self.expires = time.monotonic() + timeout if timeout else None
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason=DISCONNECTED):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    def remaining(self):
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def cancelled(self):
+        if not self._cancelled.is_set() and self.expires is not None and time.monotonic() >= self.expires:
+            self.cancel(DEADLINE)
+        return self._cancelled.is_set()
+
+    def check(self, stage=""):
+        if self.cancelled:
+            metrics.incr(f"requests.cancelled.{self.reason}")
+            print(f"CANCELLED -> {self.reason} before {stage or 'next stage'}")
+            raise Cancelled(self.reason)
+
+    @contextmanager
+    def sqlite(self, conn, steps=SQLITE_CHECK_STEPS):
+        """Interrupts queries on conn once the request is cancelled"""
+        conn.set_progress_handler(lambda: 1 if self.cancelled else 0, steps)
+        try:
+            yield conn
+        except Exception:
+            # sqlite3 raises OperationalError("interrupted"), pandas wraps it in its own DatabaseError
+            if self.cancelled:
+                self.check("end of query")
+            raise
+        finally:
+            conn.set_progress_handler(None, steps)
+
+    def wait(self, future):
+        """Result of future, raising Cancelled as soon as the request is"""
+        while True:
+            self.check("result")
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL)
+            except FutureTimeout:
+                continue
+
+    def submit(self, func, *args, **kwargs):
+        """Starts func on the cancellation pool unless the request is already cancelled"""
+        self.check(getattr(func, "__name__", "call"))
+        return _pool.submit(func, *args, **kwargs)
+
+    def call(self, func, *args, **kwargs):
+        """Runs func on the cancellation pool, the request stops waiting when cancelled"""
+        return self.wait(self.submit(func, *args, **kwargs))
@@ -0,0 +1,215 @@
+"""
+Write-behind log of /recommend requests: preferences, retrieved and ranked
+candidates, the model's answer and per-stage timings.
+
+recommend_movies only puts a dict on a bounded in-process queue, a writer
+thread flushes the queue in batches to SQLite. When the writer falls behind
+and the queue is full, events are dropped and counted instead of slowing
+requests down.
+"""
+import os
+import json
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+# Off by default: the log keeps preferences and model answers of every request for EVENT_RETENTION_DAYS
+EVENT_LOG_ENABLED = os.getenv("EVENT_LOG_ENABLED", "false").lower() == "true"
+EVENT_LOG_DB = os.getenv("EVENT_LOG_DB", "logs/recommend_events.db")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "10000"))
+# Events per INSERT transaction, and the longest an event waits for a batch to fill
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "200"))
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "1.0"))
+EVENT_RETENTION_DAYS = float(os.getenv("EVENT_RETENTION_DAYS", "14"))
+# How far back the cache warmer looks for popular preferences
+EVENT_WARM_WINDOW = float(os.getenv("EVENT_WARM_WINDOW", str(24 * 3600)))
+
+COLUMNS = ["ts", "user_id", "preferences", "first_page", "outcome", "source", "retrieved",
+           "candidates", "returned", "llm_response", "stages", "total_ms", "error"]
+# Stored as JSON text
+JSON_COLUMNS = {"preferences", "candidates", "returned", "stages"}
+
+# Seconds between deletions of events older than the retention
+PRUNE_INTERVAL = 3600
+
+# Queued by stop() to wake the writer
+_STOP = object()
+
+
+def user_key(user_id):
+    """Pseudonymous stand-in for a uid, the same user always gets the same key"""
+    if not user_id:
+        return None
+    return hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()[:16]
+
+
+class Trace:
+    """Stage timings and details of one request, filled in as it runs"""
+
+    def __init__(self):
+        self.started = self._last = time.monotonic()
+        self.stages = {}
+        self.fields = {}
+
+    def mark(self, stage):
+        """Time since the previous mark is booked to `stage`"""
+        now = time.monotonic()
+        self.stages[stage] = round(self.stages.get(stage, 0.0) + now - self._last, 6)
+        self._last = now
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+
+class EventLog:
+    """Bounded queue of events written to SQLite in batches by one background thread"""
+
+    def __init__(self, path=EVENT_LOG_DB, queue_size=EVENT_QUEUE_SIZE, batch_size=EVENT_BATCH_SIZE,
+                 flush_interval=EVENT_FLUSH_INTERVAL, retention_days=EVENT_RETENTION_DAYS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention_days * 86400
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._pruned_at = 0.0
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "ts REAL, user_id TEXT, preferences TEXT, first_page INTEGER, outcome TEXT, source TEXT, "
+            "retrieved INTEGER, candidates TEXT, returned TEXT, llm_response TEXT, stages TEXT, "
+            "total_ms REAL, error TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts)")
+        return conn
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Writes what is queued and stops the writer"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def record(self, event):
+        """Queues one event without blocking, False when it was dropped"""
+        self.start()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            metrics.incr("event_log.dropped")
+            return False
+        metrics.incr("event_log.queued")
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self):
+        """Blocks until every queued event has been written or dropped"""
+        self._queue.join()
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            # Once stopping, only take what is already queued
+            timeout = 0 if self._stop.is_set() else deadline - time.monotonic()
+            try:
+                event = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if event is _STOP:
+                self._queue.task_done()
+                continue
+            batch.append(event)
+        return batch
+
+    def _loop(self):
+        try:
+            conn = self._connect()
+        except (sqlite3.Error, OSError) as e:
+            # Keep draining the queue so it is counted as dropped rather than piling up
+            print(f"❌ Could not open event log {self.path}: {e}")
+            conn = None
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch:
+                    self._write(conn, batch)
+                elif self._stop.is_set():
+                    break
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _write(self, conn, batch):
+        started = time.monotonic()
+        try:
+            if conn is None:
+                raise sqlite3.OperationalError("event log is not open")
+            rows = [tuple(json.dumps(event.get(c), sort_keys=True) if c in JSON_COLUMNS else event.get(c)
+                          for c in COLUMNS) for event in batch]
+            with conn:
+                conn.executemany(f"INSERT INTO events ({', '.join(COLUMNS)}) VALUES "
+                                 f"({', '.join('?' for _ in COLUMNS)})", rows)
+            metrics.incr("event_log.written", len(batch))
+            self._prune(conn)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            metrics.incr("event_log.write_errors")
+            metrics.incr("event_log.dropped", len(batch))
+            print(f"❌ Could not write {len(batch)} recommendation events: {e}")
+        finally:
+            metrics.observe("event_log.flush", time.monotonic() - started)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _prune(self, conn):
+        now = time.time()
+        if now - self._pruned_at < PRUNE_INTERVAL:
+            return
+        self._pruned_at = now
+        with conn:
+            conn.execute("DELETE FROM events WHERE ts < ?", (now - self.retention,))
+
+    def top_preferences(self, n, window=EVENT_WARM_WINDOW):
+        """Most requested first-page preference payloads of the last `window` seconds"""
+        if not os.path.exists(self.path):
+            return []
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                rows = conn.execute(
+                    "SELECT preferences, COUNT(*) AS requests FROM events "
+                    "WHERE first_page = 1 AND ts >= ? AND outcome != 'error' "
+                    "GROUP BY preferences ORDER BY requests DESC LIMIT ?",
+                    (time.time() - window, n),
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"❌ Could not read recommendation events: {e}")
+            return []
+        return [json.loads(preferences) for preferences, _ in rows]
@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from candidate_table import ERAS, LENGTH_BUCKETS, era_mask
+from filter_utils import wanted_genre_set
+from sql_utils import runtime_range
+
+# Filter combinations whose counts are kept, per catalog version
+FACET_CACHE_SIZE = 1024
+
+# Set bits per byte value, for counting rows in packed bitmaps
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def pack(mask):
+    return np.packbits(mask)
+
+
+def count(packed):
+    """Rows set in a packed bitmap (or in each row of a matrix of them)"""
+    return POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+
+def list_bitmaps(codes, offsets, vocab, rows):
+    """One packed bitmap per value of a list column (genres, countries)"""
+    row_of_code = np.repeat(np.arange(rows), np.diff(offsets))
+    bitmaps = np.zeros((len(vocab), rows), dtype=bool)
+    bitmaps[codes, row_of_code] = True
+    return np.packbits(bitmaps, axis=1)
+
+
+class FacetIndex:
+    """
+    Packed per-value bitmaps over the catalog rows, so facet counts under
+    any filter combination are a few AND + popcount passes.
+    """
+
+    def __init__(self, catalog, cache_size=FACET_CACHE_SIZE):
+        rows = len(catalog)
+        self.version = catalog.version
+        self.genres = list(catalog.genres)
+        self.languages = list(catalog.languages)
+        self.countries = list(catalog.countries)
+
+        self.genre_bitmaps = list_bitmaps(catalog.genre_codes, catalog.genre_offsets, self.genres, rows)
+        self.country_bitmaps = list_bitmaps(catalog.country_codes, catalog.country_offsets, self.countries, rows)
+        language_codes = np.asarray(catalog.language_codes)
+        self.language_bitmaps = np.packbits(
+            language_codes[None, :] == np.arange(len(self.languages))[:, None], axis=1)
+
+        year = np.asarray(catalog.year)
+        self.era_bitmaps = np.stack([pack(era_mask(year, era)) for era in ERAS])
+
+        # Kept for preferred lengths between the buckets
+        self.runtime = np.asarray(catalog.runtime)
+        self.length_bitmaps = np.stack([self.runtime_bitmap(length) for length in LENGTH_BUCKETS])
+
+        # filter_dataframe drops movies without genres
+        self.base = pack(np.diff(catalog.genre_offsets) > 0)
+
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def runtime_bitmap(self, preferred_length):
+        # Same BETWEEN bounds as build_sql_query, NaN runtimes never match
+        low, high = runtime_range(preferred_length)
+        return pack((self.runtime >= low) & (self.runtime <= high))
+
+    def _value_bitmap(self, values, bitmaps, value):
+        if value not in values:
+            return None
+        return bitmaps[values.index(value)]
+
+    def filter_bitmaps(self, filters):
+        """Packed bitmap of each active filter, empty for values the catalog does not have"""
+        bitmaps = {}
+
+        wanted = wanted_genre_set(filters.get("mood"), filters.get("selected_genres"))
+        if wanted:
+            codes = [self.genres.index(g) for g in wanted if g in self.genres]
+            bitmaps["genres"] = (np.bitwise_or.reduce(self.genre_bitmaps[codes], axis=0)
+                                 if codes else np.zeros_like(self.base))
+
+        if filters.get("language"):
+            bitmaps["language"] = self._value_bitmap(self.languages, self.language_bitmaps, filters["language"])
+        if filters.get("country"):
+            bitmaps["country"] = self._value_bitmap(self.countries, self.country_bitmaps, filters["country"])
+        if filters.get("era") in ERAS:
+            bitmaps["era"] = self.era_bitmaps[ERAS.index(filters["era"])]
+
+        preferred_length = filters.get("preferred_length")
+        if preferred_length:
+            if preferred_length in LENGTH_BUCKETS:
+                bitmaps["preferred_length"] = self.length_bitmaps[LENGTH_BUCKETS.index(preferred_length)]
+            else:
+                bitmaps["preferred_length"] = self.runtime_bitmap(preferred_length)
+
+        return {name: (bitmap if bitmap is not None else np.zeros_like(self.base))
+                for name, bitmap in bitmaps.items()}
+
+    def _combined(self, bitmaps, skip=None):
+        mask = self.base
+        for name, bitmap in bitmaps.items():
+            if name != skip:
+                mask = mask & bitmap
+        return mask
+
+    def compute(self, filters):
+        bitmaps = self.filter_bitmaps(filters)
+
+        def facet(name, values, value_bitmaps):
+            # Each facet is counted under the other filters, so every option shows what picking it gives
+            counts = count(value_bitmaps & self._combined(bitmaps, skip=name))
+            order = np.argsort(-counts, kind="stable")
+            return {str(values[i]): int(counts[i]) for i in order if counts[i] > 0}
+
+        return {
+            "total": int(count(self._combined(bitmaps))),
+            "facets": {
+                "genres": facet("genres", self.genres, self.genre_bitmaps),
+                "language": facet("language", self.languages, self.language_bitmaps),
+                "country": facet("country", self.countries, self.country_bitmaps),
+                "era": facet("era", ERAS, self.era_bitmaps),
+                "preferred_length": facet("preferred_length", LENGTH_BUCKETS, self.length_bitmaps),
+            },
+        }
+
+    def counts(self, filters):
+        """Facet counts for the filters, cached per filter combination"""
+        key = (
+            filters.get("mood"),
+            tuple(sorted(filters.get("selected_genres") or [])),
+            filters.get("language"),
+            filters.get("country"),
+            filters.get("era"),
+            filters.get("preferred_length"),
+        )
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        result = self.compute(filters)
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def total(self, filters):
+        """Movies matching all the filters, before the popularity split"""
+        return int(count(self._combined(self.filter_bitmaps(filters))))
@@ -1,5 +1,20 @@
-import pandas as pd
 import ast
+import numpy as np
+import pandas as pd
+
+# Mood → genres
+MOOD_TO_GENRES = {
+    "happy": ["Comedy", "Romance", "Family", "Adventure"],
+    "sad": ["Drama", "Romance"],
+    "excited": ["Action", "Adventure", "Thriller", "Science Fiction"],
+    "relaxed": ["Romance", "Comedy", "Family", "Music"],
+    "adventurous": ["Adventure", "Action", "Fantasy"],
+    "romantic": ["Romance", "Drama"],
+    "scared": ["Horror", "Thriller", "Mystery"],
+    "thoughtful": ["Drama", "History", "Mystery"],
+    "energetic": ["Action", "Adventure"],
+    "melancholic": ["Drama", "Music", "Romance"]
+}
 
 
 def safe_parse_list(x):
@@ -31,78 +46,104 @@ def safe_parse_list(x):
     return []
 
 
-def filter_dataframe(df, mood=None, mainstream=True, selected_genres=None, country=None):
-    if df.empty:
-        return df
+def wanted_genre_set(mood=None, selected_genres=None):
+    wanted_genres = set()
+    if mood and mood in MOOD_TO_GENRES:
+        wanted_genres.update(MOOD_TO_GENRES[mood])
+    if selected_genres:
+        wanted_genres.update(selected_genres)
+    return wanted_genres
 
-    filtered = df.copy()
 
-    print(f"  Parsing {len(filtered)} movies...")
+# Rows used to estimate how many candidates each predicate keeps
+SELECTIVITY_SAMPLE = 64
 
-    # Parse and force lists
-    filtered["genres"] = filtered["genres"].astype(object)
-    filtered["genres"] = filtered["genres"].apply(safe_parse_list)
+LIST_COLUMNS = ["genres", "production_countries"]
 
-    filtered["production_countries"] = filtered["production_countries"].astype(object)
-    filtered["production_countries"] = filtered["production_countries"].apply(safe_parse_list)
 
-    # Remove any row where genres isn't a list
-    filtered = filtered[filtered["genres"].apply(lambda g: isinstance(g, list))]
+class ListColumns:
+    """Parses list columns lazily, only for the rows a predicate looks at"""
 
-    # Remove empty lists
-    filtered = filtered[filtered["genres"].apply(lambda g: len(g) > 0)]
+    def __init__(self, df, columns=LIST_COLUMNS):
+        self.raw = {column: df[column].to_numpy(dtype=object) for column in columns}
+        self.parsed = {column: np.empty(len(df), dtype=object) for column in columns}
+        self.done = {column: np.zeros(len(df), dtype=bool) for column in columns}
 
-    print(f"  After parsing: {len(filtered)} movies (valid lists)")
+    def values(self, column, rows):
+        done, parsed, raw = self.done[column], self.parsed[column], self.raw[column]
+        for row in rows[~done[rows]]:
+            parsed[row] = safe_parse_list(raw[row])
+        done[rows] = True
+        return parsed[rows]
 
-    # Mood → genres
-    mood_to_genres = {
-        "happy": ["Comedy", "Romance", "Family", "Adventure"],
-        "sad": ["Drama", "Romance"],
-        "excited": ["Action", "Adventure", "Thriller", "Science Fiction"],
-        "relaxed": ["Romance", "Comedy", "Family", "Music"],
-        "adventurous": ["Adventure", "Action", "Fantasy"],
-        "romantic": ["Romance", "Drama"],
-        "scared": ["Horror", "Thriller", "Mystery"],
-        "thoughtful": ["Drama", "History", "Mystery"],
-        "energetic": ["Action", "Adventure"],
-        "melancholic": ["Drama", "Music", "Romance"]
-    }
 
-    wanted_genres = set()
-    if mood and mood in mood_to_genres:
-        wanted_genres.update(mood_to_genres[mood])
-    if selected_genres:
-        wanted_genres.update(selected_genres)
+class Predicate:
+    """Row test on one parsed list column"""
 
-    # Genre filter
-    if wanted_genres:
-        print(f"  Filtering by genres: {wanted_genres}")
+    def __init__(self, name, column, test):
+        self.name = name
+        self.column = column
+        self.test = test
 
-        def match_genres(g):
-            if not isinstance(g, list):
-                return False
-            if not all(isinstance(item, str) for item in g):
-                return False
-            return bool(set(g) & wanted_genres)
+    def evaluate(self, lists, rows):
+        values = lists.values(self.column, rows)
+        return np.fromiter((self.test(v) for v in values), dtype=bool, count=len(values))
 
-        filtered = filtered[filtered["genres"].apply(match_genres)]
-        print(f"  After genre filter: {len(filtered)} movies")
 
-    # Country filter
+def build_predicates(wanted_genres=None, country=None):
+    if wanted_genres:
+        # Matching a genre implies a non-empty genre list
+        predicates = [Predicate("genre", "genres", lambda g: not wanted_genres.isdisjoint(g))]
+    else:
+        predicates = [Predicate("valid genres", "genres", lambda g: len(g) > 0)]
     if country:
-        filtered = filtered[filtered["production_countries"].apply(lambda c: country in c)]
-        print(f"  After country filter: {len(filtered)} movies")
+        predicates.append(Predicate("country", "production_countries", lambda c: country in c))
+    return predicates
 
-    # Popularity filter
-    if "popularity" in filtered.columns and not filtered.empty:
-        if mainstream:
-            threshold = filtered["popularity"].quantile(0.7)
-            filtered = filtered[filtered["popularity"] >= threshold]
-        else:
-            threshold = filtered["popularity"].quantile(0.3)
-            filtered = filtered[filtered["popularity"] <= threshold]
 
-        print(f"  After popularity filter: {len(filtered)} movies")
+def order_by_selectivity(predicates, lists, rows, sample_size=SELECTIVITY_SAMPLE):
+    """Most selective predicate first, estimated on a sample of the rows"""
+    if len(predicates) < 2:
+        return predicates
+    sample = rows[:sample_size]
+    return sorted(predicates, key=lambda p: p.evaluate(lists, sample).mean())
 
-    return filtered
 
+def filter_dataframe(df, mood=None, mainstream=True, selected_genres=None, country=None):
+    if df.empty:
+        return df
+
+    print(f"  Filtering {len(df)} movies...")
+
+    lists = ListColumns(df)
+    wanted_genres = wanted_genre_set(mood, selected_genres)
+    if wanted_genres:
+        print(f"  Filtering by genres: {wanted_genres}")
+
+    # One boolean mask, each predicate only looks at the rows still alive
+    mask = np.ones(len(df), dtype=bool)
+    predicates = order_by_selectivity(build_predicates(wanted_genres, country), lists, np.arange(len(df)))
+    for predicate in predicates:
+        alive = np.flatnonzero(mask)
+        if alive.size == 0:
+            break
+        mask[alive] = predicate.evaluate(lists, alive)
+        print(f"  After {predicate.name} filter: {int(mask.sum())} movies")
+
+    rows = np.flatnonzero(mask)
+
+    # The popularity threshold depends on the rows left, so it runs last
+    if "popularity" in df.columns and rows.size:
+        popularity = df["popularity"].iloc[rows]
+        if mainstream:
+            keep = popularity >= popularity.quantile(0.7)
+        else:
+            keep = popularity <= popularity.quantile(0.3)
+        rows = rows[keep.to_numpy()]
+        print(f"  After popularity filter: {len(rows)} movies")
+
+    # Slice once, with the list columns parsed for the surviving rows
+    filtered = df.take(rows)
+    for column in LIST_COLUMNS:
+        filtered[column] = pd.Series(list(lists.values(column, rows)), index=filtered.index, dtype=object)
+    return filtered
@@ -0,0 +1,48 @@
+"""
+Verification of the Firebase ID tokens the client sends as
+`Authorization: Bearer <token>`, used to check that a request acting on a
+user's data comes from that user.
+
+Needs the optional firebase-admin package and FIREBASE_PROJECT_ID. Without
+them no token verifies and only the admin token is accepted.
+"""
+import os
+import threading
+
+try:
+    import firebase_admin
+    from firebase_admin import auth as firebase_auth
+except ImportError:
+    firebase_admin = None
+
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+
+_app = None
+_lock = threading.Lock()
+
+
+def _firebase_app():
+    global _app
+    with _lock:
+        if _app is None:
+            # Verifying ID tokens only needs the project id and Google's public keys, no service account
+            _app = firebase_admin.initialize_app(options={"projectId": FIREBASE_PROJECT_ID}, name="id-tokens")
+        return _app
+
+
+def bearer_token(authorization):
+    scheme, _, token = (authorization or "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+
+
+def verified_uid(authorization):
+    """uid of a valid Firebase ID token in an Authorization header, None otherwise"""
+    token = bearer_token(authorization)
+    if token is None or firebase_admin is None or not FIREBASE_PROJECT_ID:
+        return None
+    try:
+        return firebase_auth.verify_id_token(token, app=_firebase_app())["uid"]
+    except Exception as e:
+        # Expired, revoked, malformed or issued for another project
+        print(f"❌ Rejected ID token: {e}")
+        return None
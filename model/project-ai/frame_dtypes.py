@@ -0,0 +1,44 @@
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:
+    # Without pyarrow fall back to pandas' own string dtype
+    STRING_DTYPE = "string"
+
+# Same dtypes csv_to_sql.py writes with, read_sql_query otherwise widens to float64/int64/object
+NUMERIC_DTYPES = {
+    "popularity": "float32",
+    "imdb_rating": "float32",
+    "runtime": "Int32",
+    "year": "Int32",
+}
+CATEGORY_COLUMNS = ["original_language", "director"]
+STRING_COLUMNS = ["title", "overview", "poster_path", "release_date"]
+
+
+def read_dtypes(columns=None):
+    """dtype mapping for pd.read_sql_query, limited to the selected columns"""
+    dtypes = dict(NUMERIC_DTYPES)
+    dtypes.update({column: STRING_DTYPE for column in STRING_COLUMNS})
+    if columns is not None:
+        dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+    return dtypes
+
+
+def compact_movies(frame):
+    """Convert a movies frame in place to compact dtypes, list columns are left as they are"""
+    for column, dtype in read_dtypes(frame.columns).items():
+        if frame[column].dtype != dtype:
+            frame[column] = frame[column].astype(dtype)
+    for column in CATEGORY_COLUMNS:
+        if column in frame.columns and not isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].astype("category")
+    return frame
+
+
+def bytes_per_row(frame):
+    if frame.empty:
+        return 0
+    return int(frame.memory_usage(deep=True).sum() / len(frame))
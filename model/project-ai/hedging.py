@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import metrics
+
+# Send a second identical ranking call when the first is slower than usual
+LLM_HEDGING = os.getenv("LLM_HEDGING", "false").lower() == "true"
+# The backup is sent once the first call is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# At most this share of the last HEDGE_WINDOW calls gets a backup
+HEDGE_MAX_FRACTION = float(os.getenv("HEDGE_MAX_FRACTION", "0.05"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+# Calls observed before any hedging, the percentile means little before that
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "16"))
+
+
+class Hedger:
+    """
+    Runs `call(prompt, timeout)` and, when it has not returned after the
+    recent HEDGE_PERCENTILE latency of single attempts, an identical backup
+    given only the time left of `timeout`. The first successful answer wins.
+    A blocking HTTP call cannot be stopped once started, so the losing
+    attempt runs to its end with its result dropped.
+
+    With an `admission` controller the backup needs a free slot of its own,
+    held until both attempts have finished: the caller's slot covers one
+    running attempt, the extra slot the other, winner or loser.
+    """
+
+    def __init__(self, call, percentile=HEDGE_PERCENTILE, max_fraction=HEDGE_MAX_FRACTION,
+                 min_samples=HEDGE_MIN_SAMPLES, workers=HEDGE_WORKERS, name="llm", admission=None,
+                 window=HEDGE_WINDOW):
+        self.call = call
+        self.name = name
+        self.admission = admission
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.min_samples = min_samples
+        self.window = window
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        # Numbers of the hedged calls among the last `window` calls
+        self._recent_hedges = deque()
+
+    def _attempt(self, prompt, timeout):
+        started = time.monotonic()
+        result = self.call(prompt, timeout) if timeout is not None else self.call(prompt)
+        metrics.observe(f"{self.name}.attempt.latency", time.monotonic() - started)
+        return result
+
+    def hedge_delay(self):
+        """Seconds to wait before the backup, None while there is too little history"""
+        if metrics.samples(f"{self.name}.attempt.latency") < self.min_samples:
+            return None
+        return metrics.percentile(f"{self.name}.attempt.latency", self.percentile)
+
+    def _allow_hedge(self, call_number):
+        # Budget over recent calls only, a calm stretch must not pay for a later burst
+        with self._lock:
+            while self._recent_hedges and self._recent_hedges[0] <= self.calls - self.window:
+                self._recent_hedges.popleft()
+            if len(self._recent_hedges) + 1 > self.max_fraction * min(self.calls, self.window):
+                return False
+            self._recent_hedges.append(call_number)
+            self.hedged += 1
+            return True
+
+    def invoke(self, prompt, timeout=None):
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+
+        started = time.monotonic()
+        primary = self._pool.submit(self._attempt, prompt, timeout)
+        delay = self.hedge_delay()
+        if delay is None or (timeout is not None and delay >= timeout):
+            return primary.result()
+
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self._allow_hedge(call_number):
+            metrics.incr(f"{self.name}.hedge.over_budget")
+            return primary.result()
+
+        release = None
+        if self.admission is not None:
+            release = self.admission.try_hold()
+            if release is None:
+                # Every slot is busy, a backup would only add load
+                self._uncount_hedge(call_number)
+                metrics.incr(f"{self.name}.hedge.no_slot")
+                return primary.result()
+
+        # The backup must not outlive the caller's deadline
+        remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+        metrics.incr(f"{self.name}.hedge.sent")
+        backup = self._pool.submit(self._attempt, prompt, remaining)
+        if release is not None:
+            self._release_when_done([primary, backup], release)
+
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        # Only stops an attempt still queued on the pool
+                        other.cancel()
+                    if future is backup:
+                        metrics.incr(f"{self.name}.hedge.won")
+                    return future.result()
+                error = future.exception()
+        # Both attempts failed
+        raise error
+
+    def _uncount_hedge(self, call_number):
+        with self._lock:
+            self.hedged -= 1
+            if call_number in self._recent_hedges:
+                self._recent_hedges.remove(call_number)
+
+    @staticmethod
+    def _release_when_done(futures, release):
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def finished(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                release()
+
+        for future in futures:
+            future.add_done_callback(finished)
+
+    def hedge_rate(self):
+        with self._lock:
+            return round(self.hedged / self.calls, 4) if self.calls else 0.0
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from deadlines import Cancelled
+from metrics import metrics
+
+LLM_BATCHING = os.getenv("LLM_BATCHING", "false").lower() == "true"
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "10"))
+LLM_BATCH_MAX = int(os.getenv("LLM_BATCH_MAX", "8"))
+# Batches sent to the model at the same time
+LLM_BATCH_WORKERS = int(os.getenv("LLM_BATCH_WORKERS", "4"))
+
+TASK_LINE = re.compile(r"^\s*TASK\s*(\d+)\s*:(.*)$", re.IGNORECASE)
+
+
+class RankingJob:
+    __slots__ = ("request_json", "number_recommended", "matching_text", "future")
+
+    def __init__(self, request_json, number_recommended, matching_text):
+        self.request_json = request_json
+        self.number_recommended = number_recommended
+        self.matching_text = matching_text
+        self.future = Future()
+
+
+def prompt_preferences(request_json):
+    # The user's uid is not sent to the model provider
+    return {k: v for k, v in request_json.items() if k != "user_id"}
+
+
+def batch_prompt(jobs):
+    # The instructions are sent once for all the tasks in the batch
+    tasks = "".join(
+        f"\n=== TASK {i} (choose {job.number_recommended}) ===\n"
+        f"User Preferences:\n{json.dumps(prompt_preferences(job.request_json), indent=2)}"
+        f"\nMovies List:\n{job.matching_text}\n"
+        for i, job in enumerate(jobs, start=1)
+    )
+    return (
+        f"It is your job to rank movies from most recommended to least for {len(jobs)} independent users. "
+        f"Each TASK below has its own user preferences, its own list of movie IDs and descriptions, and the "
+        f"number of movies to choose. For every task choose the best matching movies by ID and rank them "
+        f"from most recommended to least.\n"
+        f"STRICT RULES:\n"
+        f"Output exactly one line per task, in the form TASK <number>: <ids>\n"
+        f"Output exactly the requested number of movies for each task\n"
+        f"Output ONLY movie IDs after the colon, no text\n"
+        f"Choose ONLY from the list of that task\n\n"
+        f"Output example:\nTASK 1: 123 4123 10\nTASK 2: 231 7 99\n"
+        f"Do not put any punctuation or any other bit of text in the output.\n"
+        f"{tasks}"
+    )
+
+
+def parse_batch_response(text, parse_ids):
+    """{task number: ids} from a batch response"""
+    results = {}
+    for line in text.splitlines():
+        match = TASK_LINE.match(line)
+        if match:
+            results[int(match.group(1))] = parse_ids(match.group(2))
+    return results
+
+
+class LLMBatcher:
+    """
+    Collects ranking jobs for up to `window_ms` (or `max_batch` jobs) and
+    ranks them with one model call, the instruction preamble sent once.
+
+    `invoke(prompt)` returns the model's text, `single_prompt` builds the
+    regular one-user prompt (used for batches of one and for tasks the
+    batch response left out) and `parse_ids` turns text into movie ids.
+    Each batch takes one slot of `admission`.
+    """
+
+    def __init__(self, invoke, single_prompt, parse_ids, admission, window_ms=LLM_BATCH_WINDOW_MS,
+                 max_batch=LLM_BATCH_MAX, workers=LLM_BATCH_WORKERS):
+        self.invoke = invoke
+        self.single_prompt = single_prompt
+        self.parse_ids = parse_ids
+        self.admission = admission
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._jobs = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._collector = None
+        self._lock = threading.Lock()
+
+    def rank(self, request_json, number_recommended, matching_text, deadline=None):
+        """Ranked ids for one request, blocks until its batch is answered or the request is cancelled"""
+        job = RankingJob(request_json, number_recommended, matching_text)
+        self._ensure_collector()
+        self._jobs.put(job)
+        if deadline is None:
+            return job.future.result()
+        try:
+            return deadline.wait(job.future)
+        except Cancelled:
+            # Left out of its batch when it has not been sent yet
+            job.future.cancel()
+            raise
+
+    def _ensure_collector(self):
+        with self._lock:
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, daemon=True)
+                self._collector.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._jobs.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._jobs.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._run, batch)
+
+    def _rank_one(self, job):
+        prompt = self.single_prompt(job.request_json, job.number_recommended, job.matching_text)
+        job.future.set_result(self.parse_ids(self.invoke(prompt)))
+
+    def _run(self, batch):
+        batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        metrics.incr("llm.batches")
+        metrics.incr("llm.batched_jobs", len(batch))
+        missing = []
+        try:
+            with self.admission.admit():
+                if len(batch) == 1:
+                    self._rank_one(batch[0])
+                    return
+
+                print(f"AI BATCH -> Ranking {len(batch)} requests in one call")
+                results = parse_batch_response(self.invoke(batch_prompt(batch)), self.parse_ids)
+                for i, job in enumerate(batch, start=1):
+                    if results.get(i):
+                        job.future.set_result(results[i])
+                    else:
+                        missing.append(job)
+        except Exception as e:
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+
+        for job in missing:
+            # The model skipped this task: ranked on its own, in parallel and in a slot of its own,
+            # so a malformed answer does not add sequential calls to one caller's wait
+            metrics.incr("llm.batch_retries")
+            self._pool.submit(self._retry, job)
+
+    def _retry(self, job):
+        try:
+            with self.admission.admit():
+                self._rank_one(job)
+        except Exception as e:
+            job.future.set_exception(e)
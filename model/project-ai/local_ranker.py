@@ -0,0 +1,38 @@
+import numpy as np
+
+from filter_utils import safe_parse_list, wanted_genre_set
+
+# Weights of the local score, popularity and rating are scaled to 0..1
+SCORE_WEIGHTS = {"genres": 0.5, "rating": 0.3, "popularity": 0.2}
+
+
+def rank_by_popularity(candidates, number_recommended, request_json=None):
+    # Same ordering the SQL retrieval uses, so no AI call is needed
+    ranked = candidates.sort_values(["popularity", "imdb_rating"], ascending=False, kind="stable")
+    return [int(movie_id) for movie_id in ranked["id"].head(number_recommended)]
+
+
+def rank_by_score(candidates, number_recommended, request_json=None):
+    """Weighted genre overlap with the wanted genres, rating and popularity"""
+    request_json = request_json or {}
+    wanted = wanted_genre_set(request_json.get("mood"), request_json.get("selected_genres"))
+
+    if wanted:
+        overlap = np.array([len(wanted.intersection(safe_parse_list(g))) / len(wanted)
+                            for g in candidates["genres"]], dtype=float)
+    else:
+        overlap = np.zeros(len(candidates))
+    rating = candidates["imdb_rating"].to_numpy(dtype=float, na_value=0.0) / 10
+    popularity = candidates["popularity"].rank(pct=True).to_numpy(dtype=float, na_value=0.0)
+
+    score = (SCORE_WEIGHTS["genres"] * overlap + SCORE_WEIGHTS["rating"] * rating
+             + SCORE_WEIGHTS["popularity"] * popularity)
+    # Stable, so equal scores keep the candidate order
+    order = np.argsort(-score, kind="stable")[:number_recommended]
+    return [int(movie_id) for movie_id in candidates["id"].to_numpy()[order]]
+
+
+LOCAL_RANKERS = {
+    "popularity": rank_by_popularity,
+    "score": rank_by_score,
+}
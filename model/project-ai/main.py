@@ -2,13 +2,37 @@
 import os
 import json
 import sqlite3
+import numpy as np
 import pandas as pd
 # from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
-from filter_utils import filter_dataframe
-from sql_utils import build_sql_query
+from filter_utils import filter_dataframe, safe_parse_list
+from sql_utils import MOVIE_COLUMNS, RETRIEVAL_COLUMNS, build_sql_query, build_ids_query, build_similar_query
+from candidate_cache import CandidateCache, retrieval_key
+from candidate_table import CandidateTable
+from catalog import CATALOG_DIR, build_catalog, file_version, open_catalog
+from facets import FacetIndex
+from admission import AdmissionController, Overloaded, LLM_OVERLOAD_MODE
+from deadlines import Cancelled, Deadline
+from local_ranker import rank_by_popularity
+from shadow_ranker import ShadowRanker
+from overview_store import OverviewStore
+from result_cache import PreferenceTracker, ResultCache, result_key
+from cache_warmer import CacheWarmer, WARM_PRESETS_FILE, WARMER_TOP_N, load_presets
+from llm_batcher import LLMBatcher, LLM_BATCHING, prompt_preferences
+from hedging import LLM_HEDGING, Hedger
+from model_registry import ModelRegistry, configured_models
+from prefetch import PREFETCH_ENABLED, Prefetcher
+from taste_profiles import ProfileStore
+from event_log import EVENT_LOG_ENABLED, EventLog, Trace, user_key
+from data_version import DataVersion, DatabaseWatcher, ReloadInProgress, pin_database, snapshot_database
+from partitions import PARTITION_DIR, build_partitions, open_partitions
+from frame_dtypes import bytes_per_row, compact_movies, read_dtypes
+from metrics import metrics
+import time
 import gc
+import threading
 
 load_dotenv()
 # CHANGE GOOGLE GEMINI TO OPEN AI
@@ -34,12 +58,230 @@ print("DB -> Database connected!")
 #     api_key=GOOGLE_API_KEY
 # )
 
+LLM_MODEL = "gpt-4.1-mini"
+
 llm = ChatOpenAI(
-    model="gpt-4.1-mini",
+    model=LLM_MODEL,
     temperature=0.3,
     api_key=OPEN_AI_KEY
 )
 
+# Number of top candidates sent to the AI for ranking
+CANDIDATE_WINDOW = 50
+
+# Bounds concurrent llm.invoke calls and the queue waiting for them
+llm_admission = AdmissionController()
+metrics.gauge("llm.in_flight", lambda: llm_admission.in_flight)
+metrics.gauge("llm.waiting", lambda: llm_admission.waiting)
+
+# Filtered candidate lists kept behind the cursor returned with each response
+candidate_cache = CandidateCache()
+
+# Read candidates with compact dtypes (float32, Int32, categories, Arrow strings) and without copies
+LEAN_MODE = os.getenv("LEAN_MODE", "false").lower() == "true"
+
+# Neighbours returned by /similar/{id}, at most NEIGHBORS_K are precomputed
+SIMILAR_LIMIT = 10
+
+# Rank the whole candidate window in one AI call and serve "more" pages from that ordering
+FULL_RANKING = os.getenv("FULL_RANKING", "false").lower() == "true"
+
+# Preferences, candidates, model answers and stage timings of each request, written behind the response
+event_log = EventLog()
+metrics.gauge("event_log.pending", lambda: event_log.pending())
+
+# Final first-page responses, kept warm for popular preferences by cache_warmer
+result_cache = ResultCache()
+preference_tracker = PreferenceTracker()
+
+
+def warm_hit_rate():
+    lookups = metrics.counter("result_cache.hit") + metrics.counter("result_cache.miss")
+    return round(metrics.counter("result_cache.warm_hit") / lookups, 4) if lookups else 0.0
+
+
+metrics.gauge("result_cache.entries", lambda: len(result_cache))
+metrics.gauge("result_cache.warm_hit_rate", warm_hit_rate)
+
+# Memory-mapped catalog shared by all workers, attached at startup
+catalog = None
+
+# Precomputed candidate ids for common preference combinations, stored in the catalog
+MATERIALIZE_CANDIDATES = os.getenv("MATERIALIZE_CANDIDATES", "true").lower() == "true"
+candidate_table = None
+
+# Order candidates by the catalog's precomputed mood affinity instead of popularity alone (opt-in).
+# A smaller AFFINITY_WINDOW sends fewer candidates to the AI, lower it only once an offline
+# comparison shows the rankings keep their relevance.
+AFFINITY_ORDER = os.getenv("AFFINITY_ORDER", "false").lower() == "true"
+AFFINITY_WINDOW = int(os.getenv("AFFINITY_WINDOW", str(CANDIDATE_WINDOW)))
+
+# Per-user taste vectors built from saved recommendation history, blended into the candidate order
+# (opt-in). The taste score replaces the popularity order of the candidates, switch it on only once
+# an offline comparison shows the rankings keep their relevance.
+PERSONALIZATION = os.getenv("PERSONALIZATION", "false").lower() == "true"
+TASTE_WEIGHT = float(os.getenv("TASTE_WEIGHT", "0.5"))
+profile_store = ProfileStore()
+
+# Per-value bitmaps of the catalog behind /facets, also used to skip guaranteed-empty queries
+facet_index = None
+
+# Era / language partitioned copy of the movies table scanned in parallel (see partitions.py)
+PARTITIONED_QUERIES = os.getenv("PARTITIONED_QUERIES", "false").lower() == "true"
+movie_partitions = None
+
+
+# Set when the database keeps overviews compressed in movie_overviews (see overview_store.py)
+overview_store = None
+
+
+def load_overview_store():
+    global overview_store
+    store_conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    try:
+        overview_store = OverviewStore.open(store_conn)
+    except sqlite3.DatabaseError as e:
+        print(f"❌ Could not open overview store: {e}")
+    finally:
+        store_conn.close()
+
+
+load_overview_store()
+
+
+def movie_columns(store=None):
+    # Retrieval skips the overview column when it is decoded on demand instead
+    return MOVIE_COLUMNS if store is None else RETRIEVAL_COLUMNS
+
+
+# Everything built from one database file, swapped as a whole by reload_data (see data_version.py)
+data_version = None
+data_lock = threading.Lock()
+reload_lock = threading.Lock()
+metrics.gauge("data.in_flight", lambda: data_version.active if data_version is not None else 0)
+
+
+def build_data_version(db_path):
+    """Catalog, indexes and stores of db_path, built without touching the active version"""
+    # Built from a hard link so the catalog and the pinned database are the same file
+    staged = snapshot_database(db_path, CATALOG_DIR)
+    try:
+        # No-op when a prestart step or another worker already built this version
+        path = build_catalog(staged or db_path, CATALOG_DIR, materialize=MATERIALIZE_CANDIDATES)
+    except Exception:
+        if staged is not None:
+            os.remove(staged)
+        raise
+    if staged is not None:
+        db_path = pin_database(staged, path)
+    version_catalog = open_catalog(path)
+
+    store_conn = sqlite3.connect(db_path, check_same_thread=False)
+    try:
+        store = OverviewStore.open(store_conn)
+    finally:
+        store_conn.close()
+
+    partitions = None
+    if PARTITIONED_QUERIES:
+        try:
+            partitions = open_partitions(build_partitions(db_path, PARTITION_DIR))
+        except Exception as e:
+            print(f"❌ Could not load partitions: {e}")
+
+    return DataVersion(
+        db_path,
+        version_catalog.version,
+        catalog=version_catalog,
+        candidate_table=CandidateTable.from_catalog(version_catalog) if MATERIALIZE_CANDIDATES else None,
+        facet_index=FacetIndex(version_catalog),
+        overview_store=store,
+        movie_partitions=partitions,
+        build_dir=path,
+    )
+
+
+def activate(version):
+    """Swaps in a data version, the previous one is freed once its requests have finished"""
+    global data_version, catalog, candidate_table, facet_index, overview_store, movie_partitions
+    with data_lock:
+        previous = data_version
+        data_version = version
+        catalog, candidate_table, facet_index = version.catalog, version.candidate_table, version.facet_index
+        overview_store, movie_partitions = version.overview_store, version.movie_partitions
+
+    if previous is not None:
+        # Cached pages and cursors point at the old data
+        result_cache.clear()
+        candidate_cache.clear()
+        prefetcher.clear()
+        previous.retire()
+
+
+def active_data():
+    """The active data version, before the first load a view of what was opened at startup"""
+    version = data_version
+    if version is not None:
+        return version
+    return DataVersion(DB_PATH, None, catalog=catalog, candidate_table=candidate_table, facet_index=facet_index,
+                       overview_store=overview_store, movie_partitions=movie_partitions)
+
+
+def acquire_data():
+    """Pins the active data version for one request, released with data.release()"""
+    with data_lock:
+        return active_data().acquire()
+
+
+def load_catalog():
+    with reload_lock:
+        try:
+            activate(build_data_version(DB_PATH))
+        except Exception as e:
+            print(f"❌ Could not load catalog: {e}")
+            if PARTITIONED_QUERIES:
+                load_partitions()
+
+
+def reload_data():
+    """
+    Builds the database file currently at DB_PATH next to live traffic and
+    swaps it in. Returns False when it is the version already served.
+    """
+    if not reload_lock.acquire(blocking=False):
+        raise ReloadInProgress("A data reload is already running")
+    try:
+        previous = data_version
+        if previous is not None and file_version(DB_PATH) == previous.version:
+            print("RELOAD -> Database unchanged")
+            return False
+
+        started = time.monotonic()
+        print(f"RELOAD -> Building data version from {DB_PATH}...")
+        version = build_data_version(DB_PATH)
+        activate(version)
+        metrics.incr("reload.swapped")
+        metrics.observe("reload.build", time.monotonic() - started)
+        print(f"RELOAD -> Serving data version {version.version}")
+        return True
+    except Exception:
+        metrics.incr("reload.failed")
+        raise
+    finally:
+        reload_lock.release()
+
+
+# Reloads when a new database file is moved into DB_PATH, started by the API when RELOAD_WATCH is set
+database_watcher = DatabaseWatcher(DB_PATH, reload_data)
+
+
+def load_partitions():
+    global movie_partitions
+    try:
+        movie_partitions = open_partitions(build_partitions(DB_PATH, PARTITION_DIR))
+    except Exception as e:
+        print(f"❌ Could not load partitions: {e}")
+
 
 def get_ids(response: str):
     ids = []
@@ -80,17 +322,281 @@ def ids_to_json(ids, filtered_data):
     return {"recommended_movies": results}
 
 
+def exclude_ids(frame, previous_ids):
+    if not previous_ids:
+        return frame
+    return frame[~frame["id"].isin(previous_ids)]
+
+
+def valid_ranking(ids, candidates):
+    # The model may repeat ids or invent some, keep each candidate once
+    allowed = set(candidates["id"].tolist())
+    seen = set()
+    ranking = []
+    for movie_id in ids:
+        if movie_id in allowed and movie_id not in seen:
+            seen.add(movie_id)
+            ranking.append(movie_id)
+    return ranking
+
+
+def ranked_page(entry, previous_ids, number_recommended):
+    """Next unseen ids of a stored full ranking, None when it cannot fill the page"""
+    if entry.ranking is None:
+        return None
+    seen = set(previous_ids or [])
+    ids = [movie_id for movie_id in entry.ranking if movie_id not in seen][:number_recommended]
+    return ids if len(ids) == number_recommended else None
+
+
+def candidate_window(mood, data=None):
+    # Affinity ordered candidates put the best mood matches first, fewer of them are needed
+    catalog = (data or active_data()).catalog
+    if AFFINITY_ORDER and catalog is not None and mood in catalog.meta.get("moods", []):
+        return AFFINITY_WINDOW
+    return CANDIDATE_WINDOW
+
+
+def taste_vector(request_json, data=None):
+    """Taste vector of the requesting user, None for anonymous users and users without history"""
+    user_id = request_json.get("user_id")
+    if not PERSONALIZATION or not user_id or (data or active_data()).catalog is None:
+        return None
+    return profile_store.get(user_id)
+
+
+def record_history(user_id, movie_ids, weight=1.0):
+    """Moves the user's taste vector towards the given movies, returns how many were found"""
+    data = acquire_data()
+    try:
+        catalog = data.catalog
+        rows = catalog.rows_for_ids(movie_ids)
+        rows = rows[rows >= 0]
+        if len(rows):
+            profile_store.update(user_id, catalog.taste_features[rows], weight)
+            metrics.incr("profiles.updates", len(rows))
+        return len(rows)
+    finally:
+        data.release()
+
+
+def order_candidates(frame, mood, taste=None, data=None):
+    """
+    Candidates best matching the mood first, shifted by the user's taste
+    when there is one. Popularity order is kept among equal scores.
+    """
+    catalog = (data or active_data()).catalog
+    if catalog is None or frame.empty:
+        return frame
+    ids = frame["id"].to_numpy()
+    scores = catalog.mood_affinity_of(ids, mood) if AFFINITY_ORDER and mood else None
+    if taste is not None:
+        # One matrix-vector product over the candidates' feature rows
+        personal = TASTE_WEIGHT * catalog.taste_scores(ids, taste)
+        scores = personal if scores is None else scores + personal
+    if scores is None:
+        return frame
+    return frame.iloc[np.argsort(-scores, kind="stable")]
+
+
+def lookup_materialized(request_json, previous_ids=None, data=None):
+    data = data or active_data()
+    if data.candidate_table is None:
+        return None
+
+    found = data.candidate_table.lookup(request_json)
+    if found is None:
+        return None
+
+    ids, complete = found
+    seen = set(previous_ids or [])
+    remaining = sum(1 for movie_id in ids.tolist() if movie_id not in seen)
+
+    # A truncated list that runs out before a full window needs the dynamic path
+    if not complete and remaining < candidate_window(request_json.get("mood"), data):
+        return None
+    return ids.tolist(), complete
+
+
+def read_movies_query(conn, query, params, columns):
+    if not LEAN_MODE:
+        return pd.read_sql_query(query, conn, params=params)
+    columns = [column.strip() for column in columns.split(",")]
+    movies = pd.read_sql_query(query, conn, params=params, dtype=read_dtypes(columns))
+    return compact_movies(movies)
+
+
+def fetch_movies_by_ids(conn, ids, columns=None):
+    columns = columns or movie_columns(overview_store)
+    query, params = build_ids_query(ids, columns)
+    movies = read_movies_query(conn, query, params, columns)
+
+    # Restore the candidate order, IN (...) returns rows in any order
+    position = {movie_id: i for i, movie_id in enumerate(ids)}
+    movies = movies.iloc[movies["id"].map(position).argsort()].reset_index(drop=True)
+
+    movies["genres"] = movies["genres"].astype(object).apply(safe_parse_list)
+    movies["production_countries"] = movies["production_countries"].astype(object).apply(safe_parse_list)
+    return movies
+
+
+def similar_movies(movie_id, limit=SIMILAR_LIMIT):
+    """Precomputed nearest neighbours of a movie, see neighbors_job.py"""
+    data = acquire_data()
+    conn = sqlite3.connect(data.db_path, check_same_thread=False)
+    try:
+        query, params = build_similar_query(movie_id, limit, movie_columns(data.overview_store))
+        neighbors = pd.read_sql_query(query, conn, params=params)
+        if data.overview_store is not None:
+            neighbors = data.overview_store.attach(conn, neighbors)
+    finally:
+        conn.close()
+        data.release()
+
+    result = ids_to_json(neighbors["id"].tolist(), neighbors)
+    for movie, score in zip(result["recommended_movies"], neighbors["score"]):
+        movie["score"] = float(score)
+    return {"movie_id": movie_id, "similar_movies": result["recommended_movies"]}
+
+
+def ranking_prompt(request_json, number_recommended, matching_text):
+    preferences = prompt_preferences(request_json)
+    return (
+        f"It is your job to rank movies from most recommended to least. You will be supplied a list of movie "
+        f"IDs and descriptions, you must choose the best matching {number_recommended} movies by ID for the "
+        f"user and send them rank from most recommended to least.\n"
+        f"STRICT RULES:\n"
+        f"Output exactly {number_recommended} movies\n"
+        f"Output ONLY movie IDs, no text\n"
+        f"Choose ONLY from provided list\n\n"
+        f"Output example: 123 4123 10 231 123\n"
+        f"Do not put any punctuation or any other bit of text in the output.\n"
+        f"User Preferences:\n{json.dumps(preferences, indent=2)}"
+        f"\nMovies List:\n{matching_text}"
+    )
+
+
+def call_llm(prompt, timeout=None):
+    # The HTTP call itself gives up when the request deadline passes
+    return (llm.invoke(prompt, timeout=timeout) if timeout else llm.invoke(prompt)).content
+
+
+# Ranking models routed by recent latency and errors, `llm` first plus any in LLM_MODELS
+llm_registry = ModelRegistry([(f"openai:{LLM_MODEL}", call_llm)] + configured_models())
+metrics.gauge("llm.models", llm_registry.snapshot)
+
+# Backup ranking call for slow responses (LLM_HEDGING=true), capped at HEDGE_MAX_FRACTION of the last HEDGE_WINDOW calls
+llm_hedger = Hedger(llm_registry.invoke, admission=llm_admission)
+metrics.gauge("llm.hedge.rate", llm_hedger.hedge_rate)
+
+
+def invoke_llm(prompt, timeout=None):
+    started = time.monotonic()
+    response = llm_hedger.invoke(prompt, timeout) if LLM_HEDGING else llm_registry.invoke(prompt, timeout)
+    metrics.observe("llm.latency", time.monotonic() - started)
+    return response
+
+
+# Local ranker compared against the AI on live traffic (SHADOW_RANKER=score), off by default
+shadow_ranker = ShadowRanker()
+metrics.gauge("shadow.overlap_at_k", shadow_ranker.mean_overlap)
+metrics.gauge("shadow.rank_correlation", shadow_ranker.mean_correlation)
+
+
+# Optional cross-request micro-batching of ranking calls (LLM_BATCHING=true)
+llm_batcher = LLMBatcher(invoke_llm, ranking_prompt, get_ids, llm_admission)
+
+
+def warm_result(request_json):
+    result = recommend_movies(dict(request_json), warming=True)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+cache_warmer = CacheWarmer(
+    warm_result,
+    [lambda: load_presets(WARM_PRESETS_FILE), lambda: preference_tracker.top(WARMER_TOP_N),
+     # Survives restarts, so the first run after a deploy still knows what is popular
+     lambda: event_log.top_preferences(WARMER_TOP_N) if EVENT_LOG_ENABLED else []],
+    result_cache,
+)
+
+
+def prefetch_page(request_json, previous_ids, cursor):
+    # Background run like the warmer's: no result cache lookup, no shadow ranking
+    return recommend_movies(request_json, previous_ids, cursor=cursor, warming=True)
+
+
+# Next pages computed after each response when PREFETCH_ENABLED is set
+prefetcher = Prefetcher(prefetch_page)
+metrics.gauge("prefetch.hit_rate", prefetcher.hit_rate)
+metrics.gauge("prefetch.waste_rate", prefetcher.waste_rate)
+
+
 # -------------------------------------------------------------------------
 # MAIN RECOMMENDER LOGIC
 # -------------------------------------------------------------------------
 
-def recommend_movies(request_json, previous_ids=None):
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+def event_outcome(trace, result, error):
+    if error is not None:
+        return type(error).__name__.lower()
+    if result.get("error"):
+        return "empty" if result["error"] == "No matching movies." else "error"
+    if result.get("degraded"):
+        return "degraded"
+    return trace.fields.get("outcome", "ai")
+
+
+def log_event(request_json, previous_ids, cursor, trace, result, error):
+    returned = [int(movie["id"]) for movie in (result or {}).get("recommended_movies", [])]
+    event_log.record({
+        "ts": time.time(),
+        # Requests of one user can be grouped without storing their uid
+        "user_id": user_key(request_json.get("user_id")),
+        # Same shape as a first-page payload, so the warmer can replay it
+        "preferences": {k: v for k, v in request_json.items() if k not in ("user_id", "previous_ids", "cursor")},
+        "first_page": int(not previous_ids and not cursor),
+        "outcome": event_outcome(trace, result, error),
+        "source": trace.fields.get("source"),
+        "retrieved": trace.fields.get("retrieved"),
+        "candidates": trace.fields.get("candidates"),
+        "returned": returned,
+        "llm_response": trace.fields.get("llm_response"),
+        "stages": trace.stages,
+        "total_ms": round(trace.elapsed() * 1000, 3),
+        "error": str(error) if error is not None else (result or {}).get("error"),
+    })
+
+
+def recommend_movies(request_json, previous_ids=None, cursor=None, warming=False, deadline=None):
+    trace = Trace()
+    result = None
+    error = None
+    try:
+        result = recommend_pipeline(request_json, previous_ids, cursor, warming, deadline, trace)
+        return result
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Warmer and prefetch runs are not user requests
+        if EVENT_LOG_ENABLED and not warming:
+            log_event(request_json, previous_ids, cursor, trace, result, error)
+
+
+def recommend_pipeline(request_json, previous_ids, cursor, warming, deadline, trace):
+    conn = None
     data_chunk = None
     filtered_data = None
     matching_movies = None
     ids = None
     result = None
+    # In-flight requests keep the data version they started on across a reload,
+    # every index below is read from `data`, never from the module globals
+    data = acquire_data()
+    db_path = data.db_path
+    columns = movie_columns(data.overview_store)
 
     try:
         mood = request_json.get("mood")
@@ -101,64 +607,196 @@ def recommend_movies(request_json, previous_ids=None):
         mainstream = request_json.get("popularity", True)
         selected_genres = request_json.get("selected_genres")
         number_recommended = request_json.get("number_recommended", 3)
+        # Cancelled by the API when the client disconnects
+        deadline = deadline or Deadline()
 
         print(f"REQUEST->  mood={mood}, genres={selected_genres}, length={preferred_length}")
 
-        query, params = build_sql_query(preferred_length, language, era, previous_ids)
-
-        print(f"SQL -> SQL query...")
-        data_chunk = pd.read_sql_query(query, conn, params=params)
-
-        # Required dtype conversions
-        data_chunk["genres"] = data_chunk["genres"].astype(object)
-        data_chunk["production_countries"] = data_chunk["production_countries"].astype(object)
-
-        print(f"  Loaded: {len(data_chunk)} movies ({data_chunk.memory_usage(deep=True).sum() / 1024**2:.2f} MB)")
-
-        if data_chunk.empty:
-            return {"error": "No matching movies.", "recommended_movies": []}
-
-        print(f"FILTERING -> Python filtering...")
-        filtered_data = filter_dataframe(data_chunk, mood, mainstream, selected_genres, country)
+        taste = taste_vector(request_json, data)
+
+        # Only first pages are cached, follow-ups depend on what was already shown.
+        # Personalized pages are not shared between users.
+        first_page = not previous_ids and not cursor
+        if first_page and not warming and taste is None:
+            preference_tracker.record({k: v for k, v in request_json.items() if k != "user_id"})
+            hit = result_cache.get(result_key(request_json))
+            if hit is not None:
+                cached_result, warmed = hit
+                metrics.incr("result_cache.hit")
+                if warmed:
+                    metrics.incr("result_cache.warm_hit")
+                print("CACHE -> Returning cached recommendations")
+                trace.set(outcome="result_cache")
+                return cached_result
+            metrics.incr("result_cache.miss")
+
+        key = retrieval_key(request_json)
+        cached = candidate_cache.get(cursor, key, data.version)
+
+        # Only behind a cursor of this data version, pages prefetched across a reload are stale
+        if PREFETCH_ENABLED and cached is not None and not warming:
+            # Usually computed while the user was looking at the previous page
+            prefetched = prefetcher.take(request_json, previous_ids, cursor, deadline)
+            if prefetched is not None:
+                print("PREFETCH -> Returning prefetched page")
+                trace.set(outcome="prefetch")
+                return prefetched
+
+        if cached is not None:
+            # Follow-up page: slice the cached candidates instead of querying again
+            print(f"CACHE -> Reusing {len(cached.frame)} cached candidates")
+            filtered_data = exclude_ids(cached.frame, previous_ids)
+            trace.set(source="candidate_cache", retrieved=len(cached.frame))
+
+            page_ids = ranked_page(cached, previous_ids, number_recommended)
+            if page_ids is not None:
+                # Already ordered by the AI when the first page was ranked
+                print(f"RANKING -> Serving {len(page_ids)} movies from the stored ranking")
+                metrics.incr("full_ranking.pages_served")
+                page = filtered_data[filtered_data["id"].isin(page_ids)]
+                if data.overview_store is not None:
+                    conn = sqlite3.connect(db_path, check_same_thread=False)
+                    page = data.overview_store.attach(conn, page)
+                result = ids_to_json(page_ids, page)
+                result["cursor"] = cursor
+                trace.set(outcome="stored_ranking")
+                return result
+            if not cached.complete and len(filtered_data) < candidate_window(mood, data):
+                cached = None
+
+        if cached is None:
+            materialized = lookup_materialized(request_json, previous_ids, data)
+
+            if materialized is not None:
+                materialized_ids, complete = materialized
+                print(f"CANDIDATES -> Using materialized list of {len(materialized_ids)} movies")
+
+                if not materialized_ids:
+                    return {"error": "No matching movies.", "recommended_movies": []}
+
+                conn = sqlite3.connect(db_path, check_same_thread=False)
+                with deadline.sqlite(conn):
+                    data_chunk = fetch_movies_by_ids(conn, materialized_ids, columns)
+                data_chunk = order_candidates(data_chunk, mood, taste, data)
+                trace.set(source="materialized", retrieved=len(data_chunk))
+                trace.mark("retrieval")
+                cursor = candidate_cache.put(key, data_chunk, complete, version=data.version)
+                filtered_data = exclude_ids(data_chunk, previous_ids)
+            elif data.facet_index is not None and data.facet_index.total(request_json) == 0:
+                # The facet bitmaps already tell no movie matches, skip the SQL and filter pass
+                print("FACETS -> No movie matches these filters")
+                metrics.incr("facets.empty_skipped")
+                trace.set(source="facets", retrieved=0)
+                return {"error": "No matching movies.", "recommended_movies": []}
+            else:
+                if data.movie_partitions is not None:
+                    print(f"SQL -> Partitioned SQL query...")
+                    data_chunk = data.movie_partitions.query(preferred_length, language, era, previous_ids,
+                                                             columns=columns, deadline=deadline)
+                    if LEAN_MODE:
+                        data_chunk = compact_movies(data_chunk)
+                else:
+                    query, params = build_sql_query(preferred_length, language, era, previous_ids,
+                                                    columns=columns)
+
+                    print(f"SQL -> SQL query...")
+                    conn = sqlite3.connect(db_path, check_same_thread=False)
+                    with deadline.sqlite(conn):
+                        data_chunk = read_movies_query(conn, query, params, columns)
+
+                trace.set(source="sql" if data.movie_partitions is None else "partitions", retrieved=len(data_chunk))
+                trace.mark("retrieval")
+                print(f"  Loaded: {len(data_chunk)} movies ({data_chunk.memory_usage(deep=True).sum() / 1024**2:.2f} MB, "
+                      f"{bytes_per_row(data_chunk)} bytes/row)")
+
+                if data_chunk.empty:
+                    return {"error": "No matching movies.", "recommended_movies": []}
+
+                deadline.check("filtering")
+                print(f"FILTERING -> Python filtering...")
+                filtered_data = filter_dataframe(data_chunk, mood, mainstream, selected_genres, country)
+
+                if filtered_data.empty:
+                    return {"error": "No matching movies.", "recommended_movies": []}
+
+                filtered_data = order_candidates(filtered_data, mood, taste, data)
+                trace.mark("filtering")
+                cursor = candidate_cache.put(key, filtered_data, version=data.version)
 
         if filtered_data.empty:
-            return {"error": "No matching movies.", "recommended_movies": []}
+            return {"error": "No matching movies.", "recommended_movies": [], "cursor": cursor}
+
+        deadline.check("ranking")
+        matching_movies = filtered_data.head(candidate_window(mood, data))
 
-        matching_movies = filtered_data.head(50)
-        print(f"AI PIPELINE -> Sending top 50 to AI...")
+        if data.overview_store is not None:
+            # Only the candidates sent to the AI need their overview
+            if conn is None:
+                conn = sqlite3.connect(db_path, check_same_thread=False)
+            matching_movies = data.overview_store.attach(conn, matching_movies)
+        print(f"AI PIPELINE -> Sending top {len(matching_movies)} to AI...")
+        trace.set(candidates=[int(movie_id) for movie_id in matching_movies["id"].tolist()])
+        trace.mark("candidates")
 
         matching_text = (matching_movies['id'].astype(str) + " - " +
                          matching_movies["overview"]).str.cat(sep="\n")
 
-        # AI ranking prompt
-        ai_prompt = (
-            f"It is your job to rank movies from most recommended to least. You will be supplied a list of movie "
-            f"IDs and descriptions, you must choose the best matching {number_recommended} movies by ID for the "
-            f"user and send them rank from most recommended to least.\n"
-            f"STRICT RULES:\n"
-            f"Output exactly {number_recommended} movies\n"
-            f"Output ONLY movie IDs, no text\n"
-            f"Choose ONLY from provided list\n\n"
-            f"Output example: 123 4123 10 231 123\n"
-            f"Do not put any punctuation or any other bit of text in the output.\n"
-            f"User Preferences:\n{json.dumps(request_json, indent=2)}"
-            f"\nMovies List:\n{matching_text}"
-        )
+        # With a cursor to keep it behind, the AI orders the whole window once for all pages
+        rank_count = len(matching_movies) if FULL_RANKING and cursor else number_recommended
+        ai_prompt = ranking_prompt(request_json, rank_count, matching_text)
+
+        # Runs on its own pool while the AI ranks, compared once both are done
+        shadow = None if warming else shadow_ranker.start(matching_movies, request_json)
 
-        print("Sending to AI for ranking...")
-        ai_response = llm.invoke(ai_prompt).content
-        
-        print(f"AI RESPONSE -> returned: {ai_response}")
-        
-        ids = get_ids(ai_response)
+        degraded = False
+        ranking_started = time.monotonic()
+        try:
+            if LLM_BATCHING:
+                # Shares one model call with other requests arriving in the same window
+                ids = llm_batcher.rank(request_json, rank_count, matching_text, deadline=deadline)
+            else:
+                print("Sending to AI for ranking...")
+                # A cancelled request stops waiting, the call keeps its slot until it times out on its own
+                ai_response = llm_admission.run(deadline, invoke_llm, ai_prompt, deadline.remaining())
+
+                print(f"AI RESPONSE -> returned: {ai_response}")
+                trace.set(llm_response=ai_response)
+
+                ids = get_ids(ai_response)
+        except Overloaded:
+            if LLM_OVERLOAD_MODE != "degrade":
+                raise
+            # Keep answering under overload, ranked without the AI
+            print("OVERLOAD -> Ranking by popularity instead of AI")
+            metrics.incr("llm.admission.degraded")
+            ids = rank_by_popularity(matching_movies, number_recommended)
+            degraded = True
 
         print(f"AI RESPONSE -> returned: {ids}")
+        trace.mark("ranking")
+
+        if not degraded:
+            shadow_ranker.compare(shadow, ids, time.monotonic() - ranking_started, number_recommended)
+            if rank_count > number_recommended:
+                ranking = valid_ranking(ids, matching_movies)
+                candidate_cache.set_ranking(cursor, ranking)
+                ids = ranking[:number_recommended]
 
         result = ids_to_json(ids, matching_movies)
+        result["cursor"] = cursor
+        if degraded:
+            result["degraded"] = True
+        elif first_page and taste is None and not data.retired:
+            # A page computed on a replaced version would outlive the clear in activate()
+            result_cache.put(result_key(request_json), result, warmed=warming)
         print(f"RESPONSE -> Returning {len(result['recommended_movies'])} recommendations\n")
 
         return result
 
+    except (Overloaded, Cancelled):
+        # Surfaced by the API as 429/503 with Retry-After, 504 on deadline
+        raise
+
     except Exception as e:
         print(f"❌ Error: {e}")
         import traceback
@@ -168,10 +806,13 @@ def recommend_movies(request_json, previous_ids=None):
     finally:
 
         try:
-            conn.close()
+            if conn is not None:
+                conn.close()
         except:
             pass
 
+        data.release()
+
         try:
             del data_chunk
         except:
@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+# Recent samples kept per timing for the percentiles
+TIMING_WINDOW = 1000
+
+
+class Metrics:
+    """In-process counters, timings and gauges exposed on /metrics"""
+
+    def __init__(self, window=TIMING_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+        self._gauges = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = {"count": 0, "total": 0.0, "max": 0.0,
+                                                "recent": deque(maxlen=self.window)}
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            timing["recent"].append(seconds)
+
+    def gauge(self, name, func):
+        with self._lock:
+            self._gauges[name] = func
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def samples(self, name):
+        """Recent samples kept for a timing"""
+        with self._lock:
+            timing = self._timings.get(name)
+            return len(timing["recent"]) if timing else 0
+
+    def percentile(self, name, q):
+        with self._lock:
+            timing = self._timings.get(name)
+            recent = list(timing["recent"]) if timing else []
+        if not recent:
+            return None
+        return float(np.percentile(recent, q))
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            timings = {name: dict(t, recent=list(t["recent"])) for name, t in self._timings.items()}
+            gauges = dict(self._gauges)
+
+        summary = {}
+        for name, t in timings.items():
+            recent = np.array(t["recent"]) * 1000
+            summary[name] = {
+                "count": t["count"],
+                "mean_ms": round(t["total"] / t["count"] * 1000, 2),
+                "p50_ms": round(float(np.percentile(recent, 50)), 2),
+                "p95_ms": round(float(np.percentile(recent, 95)), 2),
+                "p99_ms": round(float(np.percentile(recent, 99)), 2),
+                "max_ms": round(t["max"] * 1000, 2),
+            }
+
+        return {
+            "counters": counters,
+            "timings": summary,
+            "gauges": {name: func() for name, func in gauges.items()},
+        }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+
+
+metrics = Metrics()
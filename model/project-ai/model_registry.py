@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+
+from metrics import metrics
+
+# Extra ranking models, comma separated provider:model[@base_url], e.g.
+# "openai:gpt-4.1-nano,google:gemini-2.0-flash-lite,openai:fake@http://localhost:8001/v1"
+LLM_MODELS = os.getenv("LLM_MODELS", "")
+# Weight of the newest call in the latency and error averages
+HEALTH_ALPHA = float(os.getenv("HEALTH_ALPHA", "0.2"))
+# Seconds of latency one unit of error rate costs when choosing a model
+ERROR_PENALTY = float(os.getenv("ERROR_PENALTY", "10"))
+# Consecutive failures that open a model's circuit, and how long it stays open
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+# Seconds without a call after which a model is tried again, so a recovered model is measured anew
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "60"))
+
+
+class ModelHealth:
+    """
+    EWMA latency and error rate of one model, with a circuit breaker.
+    Averages older than `max_age` seconds restart from the next call.
+    """
+
+    def __init__(self, alpha=HEALTH_ALPHA, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN,
+                 max_age=HEALTH_PROBE_INTERVAL):
+        self.alpha = alpha
+        self.max_age = max_age
+        self.failures = failures
+        self.cooldown = cooldown
+        self.latency = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.updated_at = 0.0
+        # Last time the model was picked to be measured again
+        self.probed_at = 0.0
+
+    def _average(self, current, value):
+        return value if current is None else (1 - self.alpha) * current + self.alpha * value
+
+    def _expire(self):
+        now = time.monotonic()
+        if now - self.updated_at >= self.max_age:
+            # Say nothing about the model now, the next call alone counts
+            self.latency = None
+            self.error_rate = 0.0
+        self.updated_at = now
+
+    def success(self, seconds):
+        self._expire()
+        self.latency = self._average(self.latency, seconds)
+        self.error_rate = self._average(self.error_rate, 0.0)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def failure(self, seconds):
+        self._expire()
+        self.latency = self._average(self.latency, seconds)
+        self.error_rate = self._average(self.error_rate, 1.0)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failures:
+            # Half-open after the cooldown: the next call is a trial
+            self.open_until = time.monotonic() + self.cooldown
+
+    def is_open(self, now=None):
+        return (now or time.monotonic()) < self.open_until
+
+    def stale(self, now=None):
+        """Measured, but neither called nor probed for max_age seconds"""
+        now = now or time.monotonic()
+        return self.latency is not None and now - max(self.updated_at, self.probed_at) >= self.max_age
+
+    def score(self, penalty=ERROR_PENALTY):
+        # Untried models go first so every model gets measured
+        if self.latency is None:
+            return 0.0
+        return self.latency + penalty * self.error_rate
+
+    def snapshot(self):
+        return {
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 2),
+            "error_rate": round(self.error_rate, 4),
+            "open": self.is_open(),
+        }
+
+
+class ModelRegistry:
+    """
+    Ranking models tried best first: lowest recent latency plus error
+    penalty, models with an open circuit last. A model not called for
+    HEALTH_PROBE_INTERVAL seconds goes first once and its averages restart,
+    so a model left behind after a slow spell is measured again. A failing call
+    fails over to the next model within what is left of the timeout, the
+    last error is raised when all of them fail.
+
+    `models` are (name, call) pairs, `call(prompt, timeout)` returns text.
+    """
+
+    def __init__(self, models, penalty=ERROR_PENALTY, **health_options):
+        self.penalty = penalty
+        self.models = list(models)
+        self.health = {name: ModelHealth(**health_options) for name, _ in self.models}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.models)
+
+    def _rank_key(self, name, now):
+        health = self.health[name]
+        # A stale model ranks like an untried one
+        score = 0.0 if health.stale(now) else health.score(self.penalty)
+        return health.is_open(now), score
+
+    def order(self):
+        """Models in the order a call tries them"""
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(self.models, key=lambda model: self._rank_key(model[0], now))
+            first = self.health[ranked[0][0]]
+            if first.stale(now) and not first.is_open(now):
+                # One probe per interval, concurrent calls keep the usual order
+                first.probed_at = now
+                metrics.incr("llm.probes")
+        return ranked
+
+    def invoke(self, prompt, timeout=None):
+        error = None
+        expires = None if timeout is None else time.monotonic() + timeout
+        for attempt, (name, call) in enumerate(self.order()):
+            remaining = None if expires is None else expires - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                # All models share the caller's timeout
+                metrics.incr("llm.failover_timed_out")
+                break
+            if attempt:
+                metrics.incr("llm.failover")
+                print(f"LLM -> Failing over to {name}")
+            started = time.monotonic()
+            try:
+                response = call(prompt, remaining)
+            except Exception as e:
+                with self._lock:
+                    self.health[name].failure(time.monotonic() - started)
+                metrics.incr(f"llm.model.{name}.errors")
+                print(f"❌ Ranking model {name} failed: {e}")
+                error = e
+                continue
+            with self._lock:
+                self.health[name].success(time.monotonic() - started)
+            metrics.incr(f"llm.model.{name}.calls")
+            return response
+        raise error or TimeoutError("Ranking call timed out")
+
+    def snapshot(self):
+        with self._lock:
+            return {name: health.snapshot() for name, health in self.health.items()}
+
+
+def parse_model_specs(text):
+    """[(provider, model, base_url)] from LLM_MODELS"""
+    specs = []
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        provider, _, model = item.partition(":")
+        model, _, base_url = model.partition("@")
+        if not model:
+            print(f"❌ Ignoring ranking model {item}, expected provider:model")
+            continue
+        specs.append((provider.strip().lower(), model.strip(), base_url.strip() or None))
+    return specs
+
+
+def build_chat_model(provider, model, base_url=None, temperature=0.3):
+    """LangChain chat model for a spec, None when its provider is not available"""
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+        # A base_url points at any OpenAI compatible endpoint, local fakes included
+        return ChatOpenAI(model=model, temperature=temperature, api_key=os.getenv("OPEN_AI_KEY"), base_url=base_url)
+    if provider == "google":
+        try:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+        except ImportError:
+            print("❌ langchain_google_genai is not installed, skipping Google models")
+            return None
+        return ChatGoogleGenerativeAI(model=model, temperature=temperature, api_key=os.getenv("GOOGLE_API_KEY"))
+    print(f"❌ Unknown ranking model provider {provider}")
+    return None
+
+
+def chat_model_call(chat_model):
+    def call(prompt, timeout=None):
+        return (chat_model.invoke(prompt, timeout=timeout) if timeout else chat_model.invoke(prompt)).content
+    return call
+
+
+def configured_models(specs=LLM_MODELS):
+    """(name, call) pairs of the extra models in LLM_MODELS"""
+    models = []
+    for provider, model, base_url in parse_model_specs(specs):
+        chat_model = build_chat_model(provider, model, base_url)
+        if chat_model is not None:
+            models.append((f"{provider}:{model}", chat_model_call(chat_model)))
+    return models
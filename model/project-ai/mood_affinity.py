@@ -0,0 +1,70 @@
+import os
+import re
+import numpy as np
+from filter_utils import MOOD_TO_GENRES
+
+# Moods in column order of the affinity matrix
+MOODS = list(MOOD_TO_GENRES)
+
+# Overview words that hint at a mood beyond the genre tags
+MOOD_KEYWORDS = {
+    "happy": ["fun", "friendship", "friends", "family", "joy", "wedding", "holiday", "comedy", "hilarious", "heartwarming"],
+    "sad": ["loss", "grief", "death", "dying", "tragedy", "tragic", "illness", "cancer", "funeral", "alone"],
+    "excited": ["race", "chase", "heist", "battle", "explosive", "mission", "escape", "fight", "danger", "spy"],
+    "relaxed": ["summer", "vacation", "village", "cooking", "garden", "gentle", "simple", "holiday", "music", "road"],
+    "adventurous": ["journey", "quest", "expedition", "treasure", "island", "explore", "kingdom", "jungle", "voyage", "legend"],
+    "romantic": ["love", "romance", "lovers", "marriage", "wedding", "affair", "passion", "heart", "falls", "kiss"],
+    "scared": ["haunted", "killer", "murder", "terror", "demon", "ghost", "evil", "nightmare", "creature", "possessed"],
+    "thoughtful": ["truth", "history", "true", "war", "justice", "memory", "society", "faith", "identity", "political"],
+    "energetic": ["fight", "dance", "race", "martial", "action", "team", "champion", "competition", "battle", "street"],
+    "melancholic": ["memories", "lonely", "past", "lost", "regret", "farewell", "rain", "musician", "fading", "longing"],
+}
+
+# Share of the score coming from genres, overview keywords and rating
+GENRE_WEIGHT = float(os.getenv("AFFINITY_GENRE_WEIGHT", "0.6"))
+KEYWORD_WEIGHT = float(os.getenv("AFFINITY_KEYWORD_WEIGHT", "0.25"))
+RATING_WEIGHT = float(os.getenv("AFFINITY_RATING_WEIGHT", "0.15"))
+# Keyword hits that count as a full keyword match
+KEYWORD_SATURATION = 3
+
+WORD = re.compile(r"[a-z]+")
+
+
+def overview_words(text):
+    if not isinstance(text, str):
+        return set()
+    return set(WORD.findall(text.lower()))
+
+
+def mood_scores(genres, overview, rating):
+    """Affinity of one movie to every mood, in MOODS order, each in [0, 1]"""
+    genres = set(genres)
+    words = overview_words(overview)
+    rating = 0.0 if rating is None or rating != rating else min(max(float(rating) / 10, 0.0), 1.0)
+
+    scores = []
+    for mood in MOODS:
+        # Share of the movie's genres that fit the mood, so pure matches beat mixed ones
+        genre_score = len(genres & set(MOOD_TO_GENRES[mood])) / len(genres) if genres else 0.0
+        keyword_score = min(len(words & set(MOOD_KEYWORDS[mood])) / KEYWORD_SATURATION, 1.0)
+        # Rating only counts for movies that match the mood at all
+        matched = genre_score > 0 or keyword_score > 0
+        scores.append(GENRE_WEIGHT * genre_score + KEYWORD_WEIGHT * keyword_score
+                      + (RATING_WEIGHT * rating if matched else 0.0))
+    return scores
+
+
+def affinity_matrix(genre_lists, overviews, ratings):
+    """float32 (movies, moods) matrix of mood affinities"""
+    matrix = np.zeros((len(genre_lists), len(MOODS)), dtype=np.float32)
+    for row, (genres, overview, rating) in enumerate(zip(genre_lists, overviews, ratings)):
+        matrix[row] = mood_scores(genres, overview, rating)
+    return matrix
+
+
+def mood_column(mood, moods=MOODS):
+    """Matrix column of a mood, None for unknown moods"""
+    try:
+        return moods.index(mood)
+    except ValueError:
+        return None
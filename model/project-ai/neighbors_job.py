@@ -0,0 +1,157 @@
+"""
+Offline job that precomputes the top-K most similar movies for every movie.
+
+Run it after csv_to_sql.py (and again whenever the movies table changes):
+
+    python neighbors_job.py
+
+Similarity is a weighted sum of genre overlap, same director, same language,
+release year closeness and overview text similarity. Scores are computed
+block by block over dense feature matrices so memory stays bounded by
+BLOCK_SIZE x number of movies, and the result is written to the
+`movie_neighbors` table read by GET /similar/{id}.
+"""
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+import numpy as np
+
+from catalog import DB_PATH, catalog_from_connection
+
+NEIGHBORS_K = int(os.getenv("NEIGHBORS_K", "20"))
+BLOCK_SIZE = int(os.getenv("NEIGHBORS_BLOCK_SIZE", "1024"))
+# Hashed bag-of-words width for overview text
+OVERVIEW_DIM = int(os.getenv("NEIGHBORS_OVERVIEW_DIM", "256"))
+# Years apart at which the era similarity drops to zero
+ERA_SPAN = 20
+
+WEIGHTS = {
+    "genres": 0.4,
+    "overview": 0.3,
+    "director": 0.15,
+    "era": 0.1,
+    "language": 0.05,
+}
+
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has his her in into is it its of on or "
+    "that the their they this to was when who whose will with".split()
+)
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def overview_vectors(texts, dim=OVERVIEW_DIM):
+    """L2 normalised TF-IDF vectors over hashed overview tokens"""
+    counts = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            if token not in STOP_WORDS:
+                counts[row, zlib.crc32(token.encode("utf-8")) % dim] += 1
+
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(texts)) / (1 + document_frequency)).astype(np.float32) + 1
+    vectors = np.log1p(counts) * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def genre_matrix(catalog):
+    """Multi-hot genre matrix, one column per catalog genre"""
+    matrix = np.zeros((len(catalog), len(catalog.genres)), dtype=np.float32)
+    rows = np.repeat(np.arange(len(catalog)), np.diff(catalog.genre_offsets))
+    matrix[rows, catalog.genre_codes] = 1
+    return matrix
+
+
+def similarity_block(features, start, stop):
+    """Similarity of rows [start, stop) against every movie, shape (stop - start, n)"""
+    genres = features["genres"]
+    intersection = genres[start:stop] @ genres.T
+    sizes = genres.sum(axis=1)
+    union = sizes[start:stop, None] + sizes[None, :] - intersection
+    genre_sim = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    overview_sim = features["overview"][start:stop] @ features["overview"].T
+
+    director = features["director"]
+    director_sim = (director[start:stop, None] == director[None, :]) & (director[None, :] >= 0)
+
+    language = features["language"]
+    language_sim = (language[start:stop, None] == language[None, :]) & (language[None, :] >= 0)
+
+    year = features["year"]
+    gap = np.abs(year[start:stop, None] - year[None, :])
+    era_sim = np.nan_to_num(np.clip(1 - gap / ERA_SPAN, 0, 1))
+
+    scores = (WEIGHTS["genres"] * genre_sim
+              + WEIGHTS["overview"] * overview_sim
+              + WEIGHTS["director"] * director_sim
+              + WEIGHTS["language"] * language_sim
+              + WEIGHTS["era"] * era_sim)
+
+    # A movie is never its own neighbour
+    scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+    return scores
+
+
+def top_k(scores, k):
+    """Column indices of the k best scores per row, best first"""
+    k = min(k, scores.shape[1] - 1)
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def compute_neighbors(catalog, k=NEIGHBORS_K, block_size=BLOCK_SIZE):
+    """Yield (movie_id, rank, neighbor_id, score) rows for every movie"""
+    if len(catalog) < 2:
+        return
+
+    features = {
+        "genres": genre_matrix(catalog),
+        "overview": overview_vectors([catalog.text("overview", row) for row in range(len(catalog))]),
+        "director": np.asarray(catalog.director_codes),
+        "language": np.asarray(catalog.language_codes),
+        "year": np.asarray(catalog.year, dtype=np.float32),
+    }
+    ids = np.asarray(catalog.ids)
+
+    for start in range(0, len(catalog), block_size):
+        stop = min(start + block_size, len(catalog))
+        best, best_scores = top_k(similarity_block(features, start, stop), k)
+        for offset in range(stop - start):
+            movie_id = int(ids[start + offset])
+            for rank, (column, score) in enumerate(zip(best[offset], best_scores[offset])):
+                yield movie_id, rank, int(ids[column]), round(float(score), 4)
+
+
+def write_neighbors(conn, rows):
+    conn.execute("DROP TABLE IF EXISTS movie_neighbors")
+    # Clustered on (movie_id, rank): one lookup reads a movie's neighbours in order
+    conn.execute(
+        "CREATE TABLE movie_neighbors ("
+        "movie_id INTEGER NOT NULL, rank INTEGER NOT NULL, "
+        "neighbor_id INTEGER NOT NULL, score REAL NOT NULL, "
+        "PRIMARY KEY (movie_id, rank)) WITHOUT ROWID"
+    )
+    conn.executemany("INSERT INTO movie_neighbors VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+
+
+def build_neighbors(conn, k=NEIGHBORS_K, block_size=BLOCK_SIZE):
+    catalog = catalog_from_connection(conn)
+    write_neighbors(conn, compute_neighbors(catalog, k, block_size))
+    return conn.execute("SELECT COUNT(*) FROM movie_neighbors").fetchone()[0]
+
+
+if __name__ == "__main__":
+    print(f"Computing top {NEIGHBORS_K} neighbours for {DB_PATH}...")
+    started = time.monotonic()
+    conn = sqlite3.connect(DB_PATH)
+    count = build_neighbors(conn)
+    conn.close()
+    print(f"Wrote {count} neighbour rows in {time.monotonic() - started:.1f}s")
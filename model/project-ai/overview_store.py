@@ -0,0 +1,138 @@
+"""
+Compressed overview storage.
+
+Overviews are the largest column of the movies table but only the few
+candidates sent to the AI need them. The ETL moves them to the
+`movie_overviews` table, each one compressed with zlib against a shared
+dictionary of common words stored in `overview_dictionary`, so retrieval
+queries only read the small columns and overviews are decoded on demand.
+
+Migrate an existing database in place:
+
+    python overview_store.py
+"""
+import os
+import re
+import sqlite3
+import zlib
+from collections import Counter
+
+DB_PATH = "datasets/movie_dataset.db"
+
+# zlib only uses the last 32 KB of a preset dictionary
+MAX_DICTIONARY_BYTES = 32 * 1024
+COMPRESSION_LEVEL = 9
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def train_dictionary(texts, max_bytes=MAX_DICTIONARY_BYTES):
+    """Preset dictionary made of the most frequent words in the overviews"""
+    counts = Counter(word for text in texts if text for word in WORD_PATTERN.findall(text))
+
+    words, size = [], 0
+    for word, count in counts.most_common():
+        if count < 2:
+            break
+        size += len(word.encode("utf-8")) + 1
+        if size > max_bytes:
+            break
+        words.append(word)
+
+    # Matches closer to the end of the dictionary get shorter distances
+    return " ".join(reversed(words)).encode("utf-8")
+
+
+def compress(text, zdict):
+    if text is None:
+        return None
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zdict=zdict) if zdict else zlib.compressobj(COMPRESSION_LEVEL)
+    return compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+def decompress(blob, zdict):
+    if blob is None:
+        return None
+    decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+    return (decompressor.decompress(blob) + decompressor.flush()).decode("utf-8")
+
+
+def has_overview_store(conn):
+    row = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('movie_overviews', 'overview_dictionary')"
+    ).fetchone()
+    return row[0] == 2
+
+
+class OverviewStore:
+    """Decodes overviews from movie_overviews with the shared dictionary"""
+
+    def __init__(self, zdict):
+        self.zdict = zdict
+
+    @classmethod
+    def open(cls, conn):
+        """Store for the database, None when overviews are still in the movies table"""
+        if not has_overview_store(conn):
+            return None
+        row = conn.execute("SELECT zdict FROM overview_dictionary WHERE id = 1").fetchone()
+        return cls(row[0] if row else b"")
+
+    def fetch(self, conn, ids):
+        """Decoded overviews for the given movie ids as {id: text}"""
+        ids = [int(movie_id) for movie_id in ids]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(
+            f"SELECT movie_id, overview FROM movie_overviews WHERE movie_id IN ({placeholders})", ids
+        ).fetchall()
+        return {movie_id: decompress(blob, self.zdict) for movie_id, blob in rows}
+
+    def attach(self, conn, frame):
+        """Copy of frame with its overview column filled in from the store"""
+        overviews = self.fetch(conn, frame["id"].tolist())
+        frame = frame.copy()
+        frame["overview"] = frame["id"].map(overviews)
+        return frame
+
+
+def write_overview_store(conn, rows):
+    """Write (movie_id, overview) rows compressed with a dictionary trained on them"""
+    rows = list(rows)
+    zdict = train_dictionary(text for _, text in rows)
+
+    conn.execute("DROP TABLE IF EXISTS movie_overviews")
+    conn.execute("DROP TABLE IF EXISTS overview_dictionary")
+    conn.execute("CREATE TABLE overview_dictionary (id INTEGER PRIMARY KEY, zdict BLOB NOT NULL)")
+    conn.execute("CREATE TABLE movie_overviews (movie_id INTEGER PRIMARY KEY, overview BLOB)")
+    conn.execute("INSERT INTO overview_dictionary VALUES (1, ?)", (zdict,))
+    conn.executemany(
+        "INSERT INTO movie_overviews VALUES (?, ?)",
+        ((int(movie_id), compress(text, zdict)) for movie_id, text in rows),
+    )
+    conn.commit()
+    return zdict
+
+
+def migrate(conn):
+    """Move movies.overview into the compressed store and drop the column"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(movies)")]
+    if "overview" not in columns:
+        return False
+
+    write_overview_store(conn, conn.execute("SELECT id, overview FROM movies").fetchall())
+    conn.execute("ALTER TABLE movies DROP COLUMN overview")
+    conn.commit()
+    return True
+
+
+if __name__ == "__main__":
+    before = os.path.getsize(DB_PATH)
+    conn = sqlite3.connect(DB_PATH)
+    if migrate(conn):
+        print("Overviews moved to movie_overviews, compacting database...")
+        conn.execute("VACUUM")
+    else:
+        print("Overviews are already stored compressed")
+    conn.close()
+    print(f"Database size: {before / 1024**2:.2f} MB -> {os.path.getsize(DB_PATH) / 1024**2:.2f} MB")
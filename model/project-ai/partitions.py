@@ -0,0 +1,201 @@
+"""
+Era / language partitioned copy of the movies table.
+
+Each era gets its own SQLite file with one table per common language
+(plus one for every other language), so a candidate query only scans the
+partitions its era and language can match. The remaining partitions are
+queried in parallel and merged in the same popularity DESC, imdb_rating
+DESC order as the single-table query.
+
+Build it next to the catalog (the web workers also build it on startup
+when PARTITIONED_QUERIES is enabled and it is missing):
+
+    python partitions.py
+"""
+import os
+import re
+import json
+import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from catalog import DB_PATH, file_version
+from sql_utils import MOVIE_COLUMNS, build_sql_query
+
+PARTITION_DIR = os.getenv("PARTITION_DIR", "datasets/partitions")
+# Languages with their own table in every era, the rest share one
+PARTITION_LANGUAGES = int(os.getenv("PARTITION_LANGUAGES", "8"))
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", "4"))
+
+# Same year ranges as build_sql_query, NULL years only match queries without an era
+ERA_CONDITIONS = {
+    "old": "year <= 1990",
+    "actual": "year > 1990 AND year <= 2020",
+    "new": "year > 2020",
+    "unknown": "year IS NULL",
+}
+# Eras build_sql_query filters on, it ignores any other value
+QUERY_ERAS = ("old", "actual", "new")
+OTHER_LANGUAGES = "other"
+NUMERIC_COLUMNS = ["popularity", "imdb_rating", "runtime", "year"]
+LANGUAGE_PATTERN = re.compile(r"^[a-z]{2,3}$")
+
+
+def partition_languages(conn, limit=PARTITION_LANGUAGES):
+    rows = conn.execute(
+        "SELECT original_language FROM movies WHERE original_language IS NOT NULL "
+        "GROUP BY original_language ORDER BY COUNT(*) DESC, original_language LIMIT ?", (limit,)
+    ).fetchall()
+    return [language for (language,) in rows if LANGUAGE_PATTERN.match(language)]
+
+
+def table_name(language):
+    return f"movies_{language}"
+
+
+def write_partitions(db_path, target, languages):
+    """Write one file per era into target, returns the manifest partitions"""
+    partitions = []
+    placeholders = ",".join("?" * len(languages))
+    other_condition = (f"(original_language IS NULL OR original_language NOT IN ({placeholders}))"
+                       if languages else "1=1")
+
+    for era, era_condition in ERA_CONDITIONS.items():
+        file_name = f"movies_{era}.db"
+        conn = sqlite3.connect(os.path.join(target, file_name))
+        try:
+            conn.execute("ATTACH DATABASE ? AS src", (db_path,))
+            buckets = [(language, "original_language = ?", [language]) for language in languages]
+            buckets.append((OTHER_LANGUAGES, other_condition, list(languages)))
+
+            for language, language_condition, params in buckets:
+                table = table_name(language)
+                # source_rowid keeps the single-table order for equal popularity and rating
+                conn.execute(
+                    f"CREATE TABLE {table} AS SELECT rowid AS source_rowid, * FROM src.movies "
+                    f"WHERE {era_condition} AND {language_condition}", params
+                )
+                conn.execute(f"CREATE INDEX idx_{table}_runtime ON {table}(runtime)")
+                conn.execute(f"CREATE INDEX idx_{table}_rank ON {table}(popularity DESC, imdb_rating DESC)")
+                rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                partitions.append({"era": era, "language": language, "file": file_name,
+                                   "table": table, "rows": rows})
+            conn.commit()
+            conn.execute("DETACH DATABASE src")
+        finally:
+            conn.close()
+
+    return partitions
+
+
+def build_partitions(db_path=DB_PATH, partition_dir=PARTITION_DIR):
+    """Writes the partitions of db_path unless that version is already built, returns their path"""
+    version = file_version(db_path)
+    os.makedirs(partition_dir, exist_ok=True)
+    target = os.path.join(partition_dir, version)
+
+    if not os.path.exists(os.path.join(target, "manifest.json")):
+        print(f"PARTITIONS -> Partitioning {db_path} by era and language...")
+        conn = sqlite3.connect(db_path)
+        try:
+            languages = partition_languages(conn)
+        finally:
+            conn.close()
+
+        tmp = tempfile.mkdtemp(dir=partition_dir, prefix=".build-")
+        partitions = write_partitions(db_path, tmp, languages)
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({"version": version, "languages": languages, "partitions": partitions}, f)
+
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Another worker published the same version first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return target
+
+
+class PartitionedMovies:
+    """Prunes partitions for a query and scans the rest in parallel"""
+
+    def __init__(self, path, manifest, workers=PARTITION_WORKERS):
+        self.path = path
+        self.version = manifest["version"]
+        self.languages = manifest["languages"]
+        self.partitions = manifest["partitions"]
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def prune(self, language=None, era=None):
+        """Partitions a query with these filters can match"""
+        if era not in QUERY_ERAS:
+            era = None
+        if not language:
+            language_bucket = None
+        elif language in self.languages:
+            language_bucket = language
+        else:
+            language_bucket = OTHER_LANGUAGES
+
+        return [
+            p for p in self.partitions
+            if (era is None or p["era"] == era)
+            and (language_bucket is None or p["language"] == language_bucket)
+            and p["rows"] > 0
+        ]
+
+    def _scan(self, partition, query, params, deadline=None):
+        conn = sqlite3.connect(f"file:{os.path.join(self.path, partition['file'])}?mode=ro",
+                               uri=True, check_same_thread=False)
+        try:
+            if deadline is None:
+                return pd.read_sql_query(query, conn, params=params)
+            with deadline.sqlite(conn):
+                return pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+
+    def query(self, preferred_length=None, language=None, era=None, previous_ids=None, columns=MOVIE_COLUMNS,
+              deadline=None):
+        """Same rows and order as build_sql_query on the movies table"""
+        jobs = []
+        for partition in self.prune(language, era):
+            # Filters are still applied, the "other" table holds several languages
+            query, params = build_sql_query(preferred_length, language, era, previous_ids,
+                                            columns=f"{columns}, source_rowid", table=partition["table"])
+            jobs.append(self._pool.submit(self._scan, partition, query, params, deadline))
+
+        frames = [job.result() for job in jobs]
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=[c.strip() for c in columns.split(",")])
+
+        for frame in frames:
+            # An all-NULL column comes back as object, keep numbers numeric for the merge
+            for column in NUMERIC_COLUMNS:
+                if column in frame.columns and frame[column].dtype == object:
+                    frame[column] = pd.to_numeric(frame[column])
+        merged = pd.concat(frames, ignore_index=True)
+        merged = merged.sort_values(["popularity", "imdb_rating", "source_rowid"],
+                                    ascending=[False, False, True], kind="stable")
+        return merged.drop(columns="source_rowid").reset_index(drop=True)
+
+
+def open_partitions(path):
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    movies = PartitionedMovies(path, manifest)
+    print(f"PARTITIONS -> Attached {len(movies.partitions)} partitions of {movies.version}")
+    return movies
+
+
+if __name__ == "__main__":
+    path = build_partitions()
+    open_partitions(path)
+    print(f"Partitions ready at {path}")
@@ -0,0 +1,134 @@
+import os
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from result_cache import result_key
+
+# Compute the likely next page after each response so "more" is a cache hit
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() == "true"
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+# Prefetches queued or running at once, responses above it are not prefetched
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "8"))
+PREFETCH_TTL = int(os.getenv("PREFETCH_TTL", "300"))
+PREFETCH_MAX_ENTRIES = int(os.getenv("PREFETCH_MAX_ENTRIES", "256"))
+
+
+def page_key(request_json, previous_ids, cursor):
+    return result_key(request_json) + (cursor, tuple(sorted(set(previous_ids or []))))
+
+
+def next_page(previous_ids, result):
+    """previous_ids of the follow-up request: everything shown so far"""
+    shown = [movie["id"] for movie in result.get("recommended_movies", [])]
+    return list(previous_ids or []) + shown
+
+
+class Prefetcher:
+    """
+    Computes follow-up pages in the background and keeps each one until
+    its request arrives (then it is handed out once) or it expires.
+
+    `compute(request_json, previous_ids, cursor)` returns a response.
+    A prefetch that is still running when its request arrives is waited
+    for instead of being computed twice.
+    """
+
+    def __init__(self, compute, ttl=PREFETCH_TTL, max_pending=PREFETCH_MAX_PENDING,
+                 max_entries=PREFETCH_MAX_ENTRIES, workers=PREFETCH_WORKERS):
+        self.compute = compute
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, request_json, previous_ids, result):
+        """Starts computing the page after result, returns False when over budget"""
+        cursor = result.get("cursor")
+        if not cursor or not result.get("recommended_movies") or result.get("degraded"):
+            return False
+
+        following = next_page(previous_ids, result)
+        key = page_key(request_json, following, cursor)
+        with self._lock:
+            if key in self._entries or key in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                metrics.incr("prefetch.skipped")
+                return False
+            self._pending[key] = self._pool.submit(self._run, key, dict(request_json), following, cursor)
+        metrics.incr("prefetch.scheduled")
+        return True
+
+    def _run(self, key, request_json, previous_ids, cursor):
+        try:
+            result = self.compute(request_json, previous_ids, cursor)
+            if result.get("recommended_movies") and not result.get("degraded") and "error" not in result:
+                self._store(key, result)
+            else:
+                metrics.incr("prefetch.empty")
+        except Exception as e:
+            metrics.incr("prefetch.failed")
+            print(f"❌ Prefetching next page failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _store(self, key, result):
+        with self._lock:
+            self._expire()
+            self._entries[key] = (copy.deepcopy(result), time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.incr("prefetch.wasted")
+        metrics.incr("prefetch.stored")
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [k for k, (_, expires_at) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+            metrics.incr("prefetch.wasted")
+
+    def take(self, request_json, previous_ids, cursor, deadline=None):
+        """The prefetched page for this request (waiting for one in flight), None otherwise"""
+        key = page_key(request_json, previous_ids, cursor)
+        with self._lock:
+            pending = self._pending.get(key)
+
+        if pending is not None:
+            metrics.incr("prefetch.joined")
+            if deadline is not None:
+                deadline.wait(pending)
+            else:
+                pending.result()
+
+        with self._lock:
+            self._expire()
+            entry = self._entries.pop(key, None)
+
+        if entry is None:
+            metrics.incr("prefetch.miss")
+            return None
+        metrics.incr("prefetch.hit")
+        return entry[0]
+
+    def hit_rate(self):
+        lookups = metrics.counter("prefetch.hit") + metrics.counter("prefetch.miss")
+        return round(metrics.counter("prefetch.hit") / lookups, 4) if lookups else 0.0
+
+    def waste_rate(self):
+        stored = metrics.counter("prefetch.stored")
+        return round(metrics.counter("prefetch.wasted") / stored, 4) if stored else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
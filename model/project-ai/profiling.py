@@ -0,0 +1,170 @@
+"""
+Opt-in per-request profiling.
+
+With PROFILING_ENABLED=true a request is profiled when it sends the
+`X-Profile: 1` header, or at random with probability PROFILE_SAMPLE_RATE.
+A profiled request records a cProfile CPU profile of the handling thread
+plus the top tracemalloc allocation sites. Both are written to PROFILE_DIR
+and listed by the admin endpoints in app.py.
+
+Work the request hands to other pools (the LLM call, hedged attempts,
+partition scans) is not profiled, it only shows up as the handling thread
+waiting on it. tracemalloc traces the whole process, so the allocation
+report also covers concurrent requests. Only one request is profiled at a time.
+"""
+import os
+import io
+import re
+import json
+import time
+import random
+import pstats
+import cProfile
+import secrets
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Rows kept in the CPU and allocation reports
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "25"))
+# Older profiles are deleted beyond this many
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+CPU_REPORT_NOTE = ("CPU profile of the handling thread only. Work on other pools (LLM calls, hedges, "
+                   "partition scans) appears as time spent waiting on it.\n\n")
+
+PROFILE_ID_PATTERN = re.compile(r"^\d{8}-\d{6}-[A-Za-z0-9_-]+$")
+
+_active = threading.Lock()
+
+
+def should_profile(header_value=None, enabled=None, sample_rate=None):
+    enabled = PROFILING_ENABLED if enabled is None else enabled
+    sample_rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not enabled:
+        return False
+    if header_value and header_value.strip().lower() in ("1", "true", "yes"):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+def cpu_report(profiler, top_n):
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top_n)
+    return stream.getvalue()
+
+
+def allocation_report(snapshot, top_n):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    return [
+        {"location": str(stat.traceback), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+        for stat in snapshot.statistics("lineno")[:top_n]
+    ]
+
+
+def prune_profiles(profile_dir, keep):
+    summaries = sorted(name for name in os.listdir(profile_dir) if name.endswith(".json"))
+    for name in summaries[:max(0, len(summaries) - keep)]:
+        profile_id = name[:-len(".json")]
+        for suffix in (".json", ".prof", ".txt"):
+            try:
+                os.remove(os.path.join(profile_dir, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(name, profiler, snapshot, duration, peak, profile_dir, top_n):
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_urlsafe(6)}"
+    os.makedirs(profile_dir, exist_ok=True)
+    base = os.path.join(profile_dir, profile_id)
+
+    profiler.dump_stats(base + ".prof")
+    allocations = allocation_report(snapshot, top_n)
+    with open(base + ".txt", "w") as f:
+        f.write(CPU_REPORT_NOTE)
+        f.write(cpu_report(profiler, top_n))
+        f.write("\nTop allocations:\n")
+        for alloc in allocations:
+            f.write(f"{alloc['size_kb']:>10.1f} KB {alloc['count']:>8} blocks  {alloc['location']}\n")
+    with open(base + ".json", "w") as f:
+        json.dump({
+            "id": profile_id,
+            "name": name,
+            "created": time.time(),
+            "duration_ms": round(duration * 1000, 2),
+            "peak_traced_kb": round(peak / 1024, 1),
+            "top_allocations": allocations,
+        }, f)
+
+    prune_profiles(profile_dir, PROFILE_KEEP)
+    print(f"PROFILE -> {name} took {duration * 1000:.0f} ms, saved as {profile_id}")
+    return profile_id
+
+
+@contextmanager
+def profile_request(name, enabled=True, profile_dir=None, top_n=None):
+    """
+    Profile the enclosed block. Yields a dict whose "id" is set to the
+    profile id, or stays None when profiling was skipped.
+    """
+    info = {"id": None}
+    if not enabled or not _active.acquire(blocking=False):
+        yield info
+        return
+
+    profile_dir = profile_dir or PROFILE_DIR
+    top_n = top_n or PROFILE_TOP_N
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    started = time.monotonic()
+
+    try:
+        profiler.enable()
+        try:
+            yield info
+        finally:
+            # Also runs when the request fails, slow failures are worth a look too
+            profiler.disable()
+            duration = time.monotonic() - started
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            info["id"] = save_profile(name, profiler, snapshot, duration, peak, profile_dir, top_n)
+    finally:
+        _active.release()
+
+
+def list_profiles(profile_dir=None, limit=20):
+    """Summaries of the most recent profiles, newest first"""
+    profile_dir = profile_dir or PROFILE_DIR
+    if not os.path.isdir(profile_dir):
+        return []
+    names = sorted((n for n in os.listdir(profile_dir) if n.endswith(".json")), reverse=True)[:limit]
+    summaries = []
+    for name in names:
+        with open(os.path.join(profile_dir, name)) as f:
+            summary = json.load(f)
+        summary.pop("top_allocations", None)
+        summaries.append(summary)
+    return summaries
+
+
+def read_profile_report(profile_id, profile_dir=None):
+    """Text report of a profile, None for unknown or malformed ids"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(profile_dir or PROFILE_DIR, profile_id + ".txt")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read()
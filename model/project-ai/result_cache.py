@@ -0,0 +1,101 @@
+import os
+import copy
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from candidate_cache import retrieval_key
+
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "900"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+# Distinct preference combinations counted for the cache warmer
+TRACKER_MAX_KEYS = int(os.getenv("TRACKER_MAX_KEYS", "10000"))
+
+
+def result_key(request_json):
+    return retrieval_key(request_json) + (request_json.get("number_recommended", 3),)
+
+
+class ResultEntry:
+    __slots__ = ("result", "expires_at", "warmed")
+
+    def __init__(self, result, expires_at, warmed):
+        self.result = result
+        self.expires_at = expires_at
+        # Stored by the cache warmer rather than by a user request
+        self.warmed = warmed
+
+
+class ResultCache:
+    """
+    Final first-page responses keyed by the full preferences, so repeated
+    popular queries skip retrieval and the AI call.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, key, result, warmed=False):
+        entry = ResultEntry(copy.deepcopy(result), time.monotonic() + self.ttl, warmed)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """(result, warmed) for a live entry, None otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(entry.result), entry.warmed
+
+    def ttl_left(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return None if entry is None else entry.expires_at - time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PreferenceTracker:
+    """Counts first-page preference payloads so the warmer knows what is popular"""
+
+    def __init__(self, max_keys=TRACKER_MAX_KEYS):
+        self.max_keys = max_keys
+        self._counts = Counter()
+        self._payloads = {}
+        self._lock = threading.Lock()
+
+    def record(self, request_json):
+        key = result_key(request_json)
+        with self._lock:
+            self._counts[key] += 1
+            self._payloads[key] = dict(request_json)
+            if len(self._counts) > self.max_keys:
+                # Keep the most common half, rare combinations are not worth warming
+                keep = dict(self._counts.most_common(self.max_keys // 2))
+                self._counts = Counter(keep)
+                self._payloads = {k: self._payloads[k] for k in keep}
+
+    def top(self, n):
+        with self._lock:
+            return [dict(self._payloads[key]) for key, _ in self._counts.most_common(n)]
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._payloads.clear()
@@ -0,0 +1,152 @@
+import os
+import json
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from local_ranker import LOCAL_RANKERS
+from metrics import metrics
+
+# Local ranker run next to the AI on the same candidates (see LOCAL_RANKERS), empty disables shadowing
+SHADOW_RANKER = os.getenv("SHADOW_RANKER", "")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "1.0"))
+# One JSON line per comparison
+SHADOW_LOG = os.getenv("SHADOW_LOG", "logs/shadow_ranker.jsonl")
+SHADOW_WORKERS = int(os.getenv("SHADOW_WORKERS", "2"))
+# Shadow rankings waiting or running, requests above it are not shadowed
+SHADOW_MAX_PENDING = int(os.getenv("SHADOW_MAX_PENDING", "32"))
+
+# Recent comparisons averaged by the /metrics gauges
+SHADOW_WINDOW = 1000
+
+
+def overlap_at_k(reference, candidate, k):
+    """Share of the reference top k that the candidate ranking also puts in its top k"""
+    if k <= 0 or not reference:
+        return None
+    return len(set(reference[:k]) & set(candidate[:k])) / min(k, len(reference))
+
+
+def rank_correlation(reference, candidate):
+    """
+    Spearman correlation between the reference order and the order the
+    candidate ranking gives the same movies (None for fewer than two).
+    """
+    position = {movie_id: i for i, movie_id in enumerate(candidate)}
+    shared = [movie_id for movie_id in reference if movie_id in position]
+    n = len(shared)
+    if n < 2:
+        return None
+    candidate_rank = {movie_id: rank for rank, movie_id in enumerate(sorted(shared, key=position.get))}
+    d2 = sum((i - candidate_rank[movie_id]) ** 2 for i, movie_id in enumerate(shared))
+    return 1 - 6 * d2 / (n * (n * n - 1))
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 4) if values else None
+
+
+class ShadowRanker:
+    """
+    Ranks the AI's candidates with a local ranker on a background pool and,
+    once the AI has answered, compares both rankings. Nothing here blocks
+    the request: the local ranking starts before the AI call and the
+    comparison runs when both are done.
+    """
+
+    def __init__(self, name=SHADOW_RANKER, sample_rate=SHADOW_SAMPLE_RATE, log_path=SHADOW_LOG,
+                 workers=SHADOW_WORKERS, max_pending=SHADOW_MAX_PENDING):
+        self.name = name
+        self.ranker = LOCAL_RANKERS.get(name)
+        if name and self.ranker is None:
+            print(f"❌ Unknown shadow ranker {name}, shadowing disabled")
+        self.sample_rate = sample_rate
+        self.log_path = log_path
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._overlaps = deque(maxlen=SHADOW_WINDOW)
+        self._correlations = deque(maxlen=SHADOW_WINDOW)
+
+    @property
+    def enabled(self):
+        return self.ranker is not None
+
+    def start(self, candidates, request_json):
+        """Future of (full local ranking, seconds) or None when this request is not shadowed"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            if self._pending >= self.max_pending:
+                metrics.incr("shadow.skipped")
+                return None
+            self._pending += 1
+        return self._pool.submit(self._rank, candidates, dict(request_json))
+
+    def _rank(self, candidates, request_json):
+        try:
+            started = time.monotonic()
+            ranking = self.ranker(candidates, len(candidates), request_json)
+            return ranking, time.monotonic() - started
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def compare(self, shadow, ai_ids, ai_latency, k):
+        """Records the comparison on the pool once the local ranking is done"""
+        if shadow is None:
+            return
+        ai_ids = list(ai_ids)
+        # A done future runs the callback right here on the request thread, keep the file write off it
+        shadow.add_done_callback(lambda future: self._pool.submit(self._record, future, ai_ids, ai_latency, k))
+
+    def _record(self, future, ai_ids, ai_latency, k):
+        try:
+            ranking, local_latency = future.result()
+            overlap = overlap_at_k(ai_ids, ranking, k)
+            correlation = rank_correlation(ai_ids, ranking)
+
+            metrics.incr("shadow.compared")
+            metrics.observe("shadow.local_latency", local_latency)
+            metrics.observe("shadow.llm_latency", ai_latency)
+            with self._lock:
+                self._overlaps.append(overlap)
+                self._correlations.append(correlation)
+
+            self._log({
+                "time": round(time.time(), 3),
+                "ranker": self.name,
+                "k": k,
+                "overlap_at_k": overlap,
+                "rank_correlation": correlation,
+                "local_ms": round(local_latency * 1000, 3),
+                "llm_ms": round(ai_latency * 1000, 3),
+                "ai_ids": ai_ids,
+                "local_ids": ranking[:k],
+            })
+        except Exception as e:
+            metrics.incr("shadow.failed")
+            print(f"❌ Shadow ranking failed: {e}")
+
+    def _log(self, entry):
+        if not self.log_path:
+            return
+        with self._log_lock:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def mean_overlap(self):
+        with self._lock:
+            return _mean(self._overlaps)
+
+    def mean_correlation(self):
+        with self._lock:
+            return _mean(self._correlations)
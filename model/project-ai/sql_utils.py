@@ -1,14 +1,24 @@
 
-def build_sql_query(preferred_length=None, language=None, era=None, previous_ids=None):
-    query = ("SELECT id, title, overview, genres, production_countries, popularity, "
-             "imdb_rating, runtime, year, original_language, director, poster_path, release_date "
-             "FROM movies WHERE 1=1")
+MOVIE_COLUMNS = ("id, title, overview, genres, production_countries, popularity, "
+                 "imdb_rating, runtime, year, original_language, director, poster_path, release_date")
+
+# Everything but the overview, for databases that keep overviews in the compressed store
+RETRIEVAL_COLUMNS = ", ".join(c.strip() for c in MOVIE_COLUMNS.split(",") if c.strip() != "overview")
+
+RUNTIME_TOLERANCE = 20
+
+
+def runtime_range(preferred_length):
+    return max(0, preferred_length - RUNTIME_TOLERANCE), preferred_length + RUNTIME_TOLERANCE
+
+
+def build_sql_query(preferred_length=None, language=None, era=None, previous_ids=None, columns=MOVIE_COLUMNS,
+                    table="movies"):
+    query = f"SELECT {columns} FROM {table} WHERE 1=1"
     params = []
 
     if preferred_length:
-        tolerance = 20
-        min_time = max(0, preferred_length - tolerance)
-        max_time = preferred_length + tolerance
+        min_time, max_time = runtime_range(preferred_length)
         query += " AND runtime BETWEEN ? AND ?"
         params.extend([min_time, max_time])
 
@@ -30,3 +40,19 @@ def build_sql_query(preferred_length=None, language=None, era=None, previous_ids
 
     query += " ORDER BY popularity DESC, imdb_rating DESC"
     return query, params
+
+
+def build_ids_query(ids, columns=MOVIE_COLUMNS):
+    placeholders = ','.join('?' * len(ids))
+    query = f"SELECT {columns} FROM movies WHERE id IN ({placeholders})"
+    return query, list(ids)
+
+
+def build_similar_query(movie_id, limit, columns=MOVIE_COLUMNS):
+    # Range scan on the movie_neighbors primary key, joined to the movie details
+    query = (
+        "SELECT n.score, " + ", ".join(f"m.{c.strip()}" for c in columns.split(",")) +
+        " FROM movie_neighbors n JOIN movies m ON m.id = n.neighbor_id"
+        " WHERE n.movie_id = ? ORDER BY n.rank LIMIT ?"
+    )
+    return query, [movie_id, limit]
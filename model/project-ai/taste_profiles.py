@@ -0,0 +1,169 @@
+"""
+Per-user taste vectors over the same fixed-size feature space as the
+catalog's taste_features array: hashed genres, languages, eras, directors
+and overview words. A profile is moved towards the features of each movie
+a user keeps in their history in O(dims), and scoring candidates is one
+matrix-vector product against the catalog rows.
+"""
+import os
+import zlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from mood_affinity import overview_words
+
+# Hashed slots per feature block, the total is the vector size
+GENRE_DIMS = 24
+LANGUAGE_DIMS = 16
+ERA_DIMS = 3
+DIRECTOR_DIMS = 16
+TEXT_DIMS = 32
+TASTE_DIMS = GENRE_DIMS + LANGUAGE_DIMS + ERA_DIMS + DIRECTOR_DIMS + TEXT_DIMS
+
+# Share of each block in a movie vector
+BLOCK_WEIGHTS = {"genre": 0.45, "language": 0.15, "era": 0.15, "director": 0.1, "text": 0.15}
+
+PROFILE_DB = os.getenv("PROFILE_DB", "datasets/user_profiles.db")
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+# Floor of the update rate, so a long history still follows new interests
+TASTE_MIN_RATE = float(os.getenv("TASTE_MIN_RATE", "0.05"))
+
+# Overview words shorter than this carry little taste signal
+MIN_WORD_LENGTH = 4
+
+
+def slot(value, size):
+    # crc32 rather than hash() so the slots are the same in every process
+    return zlib.crc32(str(value).encode("utf-8")) % size
+
+
+def _block(values, size, weight):
+    block = np.zeros(size, dtype=np.float32)
+    for value in values:
+        block[slot(value, size)] += 1.0
+    norm = np.linalg.norm(block)
+    return block * (np.sqrt(weight) / norm) if norm else block
+
+
+def era_slot(year):
+    # Same bounds as the era filter in build_sql_query
+    if year is None or year != year:
+        return None
+    if year <= 1990:
+        return 0
+    return 1 if year <= 2020 else 2
+
+
+def movie_vector(genres, language, year, director, overview):
+    """Unit length feature vector of one movie"""
+    era = era_slot(year)
+    era_block = np.zeros(ERA_DIMS, dtype=np.float32)
+    if era is not None:
+        era_block[era] = np.sqrt(BLOCK_WEIGHTS["era"])
+
+    words = [w for w in overview_words(overview) if len(w) >= MIN_WORD_LENGTH]
+    vector = np.concatenate([
+        _block(genres, GENRE_DIMS, BLOCK_WEIGHTS["genre"]),
+        _block([language] if isinstance(language, str) else [], LANGUAGE_DIMS, BLOCK_WEIGHTS["language"]),
+        era_block,
+        _block([director] if isinstance(director, str) else [], DIRECTOR_DIMS, BLOCK_WEIGHTS["director"]),
+        _block(words, TEXT_DIMS, BLOCK_WEIGHTS["text"]),
+    ])
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).astype(np.float32)
+
+
+def taste_features(genre_lists, languages, years, directors, overviews):
+    """float32 (movies, TASTE_DIMS) matrix of movie vectors"""
+    matrix = np.zeros((len(genre_lists), TASTE_DIMS), dtype=np.float32)
+    for row, values in enumerate(zip(genre_lists, languages, years, directors, overviews)):
+        matrix[row] = movie_vector(*values)
+    return matrix
+
+
+class ProfileStore:
+    """Taste vector per user, kept in an LRU in memory and written through to SQLite"""
+
+    def __init__(self, path=PROFILE_DB, dims=TASTE_DIMS, max_cached=PROFILE_CACHE_SIZE, min_rate=TASTE_MIN_RATE):
+        self.path = path
+        self.dims = dims
+        self.max_cached = max_cached
+        self.min_rate = min_rate
+        self._cache = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_profiles ("
+                "user_id TEXT PRIMARY KEY, vector BLOB NOT NULL, interactions INTEGER NOT NULL, updated_at REAL)"
+            )
+        return self._conn
+
+    def _load(self, user_id):
+        if user_id in self._cache:
+            self._cache.move_to_end(user_id)
+            return self._cache[user_id]
+
+        row = self._connect().execute(
+            "SELECT vector, interactions FROM user_profiles WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        profile = None
+        if row is not None:
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            # Profiles written for another vector size start over
+            if len(vector) == self.dims:
+                profile = [vector.copy(), row[1]]
+        if profile is None:
+            profile = [np.zeros(self.dims, dtype=np.float32), 0]
+
+        self._cache[user_id] = profile
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return profile
+
+    def get(self, user_id):
+        """The user's taste vector, None without any recorded interaction"""
+        with self._lock:
+            vector, interactions = self._load(user_id)
+            return vector.copy() if interactions else None
+
+    def interactions(self, user_id):
+        with self._lock:
+            return self._load(user_id)[1]
+
+    def update(self, user_id, features, weight=1.0):
+        """
+        Moves the vector towards each row of features (away from it for a
+        negative weight): a running mean for the first interactions, an
+        exponential average with rate TASTE_MIN_RATE after that.
+        """
+        features = np.atleast_2d(np.asarray(features, dtype=np.float32))
+        with self._lock:
+            profile = self._load(user_id)
+            vector, interactions = profile
+            for row in features:
+                interactions += 1
+                rate = max(1.0 / interactions, self.min_rate)
+                vector += np.float32(rate) * (np.float32(weight) * row - vector)
+            profile[1] = interactions
+
+            self._connect().execute(
+                "INSERT OR REPLACE INTO user_profiles (user_id, vector, interactions, updated_at) VALUES (?, ?, ?, ?)",
+                (user_id, vector.tobytes(), interactions, time.time()),
+            )
+            self._conn.commit()
+            return vector.copy()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,57 @@
+import sqlite3
+import pytest
+import numpy as np
+import pandas as pd
+
+
+def make_movies(n=120, seed=7):
+    """Movies table rows with a mix of genres, languages, eras and runtimes"""
+    rng = np.random.default_rng(seed)
+    genre_pool = ['Action', 'Comedy', 'Drama', 'Romance', 'Horror', 'Thriller', 'Adventure']
+    country_pool = ['United States of America', 'France', 'Japan', 'United Kingdom']
+    rows = []
+    for i in range(n):
+        k = int(rng.integers(0, 3))
+        genres = [str(g) for g in rng.choice(genre_pool, size=k, replace=False)]
+        countries = [str(c) for c in rng.choice(country_pool, size=int(rng.integers(1, 3)), replace=False)]
+        rows.append({
+            'id': i + 1,
+            'title': f'Movie {i}',
+            'overview': f'Overview of movie {i}',
+            'genres': str(genres),
+            'production_countries': str(countries),
+            'popularity': float(rng.integers(1, 60)),
+            'imdb_rating': float(rng.integers(1, 10)),
+            'runtime': int(rng.integers(50, 200)),
+            'year': int(rng.integers(1970, 2025)),
+            'original_language': ['en', 'en', 'fr', 'de'][i % 4],
+            'director': f'Director {i % 10}',
+            'poster_path': f'/poster{i}.jpg',
+            'release_date': '2000-01-01'
+        })
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def movies_frame():
+    """Sample movies table"""
+    return make_movies()
+
+
+@pytest.fixture
+def catalog_conn(movies_frame):
+    """In-memory SQLite database with the sample movies table"""
+    conn = sqlite3.connect(":memory:")
+    movies_frame.to_sql('movies', conn, index=False)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def movie_db(tmp_path, movies_frame):
+    """SQLite database file with the sample movies table"""
+    path = tmp_path / "movie_dataset.db"
+    conn = sqlite3.connect(path)
+    movies_frame.to_sql('movies', conn, index=False)
+    conn.close()
+    return str(path)
@@ -0,0 +1,116 @@
+import threading
+import time
+import pytest
+from admission import AdmissionController, Overloaded
+from deadlines import Cancelled, Deadline
+
+
+class TestAdmissionController:
+    """Test the concurrency limiter and bounded wait queue"""
+
+    def test_admits_within_limit(self):
+        """Test that calls under the limit run immediately"""
+        controller = AdmissionController(max_concurrency=2, max_queue=0, queue_timeout=0.1)
+        with controller.admit():
+            assert controller.in_flight == 1
+            with controller.admit():
+                assert controller.in_flight == 2
+        assert controller.in_flight == 0
+
+    def test_queue_full_rejected_with_429(self):
+        """Test that requests beyond the queue fail fast"""
+        controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=5)
+        with controller.admit():
+            with pytest.raises(Overloaded) as exc:
+                with controller.admit():
+                    pass
+        assert exc.value.status_code == 429
+        assert exc.value.retry_after >= 1
+
+    def test_queue_timeout_rejected_with_503(self):
+        """Test that waiting longer than the queue timeout fails"""
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.05)
+        with controller.admit():
+            with pytest.raises(Overloaded) as exc:
+                with controller.admit():
+                    pass
+        assert exc.value.status_code == 503
+        assert controller.waiting == 0
+
+    def test_waiting_request_admitted_when_slot_frees(self):
+        """Test that a queued request runs once a slot is released"""
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+        release = threading.Event()
+        done = []
+
+        def holder():
+            with controller.admit():
+                release.wait(5)
+
+        def waiter():
+            with controller.admit():
+                done.append(True)
+
+        first = threading.Thread(target=holder)
+        first.start()
+        while controller.in_flight == 0:
+            pass
+        second = threading.Thread(target=waiter)
+        second.start()
+        while controller.waiting == 0:
+            pass
+        release.set()
+        first.join()
+        second.join()
+        assert done == [True]
+
+    def test_slot_released_on_error(self):
+        """Test that exceptions inside the block release the slot"""
+        controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=0.1)
+        with pytest.raises(ValueError):
+            with controller.admit():
+                raise ValueError("boom")
+        with controller.admit():
+            assert controller.in_flight == 1
+
+    def test_wait_ends_with_deadline(self):
+        """Test a queued request gives up when its deadline passes before the queue timeout"""
+        controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=5)
+        started = time.monotonic()
+        with controller.admit():
+            with pytest.raises(Cancelled):
+                controller.hold(Deadline(0.05))
+        assert time.monotonic() - started < 2
+        assert controller.waiting == 0
+
+    def test_abandoned_call_keeps_slot(self):
+        """Test a cancelled request's call holds its slot until it returns"""
+        controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=0.1)
+        deadline = Deadline(10)
+        finish = threading.Event()
+        threading.Timer(0.05, deadline.cancel).start()
+
+        with pytest.raises(Cancelled):
+            controller.run(deadline, finish.wait, 5)
+        assert controller.in_flight == 1
+        with pytest.raises(Overloaded):
+            controller.hold()
+
+        finish.set()
+        for _ in range(50):
+            if controller.in_flight == 0:
+                break
+            time.sleep(0.01)
+        assert controller.in_flight == 0
+        controller.hold()()
+
+    def test_run_result(self):
+        """Test results pass through and the slot is given back"""
+        controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=0.1)
+        assert controller.run(Deadline(10), lambda x: x + 1, 41) == 42
+        time.sleep(0.01)
+        assert controller.in_flight == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
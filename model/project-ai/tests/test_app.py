@@ -1,12 +1,38 @@
-
+import sqlite3
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, Mock
-from app import app
+import main
+from app import MAX_BULK_IDS, app
+from admission import Overloaded
+from data_version import ReloadInProgress
+from deadlines import DEADLINE, Cancelled
+from event_log import EventLog
+from catalog import Catalog, encode_catalog
+from facets import FacetIndex
+from taste_profiles import ProfileStore
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def empty_result_cache():
+    """Every test starts without cached first-page results"""
+    main.result_cache.clear()
+    main.preference_tracker.clear()
+    yield
+    main.result_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def event_log(tmp_path):
+    """Recommendation events go to a temporary database"""
+    log = EventLog(str(tmp_path / "events.db"))
+    with patch.object(main, 'event_log', log):
+        yield log
+    log.stop()
+
+
 class TestHealthEndpoints:
     """Test health check and root endpoints"""
     
@@ -27,6 +53,15 @@ class TestHealthEndpoints:
         assert data["status"] == "ok"
         assert data["service"] == "movie-recommendation-api"
 
+    def test_metrics_endpoint(self):
+        """Test metrics endpoint returns counters, timings and gauges"""
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        data = response.json()
+        assert "counters" in data
+        assert "timings" in data
+        assert "llm.in_flight" in data["gauges"]
+
 
 class TestRecommendEndpoint:
     """Test the /recommend POST endpoint"""
@@ -112,6 +147,393 @@ class TestRecommendEndpoint:
         assert call_args.get("number_recommended") == 3  # Default value
 
 
+    @patch('app.recommend_movies')
+    def test_cursor_passed_separately(self, mock_recommend):
+        """Test that the cursor is passed to recommend_movies and not kept in preferences"""
+        mock_recommend.return_value = {"recommended_movies": [], "cursor": "abc"}
+
+        payload = {"mood": "happy", "previous_ids": [1, 2], "cursor": "abc"}
+
+        response = client.post("/recommend", json=payload)
+        assert response.status_code == 200
+        assert response.json()["cursor"] == "abc"
+
+        args, kwargs = mock_recommend.call_args
+        assert "cursor" not in args[0]
+        assert args[1] == [1, 2]
+        assert kwargs["cursor"] == "abc"
+
+
+    @patch('app.recommend_movies')
+    def test_overload_returns_retry_after(self, mock_recommend):
+        """Test that overload maps to its status code with Retry-After"""
+        mock_recommend.side_effect = Overloaded("busy", retry_after=7, status_code=429)
+
+        response = client.post("/recommend", json={"mood": "happy"})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "7"
+        assert response.json()["recommended_movies"] == []
+
+
+class TestRecommendUser:
+    """Test which user a /recommend request is personalized for"""
+
+    @pytest.fixture(autouse=True)
+    def id_tokens(self):
+        """Only the token "token-u1" verifies, as user u1"""
+        tokens = {"Bearer token-u1": "u1"}
+        with patch('app.verified_uid', side_effect=lambda header: tokens.get(header)):
+            yield
+
+    def user_id(self, mock_recommend, headers):
+        """user_id the pipeline got for a request made as u1"""
+        mock_recommend.return_value = {"recommended_movies": []}
+        client.post("/recommend", json={"mood": "happy", "user_id": "u1"}, headers=headers)
+        return mock_recommend.call_args[0][0]["user_id"]
+
+    @patch('app.recommend_movies')
+    def test_signed_request(self, mock_recommend):
+        """Test a request signed with the user's ID token keeps the user_id"""
+        assert self.user_id(mock_recommend, {"Authorization": "Bearer token-u1"}) == "u1"
+
+    @patch('app.recommend_movies')
+    def test_unverified_user_served_anonymously(self, mock_recommend):
+        """Test a user_id without a matching token is not used to read a taste vector"""
+        assert self.user_id(mock_recommend, {}) is None
+        assert self.user_id(mock_recommend, {"Authorization": "Bearer forged"}) is None
+
+
+class TestRecommendDeadline:
+    """Test request deadlines on /recommend"""
+
+    @patch('app.recommend_movies')
+    def test_deadline_passed_to_pipeline(self, mock_recommend):
+        """Test the pipeline gets a live deadline for the request"""
+        mock_recommend.return_value = {"recommended_movies": []}
+        client.post("/recommend", json={"mood": "happy"})
+        deadline = mock_recommend.call_args.kwargs["deadline"]
+        assert deadline.remaining() > 0
+
+    @patch('app.recommend_movies')
+    def test_deadline_exceeded(self, mock_recommend):
+        """Test an expired request answers 504"""
+        mock_recommend.side_effect = Cancelled(DEADLINE)
+        response = client.post("/recommend", json={"mood": "happy"})
+        assert response.status_code == 504
+        assert response.json()["recommended_movies"] == []
+
+
+class TestRecommendPrefetch:
+    """Test scheduling the next page after /recommend"""
+
+    @patch('app.recommend_movies')
+    def test_next_page_scheduled(self, mock_recommend):
+        """Test the response is followed by a prefetch of the next page"""
+        mock_recommend.return_value = {"recommended_movies": [{"id": 4, "content": "x"}], "cursor": "c"}
+        with patch('app.PREFETCH_ENABLED', True), patch.object(main, 'prefetcher') as prefetcher:
+            response = client.post("/recommend", json={"mood": "happy", "previous_ids": [1]})
+        assert response.status_code == 200
+        payload, previous_ids, result = prefetcher.schedule.call_args[0]
+        assert payload["mood"] == "happy"
+        assert previous_ids == [1]
+        assert result["cursor"] == "c"
+
+    @patch('app.recommend_movies')
+    def test_disabled(self, mock_recommend):
+        """Test nothing is scheduled when prefetching is off"""
+        mock_recommend.return_value = {"recommended_movies": [], "cursor": "c"}
+        with patch('app.PREFETCH_ENABLED', False), patch.object(main, 'prefetcher') as prefetcher:
+            client.post("/recommend", json={"mood": "happy"})
+        prefetcher.schedule.assert_not_called()
+
+
+class TestMoviesEndpoints:
+    """Test the catalog-backed movie lookup endpoints"""
+
+    @pytest.fixture
+    def catalog(self, movies_frame):
+        """Catalog built from the sample movies"""
+        arrays, meta = encode_catalog(movies_frame)
+        catalog = Catalog(arrays, {**meta, "version": "v1"})
+        with patch.object(main, 'catalog', catalog):
+            yield catalog
+
+    def test_get_movie(self, catalog):
+        """Test single movie lookup with cache headers"""
+        response = client.get("/movies/3")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["id"] == 3
+        assert data["title"] == "Movie 2"
+        assert data["poster"] == "https://image.tmdb.org/t/p/w500/poster2.jpg"
+        assert response.headers["etag"].startswith('"v1-')
+        assert "max-age" in response.headers["cache-control"]
+
+    def test_get_movie_not_modified(self, catalog):
+        """Test that a matching If-None-Match returns 304"""
+        etag = client.get("/movies/3").headers["etag"]
+        response = client.get("/movies/3", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+    def test_get_movie_not_found(self, catalog):
+        """Test unknown ids return 404"""
+        response = client.get("/movies/99999")
+        assert response.status_code == 404
+
+    def test_bulk_lookup_keeps_order(self, catalog):
+        """Test bulk lookup returns movies in request order and lists missing ids"""
+        response = client.get("/movies", params={"ids": "5,99999,2"})
+        assert response.status_code == 200
+        data = response.json()
+        assert [m["id"] for m in data["movies"]] == [5, 2]
+        assert data["missing"] == [99999]
+
+    def test_bulk_lookup_etag_depends_on_ids(self, catalog):
+        """Test different id lists get different ETags"""
+        a = client.get("/movies", params={"ids": "1,2"}).headers["etag"]
+        b = client.get("/movies", params={"ids": "1,3"}).headers["etag"]
+        assert a != b
+        assert client.get("/movies", params={"ids": "1,2"}, headers={"If-None-Match": a}).status_code == 304
+
+    def test_bulk_lookup_invalid_ids(self, catalog):
+        """Test non integer ids are rejected"""
+        response = client.get("/movies", params={"ids": "1,abc"})
+        assert response.status_code == 400
+
+    def test_bulk_lookup_too_many_ids(self, catalog):
+        """Test the bulk lookup size limit"""
+        ids = ",".join(str(i) for i in range(200))
+        response = client.get("/movies", params={"ids": ids})
+        assert response.status_code == 400
+
+    def test_autocomplete(self, catalog):
+        """Test title suggestions ranked by popularity"""
+        response = client.get("/autocomplete", params={"prefix": "MOVIE 1", "limit": 3})
+        assert response.status_code == 200
+        suggestions = response.json()["suggestions"]
+        assert len(suggestions) == 3
+        assert all(s["title"].startswith("Movie 1") for s in suggestions)
+        rows = catalog.rows_for_ids([s["id"] for s in suggestions])
+        assert list(rows) == sorted(rows)
+        assert "etag" in response.headers
+
+    def test_autocomplete_limit_capped(self, catalog):
+        """Test the number of suggestions is capped"""
+        response = client.get("/autocomplete", params={"prefix": "movie", "limit": 1000})
+        assert len(response.json()["suggestions"]) == 25
+
+    def test_catalog_not_loaded(self):
+        """Test 503 while the catalog is loading"""
+        with patch.object(main, 'catalog', None):
+            response = client.get("/movies/1")
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+
+class TestFacetsEndpoint:
+    """Test the /facets endpoint"""
+
+    @pytest.fixture
+    def index(self, movies_frame):
+        """Facet index over the sample movies"""
+        arrays, meta = encode_catalog(movies_frame)
+        index = FacetIndex(Catalog(arrays, {**meta, "version": "v1"}))
+        with patch.object(main, 'facet_index', index):
+            yield index
+
+    def test_counts(self, index):
+        """Test counts per facet under the selected filters"""
+        response = client.get("/facets", params={"language": "fr", "selected_genres": ["Drama", "Action"]})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == index.total({"language": "fr", "selected_genres": ["Drama", "Action"]})
+        assert set(data["facets"]) == {"genres", "language", "country", "era", "preferred_length"}
+        assert set(data["facets"]["language"]) == {"en", "fr", "de"}
+        assert "etag" in response.headers
+
+    def test_not_modified(self, index):
+        """Test a matching If-None-Match returns 304"""
+        etag = client.get("/facets", params={"era": "old"}).headers["etag"]
+        response = client.get("/facets", params={"era": "old"}, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert client.get("/facets", params={"era": "new"}).headers["etag"] != etag
+
+    def test_catalog_not_loaded(self):
+        """Test 503 while the catalog is loading"""
+        with patch.object(main, 'facet_index', None):
+            response = client.get("/facets")
+        assert response.status_code == 503
+
+
+class TestSimilarEndpoint:
+    """Test the /similar endpoint"""
+
+    @patch('app.main.similar_movies')
+    def test_similar(self, mock_similar):
+        """Test similar movies are returned"""
+        mock_similar.return_value = {"movie_id": 1, "similar_movies": [{"content": "x", "id": 2, "score": 0.8}]}
+        response = client.get("/similar/1?limit=5")
+        assert response.status_code == 200
+        assert response.json()["similar_movies"][0]["id"] == 2
+        mock_similar.assert_called_once_with(1, 5)
+
+    @patch('app.main.similar_movies')
+    def test_no_neighbours(self, mock_similar):
+        """Test 404 when the movie has no neighbours"""
+        mock_similar.return_value = {"movie_id": 1, "similar_movies": []}
+        assert client.get("/similar/1").status_code == 404
+
+    @patch('app.main.similar_movies')
+    def test_table_missing(self, mock_similar):
+        """Test 503 when the neighbour job has not run"""
+        mock_similar.side_effect = sqlite3.OperationalError("no such table: movie_neighbors")
+        assert client.get("/similar/1").status_code == 503
+
+
+class TestProfiling:
+    """Test opt-in request profiling and the admin endpoints"""
+
+    @pytest.fixture
+    def profile_dir(self, tmp_path):
+        """Profiling enabled, writing into a temporary directory"""
+        with patch('profiling.PROFILING_ENABLED', True), \
+             patch('profiling.PROFILE_DIR', str(tmp_path)), \
+             patch('app.ADMIN_TOKEN', 'secret'):
+            yield tmp_path
+
+    @patch('app.recommend_movies')
+    def test_profile_header(self, mock_recommend, profile_dir):
+        """Test X-Profile profiles the request and returns its id"""
+        mock_recommend.return_value = {"recommended_movies": []}
+        response = client.post("/recommend", json={"mood": "happy"}, headers={"X-Profile": "1"})
+
+        profile_id = response.headers["X-Profile-Id"]
+        listing = client.get("/admin/profiles", headers={"X-Admin-Token": "secret"}).json()
+        assert listing["profiles"][0]["id"] == profile_id
+
+        report = client.get(f"/admin/profiles/{profile_id}", headers={"X-Admin-Token": "secret"})
+        assert report.status_code == 200
+        assert "Top allocations" in report.text
+
+    @patch('app.recommend_movies')
+    def test_not_profiled_without_header(self, mock_recommend, profile_dir):
+        """Test requests without the header are not profiled at sample rate 0"""
+        mock_recommend.return_value = {"recommended_movies": []}
+        response = client.post("/recommend", json={"mood": "happy"})
+        assert "X-Profile-Id" not in response.headers
+
+    def test_admin_requires_token(self, profile_dir):
+        """Test admin endpoints reject missing or wrong tokens"""
+        assert client.get("/admin/profiles").status_code == 403
+        assert client.get("/admin/profiles", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    def test_admin_disabled_without_token(self):
+        """Test admin endpoints are closed when ADMIN_TOKEN is unset"""
+        with patch('app.ADMIN_TOKEN', None):
+            assert client.get("/admin/profiles", headers={"X-Admin-Token": ""}).status_code == 403
+
+    def test_unknown_profile(self, profile_dir):
+        """Test 404 for unknown profile ids"""
+        response = client.get("/admin/profiles/20240101-000000-x", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 404
+
+
+class TestUserHistory:
+    """Test recording saved history into the user's taste vector"""
+
+    @pytest.fixture
+    def sample_catalog(self, movies_frame, tmp_path):
+        """In-memory catalog and a temporary profile store"""
+        arrays, meta = encode_catalog(movies_frame)
+        store = ProfileStore(str(tmp_path / "profiles.db"))
+        with patch.object(main, 'catalog', Catalog(arrays, meta)), patch.object(main, 'profile_store', store):
+            yield
+        store.close()
+
+    @pytest.fixture(autouse=True)
+    def id_tokens(self):
+        """Only the token "token-u1" verifies, as user u1"""
+        tokens = {"Bearer token-u1": "u1"}
+        with patch('app.verified_uid', side_effect=lambda header: tokens.get(header)), \
+                patch('app.ADMIN_TOKEN', "secret"):
+            yield
+
+    def post(self, user_id, movie_ids, headers={"Authorization": "Bearer token-u1"}):
+        """Posts history for a user, signed as u1 by default"""
+        return client.post(f"/users/{user_id}/history", json={"movie_ids": movie_ids}, headers=headers)
+
+    def test_records_known_movies(self, sample_catalog):
+        """Test known ids are applied and counted"""
+        response = self.post("u1", [1, 2, 9999])
+        assert response.status_code == 200
+        assert response.json() == {"applied": 2, "interactions": 2}
+
+    def test_too_many_ids(self, sample_catalog):
+        """Test oversized history batches are rejected"""
+        assert self.post("u1", list(range(MAX_BULK_IDS + 1))).status_code == 400
+
+    def test_catalog_loading(self):
+        """Test 503 while the catalog is not attached"""
+        with patch.object(main, 'catalog', None):
+            assert self.post("u1", [1]).status_code == 503
+
+    def test_token_required(self, sample_catalog):
+        """Test unsigned or invalid requests are rejected without touching the profile"""
+        assert self.post("u1", [1], headers={}).status_code == 401
+        assert self.post("u1", [1], headers={"Authorization": "Bearer forged"}).status_code == 401
+        assert main.profile_store.interactions("u1") == 0
+
+    def test_other_users_rejected(self, sample_catalog):
+        """Test a user cannot change another user's taste vector"""
+        assert self.post("u2", [1]).status_code == 403
+        assert main.profile_store.interactions("u2") == 0
+
+    def test_admin_token(self, sample_catalog):
+        """Test the admin token may record history for any user"""
+        assert self.post("u2", [1], headers={"X-Admin-Token": "secret"}).status_code == 200
+
+
+class TestAdminReload:
+    """Test the admin triggered data reload"""
+
+    @pytest.fixture
+    def admin(self):
+        """Admin endpoints enabled with a known token"""
+        with patch('app.ADMIN_TOKEN', 'secret'):
+            yield {"X-Admin-Token": "secret"}
+
+    def test_requires_token(self, admin):
+        """Test reloads without the token are refused"""
+        with patch('main.reload_data') as reload:
+            assert client.post("/admin/reload").status_code == 403
+            reload.assert_not_called()
+
+    def test_reports_versions(self, admin):
+        """Test the swapped in and replaced versions are returned"""
+        def reload():
+            main.data_version = Mock(version="v2")
+            return True
+
+        with patch.object(main, 'data_version', Mock(version="v1")), patch('main.reload_data', side_effect=reload):
+            response = client.post("/admin/reload", headers=admin)
+
+        assert response.status_code == 200
+        assert response.json() == {"reloaded": True, "version": "v2", "previous": "v1"}
+
+    def test_reload_running(self, admin):
+        """Test 409 while another reload is building"""
+        with patch('main.reload_data', side_effect=ReloadInProgress("A data reload is already running")):
+            response = client.post("/admin/reload", headers=admin)
+        assert response.status_code == 409
+
+    def test_failed_build(self, admin):
+        """Test 500 when the new database cannot be built"""
+        with patch('main.reload_data', side_effect=sqlite3.DatabaseError("file is not a database")):
+            response = client.post("/admin/reload", headers=admin)
+        assert response.status_code == 500
+        assert "not a database" in response.json()["error"]
+
+
 class TestCORS:
     """Test CORS configuration"""
     
@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+import pytest
+from cache_warmer import CacheWarmer, load_presets
+from metrics import metrics
+from result_cache import ResultCache, result_key
+
+
+class TestLoadPresets:
+    """Test reading the configured preset payloads"""
+
+    def test_reads_payloads(self, tmp_path):
+        """Test a JSON list of payloads is loaded"""
+        path = tmp_path / "presets.json"
+        path.write_text(json.dumps([{"mood": "happy"}, "not a payload"]))
+        assert load_presets(str(path)) == [{"mood": "happy"}]
+
+    def test_missing_or_invalid(self, tmp_path):
+        """Test missing and malformed files warm nothing"""
+        assert load_presets(None) == []
+        assert load_presets(str(tmp_path / "missing.json")) == []
+        path = tmp_path / "bad.json"
+        path.write_text("{")
+        assert load_presets(str(path)) == []
+
+
+class TestCacheWarmer:
+    """Test warming runs"""
+
+    def test_warms_distinct_payloads(self):
+        """Test presets and popular payloads are warmed once each, up to top_n"""
+        warmed = []
+        warmer = CacheWarmer(warmed.append,
+                             [lambda: [{"mood": "happy"}], lambda: [{"mood": "happy"}, {"mood": "sad"}, {"mood": "scared"}]],
+                             ResultCache(), top_n=2)
+        assert warmer.run_once() == 2
+        assert sorted(p["mood"] for p in warmed) == ["happy", "sad"]
+
+    def test_skips_entries_outliving_next_run(self):
+        """Test fresh cache entries are not recomputed"""
+        cache = ResultCache(ttl=1000)
+        cache.put(result_key({"mood": "happy"}), {})
+        warmed = []
+        warmer = CacheWarmer(warmed.append, [lambda: [{"mood": "happy"}, {"mood": "sad"}]], cache, interval=10)
+        warmer.run_once()
+        assert warmed == [{"mood": "sad"}]
+
+    def test_bounded_concurrency(self):
+        """Test no more than `concurrency` payloads are warmed at once"""
+        lock = threading.Lock()
+        active, peak = [0], [0]
+
+        def warm(payload):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+        payloads = [{"preferred_length": n} for n in range(8)]
+        CacheWarmer(warm, [lambda: payloads], ResultCache(), top_n=8, concurrency=2).run_once()
+        assert peak[0] <= 2
+
+    def test_failures_are_counted(self):
+        """Test a failing payload does not stop the run"""
+        metrics.reset()
+
+        def warm(payload):
+            if payload["mood"] == "bad":
+                raise RuntimeError("no movies")
+
+        warmer = CacheWarmer(warm, [lambda: [{"mood": "bad"}, {"mood": "good"}]], ResultCache())
+        warmer.run_once()
+        assert metrics.counter("warmer.failed") == 1
+        assert metrics.counter("warmer.warmed") == 1
+
+    def test_background_start_stop(self):
+        """Test the background loop runs at start and stops"""
+        warmed = threading.Event()
+        warmer = CacheWarmer(lambda p: warmed.set(), [lambda: [{"mood": "happy"}]], ResultCache(), interval=60)
+        warmer.start()
+        assert warmed.wait(2)
+        warmer.stop()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
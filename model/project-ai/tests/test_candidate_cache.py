@@ -0,0 +1,125 @@
+import pytest
+import pandas as pd
+from unittest.mock import patch
+from candidate_cache import CandidateCache, retrieval_key
+
+
+@pytest.fixture
+def frame():
+    """Small candidate frame"""
+    return pd.DataFrame({
+        'id': [1, 2, 3],
+        'overview': ['Overview A', 'Overview B', 'Overview C'],
+        'popularity': [90.0, 80.0, 70.0]
+    })
+
+
+class TestRetrievalKey:
+    """Test the cache key built from request preferences"""
+
+    def test_genre_order_does_not_matter(self):
+        """Test that genre order produces the same key"""
+        a = retrieval_key({"mood": "happy", "selected_genres": ["Comedy", "Drama"]})
+        b = retrieval_key({"mood": "happy", "selected_genres": ["Drama", "Comedy"]})
+        assert a == b
+
+    def test_number_recommended_ignored(self):
+        """Test that number_recommended is not part of the key"""
+        a = retrieval_key({"mood": "happy", "number_recommended": 3})
+        b = retrieval_key({"mood": "happy", "number_recommended": 10})
+        assert a == b
+
+    def test_different_preferences_differ(self):
+        """Test that different preferences produce different keys"""
+        assert retrieval_key({"mood": "happy"}) != retrieval_key({"mood": "sad"})
+
+
+class TestCandidateCache:
+    """Test the CandidateCache class"""
+
+    def test_put_returns_cursor(self, frame):
+        """Test that put returns an opaque cursor string"""
+        cache = CandidateCache()
+        cursor = cache.put("key", frame)
+        assert isinstance(cursor, str)
+        assert len(cache) == 1
+        assert cache.total_bytes > 0
+
+    def test_get_returns_entry(self, frame):
+        """Test that get returns the stored frame"""
+        cache = CandidateCache()
+        cursor = cache.put("key", frame)
+        entry = cache.get(cursor, "key")
+        assert entry is not None
+        assert list(entry.frame['id']) == [1, 2, 3]
+
+    def test_get_unknown_cursor(self):
+        """Test that unknown or missing cursors return None"""
+        cache = CandidateCache()
+        assert cache.get("missing", "key") is None
+        assert cache.get(None, "key") is None
+
+    def test_key_mismatch_returns_none(self, frame):
+        """Test that a cursor is only valid for its own preferences"""
+        cache = CandidateCache()
+        cursor = cache.put("key", frame)
+        assert cache.get(cursor, "other") is None
+
+    def test_version_mismatch_removed(self, frame):
+        """Test that candidates of another data version are dropped"""
+        cache = CandidateCache()
+        cursor = cache.put("key", frame, version="v1")
+        assert cache.get(cursor, "key", "v2") is None
+        assert len(cache) == 0
+
+    def test_expired_entry_removed(self, frame):
+        """Test that entries expire after the TTL"""
+        cache = CandidateCache(ttl=10)
+        with patch('candidate_cache.time.monotonic', return_value=100.0):
+            cursor = cache.put("key", frame)
+        with patch('candidate_cache.time.monotonic', return_value=111.0):
+            assert cache.get(cursor, "key") is None
+        assert len(cache) == 0
+        assert cache.total_bytes == 0
+
+    def test_memory_bound_evicts_least_recent(self, frame):
+        """Test that the least recently used entries are evicted first"""
+        size = int(frame.memory_usage(deep=True).sum())
+        cache = CandidateCache(max_bytes=size * 2)
+        first = cache.put("a", frame)
+        second = cache.put("b", frame)
+        cache.get(first, "a")  # first is now most recent
+        cache.put("c", frame)
+        assert cache.get(second, "b") is None
+        assert cache.get(first, "a") is not None
+        assert cache.total_bytes <= size * 2
+
+    def test_frame_larger_than_limit_not_cached(self, frame):
+        """Test that oversized frames are not stored"""
+        cache = CandidateCache(max_bytes=1)
+        assert cache.put("key", frame) is None
+        assert len(cache) == 0
+
+    def test_discard_and_clear(self, frame):
+        """Test removing entries"""
+        cache = CandidateCache()
+        cursor = cache.put("a", frame)
+        cache.put("b", frame)
+        cache.discard(cursor)
+        assert len(cache) == 1
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.total_bytes == 0
+
+    def test_set_ranking(self, frame):
+        """Test a full ranking is kept on the cursor entry"""
+        cache = CandidateCache()
+        cursor = cache.put("key", frame)
+        assert cache.get(cursor, "key").ranking is None
+        cache.set_ranking(cursor, [3, 1, 2])
+        cache.set_ranking("unknown", [1])
+        assert cache.get(cursor, "key").ranking == [3, 1, 2]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
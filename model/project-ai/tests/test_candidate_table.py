@@ -0,0 +1,107 @@
+import pytest
+import numpy as np
+import pandas as pd
+from candidate_table import CandidateTable, build_candidate_table, era_mask
+from catalog import Catalog, catalog_from_connection
+from filter_utils import filter_dataframe
+from sql_utils import build_sql_query
+
+
+def dynamic_ids(conn, request):
+    """Candidate ids produced by the SQL + filter_dataframe path"""
+    query, params = build_sql_query(request.get("preferred_length"), request.get("language"),
+                                    request.get("era"))
+    data = pd.read_sql_query(query, conn, params=params)
+    filtered = filter_dataframe(data, request.get("mood"), request.get("popularity", True),
+                                request.get("selected_genres"), request.get("country"))
+    return list(filtered['id']) if not filtered.empty else []
+
+
+class TestEraMask:
+    """Test the era year ranges"""
+
+    def test_matches_sql_ranges(self):
+        """Test boundaries match build_sql_query"""
+        year = np.array([1990.0, 1991.0, 2020.0, 2021.0, np.nan])
+        assert list(era_mask(year, 'old')) == [True, False, False, False, False]
+        assert list(era_mask(year, 'actual')) == [False, True, True, False, False]
+        assert list(era_mask(year, 'new')) == [False, False, False, True, False]
+        assert era_mask(year, None).all()
+
+
+class TestCandidateTable:
+    """Test building and looking up materialized candidate lists"""
+
+    @pytest.mark.parametrize("request_json", [
+        {"mood": "happy"},
+        {"mood": "excited", "selected_genres": ["Drama"], "popularity": False},
+        {"selected_genres": ["Horror"], "era": "actual", "language": "en"},
+        {"mood": "sad", "preferred_length": 120, "popularity": True},
+        {"mood": "scared", "preferred_length": 90, "language": "fr", "era": "old"},
+        {},
+    ])
+    def test_lookup_matches_dynamic_path(self, catalog_conn, request_json):
+        """Test that materialized lists equal the SQL + filter result"""
+        table = build_candidate_table(catalog_from_connection(catalog_conn), top_n=500, n_languages=4)
+        found = table.lookup(request_json)
+        assert found is not None
+        ids, complete = found
+        assert complete
+        assert list(ids) == dynamic_ids(catalog_conn, request_json)
+
+    def test_top_n_truncates(self, catalog_conn):
+        """Test that long lists are cut at top_n and flagged incomplete"""
+        table = build_candidate_table(catalog_from_connection(catalog_conn), top_n=3)
+        ids, complete = table.lookup({"popularity": False})
+        assert len(ids) == 3
+        assert not complete
+        assert list(ids) == dynamic_ids(catalog_conn, {"popularity": False})[:3]
+
+    def test_country_not_materialized(self, catalog_conn):
+        """Test that a specific country falls back to the dynamic path"""
+        table = build_candidate_table(catalog_from_connection(catalog_conn))
+        assert table.lookup({"mood": "happy", "country": "USA"}) is None
+
+    def test_rare_language_not_materialized(self, catalog_conn):
+        """Test that languages outside the top ones are not materialized"""
+        table = build_candidate_table(catalog_from_connection(catalog_conn), n_languages=1)
+        assert table.lookup({"mood": "happy", "language": "de"}) is None
+
+    def test_unlisted_length_not_materialized(self, catalog_conn):
+        """Test that free time values outside the buckets are not materialized"""
+        table = build_candidate_table(catalog_from_connection(catalog_conn))
+        assert table.lookup({"mood": "happy", "preferred_length": 95}) is None
+
+    def test_unknown_genre_ignored_next_to_known(self, catalog_conn):
+        """Test that genres no movie has do not change the lookup"""
+        table = build_candidate_table(catalog_from_connection(catalog_conn))
+        assert table.make_key({"selected_genres": ["Comedy", "Sci-Fi"]}) == \
+            table.make_key({"selected_genres": ["Comedy"]})
+        assert table.make_key({"selected_genres": ["Sci-Fi"]}) is None
+
+    def test_compact_storage(self, catalog_conn):
+        """Test that ids are stored in one int32 array"""
+        table = build_candidate_table(catalog_from_connection(catalog_conn))
+        assert table.ids.dtype == np.int32
+        assert len(table) > 0
+
+    def test_round_trip_through_catalog_arrays(self, catalog_conn):
+        """Test that a table stored in catalog arrays gives the same lookups"""
+        catalog = catalog_from_connection(catalog_conn)
+        table = build_candidate_table(catalog, n_languages=2)
+        arrays, meta = table.to_arrays()
+        stored = Catalog({**catalog.arrays, **arrays}, {**catalog.meta, "candidates": meta})
+
+        restored = CandidateTable.from_catalog(stored)
+
+        assert restored.entries == table.entries
+        for request_json in [{"mood": "happy"}, {"era": "new", "language": "en", "popularity": False}]:
+            assert list(restored.lookup(request_json)[0]) == list(table.lookup(request_json)[0])
+
+    def test_catalog_without_table(self, catalog_conn):
+        """Test that catalogs built without materialization have no table"""
+        assert CandidateTable.from_catalog(catalog_from_connection(catalog_conn)) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
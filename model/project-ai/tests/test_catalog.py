@@ -0,0 +1,151 @@
+import os
+import pytest
+import numpy as np
+from catalog import (Catalog, build_catalog, catalog_from_connection, current_catalog_path,
+                     encode_catalog, file_version, open_catalog, read_movies)
+
+
+class TestEncodeCatalog:
+    """Test the columnar encoding of the movies table"""
+
+    def test_rows_in_sql_candidate_order(self, catalog_conn):
+        """Test rows are ordered by popularity then rating, like the SQL query"""
+        catalog = catalog_from_connection(catalog_conn)
+        frame = read_movies(catalog_conn)
+        assert list(catalog.ids) == list(frame['id'])
+
+    def test_compact_dtypes(self, catalog_conn):
+        """Test numeric and encoded columns use compact dtypes"""
+        catalog = catalog_from_connection(catalog_conn)
+        assert catalog.popularity.dtype == np.float32
+        assert catalog.imdb_rating.dtype == np.float32
+        assert catalog.language_codes.dtype == np.int16
+        assert catalog.genre_codes.dtype == np.int16
+
+    def test_decodes_original_values(self, catalog_conn, movies_frame):
+        """Test strings and lists decode back to the stored values"""
+        catalog = catalog_from_connection(catalog_conn)
+        expected = movies_frame.set_index('id')
+        for row in range(len(catalog)):
+            movie = expected.loc[int(catalog.ids[row])]
+            assert catalog.text('title', row) == movie['title']
+            assert catalog.text('overview', row) == movie['overview']
+            assert str(catalog.genres_of(row)) == movie['genres']
+            assert str(catalog.countries_of(row)) == movie['production_countries']
+            assert catalog.language_of(row) == movie['original_language']
+            assert catalog.director_of(row) == movie['director']
+
+    def test_genre_bits_match_genre_lists(self, catalog_conn):
+        """Test the genre bitmask has one bit per genre of the row"""
+        catalog = catalog_from_connection(catalog_conn)
+        for row in range(len(catalog)):
+            expected = sum(1 << catalog.genres.index(g) for g in catalog.genres_of(row))
+            assert int(catalog.genre_bits[row]) == expected
+
+    def test_rows_for_ids(self, catalog_conn):
+        """Test id to row lookup, with -1 for unknown ids"""
+        catalog = catalog_from_connection(catalog_conn)
+        rows = catalog.rows_for_ids([int(catalog.ids[5]), 99999, int(catalog.ids[0])])
+        assert list(rows) == [5, -1, 0]
+
+    def test_record(self, catalog_conn, movies_frame):
+        """Test the JSON record of a movie"""
+        catalog = catalog_from_connection(catalog_conn)
+        row = int(catalog.rows_for_ids([1])[0])
+        record = catalog.record(row)
+        movie = movies_frame.set_index('id').loc[1]
+        assert record["id"] == 1
+        assert record["title"] == movie['title']
+        assert record["runtime"] == movie['runtime']
+        assert record["year"] == movie['year']
+        assert str(record["genres"]) == movie['genres']
+        assert record["poster"] == f"https://image.tmdb.org/t/p/w500{movie['poster_path']}"
+
+    def test_reads_compressed_overviews(self, catalog_conn, movies_frame):
+        """Test the catalog decodes overviews from the compressed store"""
+        from overview_store import migrate
+        migrate(catalog_conn)
+        catalog = catalog_from_connection(catalog_conn)
+        expected = movies_frame.set_index('id')
+        for row in range(len(catalog)):
+            assert catalog.text('overview', row) == expected.loc[int(catalog.ids[row]), 'overview']
+
+    def test_autocomplete(self, catalog_conn):
+        """Test title prefix search returns matching rows in popularity order"""
+        catalog = catalog_from_connection(catalog_conn)
+        rows = catalog.autocomplete("movie 1", limit=50)
+        assert rows == sorted(rows)
+        assert all(catalog.text('title', r).lower().startswith("movie 1") for r in rows)
+        assert len(rows) == 31  # Movie 1, 10-19, 100-119
+
+    def test_missing_strings_become_empty(self, movies_frame):
+        """Test that null strings are stored as empty strings"""
+        movies_frame.loc[0, 'overview'] = None
+        arrays, meta = encode_catalog(movies_frame)
+        catalog = Catalog(arrays, meta)
+        assert catalog.text('overview', 0) == ""
+
+    def test_mood_affinity(self, catalog_conn):
+        """Test every movie gets a float32 affinity per mood, looked up by id"""
+        catalog = catalog_from_connection(catalog_conn)
+        assert catalog.mood_affinity.dtype == np.float32
+        assert catalog.mood_affinity.shape == (len(catalog), len(catalog.meta["moods"]))
+
+        ids = [int(catalog.ids[0]), 9999]
+        scores = catalog.mood_affinity_of(ids, "happy")
+        column = catalog.meta["moods"].index("happy")
+        assert scores[0] == catalog.mood_affinity[0, column]
+        assert scores[1] == -1
+        assert catalog.mood_affinity_of(ids, "bored") is None
+
+    def test_taste_scores(self, catalog_conn):
+        """Test user vectors are scored against each id's taste features"""
+        catalog = catalog_from_connection(catalog_conn)
+        assert catalog.taste_features.dtype == np.float32
+        taste = np.asarray(catalog.taste_features[3])
+
+        scores = catalog.taste_scores([int(catalog.ids[3]), int(catalog.ids[5]), 9999], taste)
+        assert scores[0] == pytest.approx(1.0, rel=1e-5)
+        assert scores[1] <= scores[0]
+        assert scores[2] == 0
+
+
+class TestBuildCatalog:
+    """Test writing and attaching the memory-mapped catalog files"""
+
+    def test_build_and_open(self, movie_db, tmp_path):
+        """Test that workers attach to memory-mapped arrays"""
+        catalog_dir = str(tmp_path / "catalog")
+        path = build_catalog(movie_db, catalog_dir, materialize=False)
+
+        catalog = open_catalog(path)
+
+        assert isinstance(catalog.ids, np.memmap)
+        assert catalog.version == file_version(movie_db)
+        assert len(catalog) == 120
+        assert current_catalog_path(catalog_dir) == path
+
+    def test_build_is_idempotent(self, movie_db, tmp_path):
+        """Test that an already built version is reused"""
+        catalog_dir = str(tmp_path / "catalog")
+        path = build_catalog(movie_db, catalog_dir, materialize=False)
+        built_at = os.path.getmtime(os.path.join(path, "meta.json"))
+
+        assert build_catalog(movie_db, catalog_dir, materialize=False) == path
+        assert os.path.getmtime(os.path.join(path, "meta.json")) == built_at
+        assert [d for d in os.listdir(catalog_dir) if d.startswith(".build-")] == []
+
+    def test_materialized_table_stored(self, movie_db, tmp_path):
+        """Test that the candidate table is written next to the catalog"""
+        path = build_catalog(movie_db, str(tmp_path / "catalog"))
+        catalog = open_catalog(path)
+        assert "candidates" in catalog.meta
+        assert isinstance(catalog.candidates_ids, np.memmap)
+
+    def test_no_current_catalog(self, tmp_path):
+        """Test that a missing pointer returns None"""
+        assert current_catalog_path(str(tmp_path)) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
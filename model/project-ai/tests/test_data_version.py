@@ -0,0 +1,173 @@
+import os
+import pytest
+from unittest.mock import Mock
+from data_version import (PINNED_DB_NAME, DatabaseWatcher, DataVersion, ReloadInProgress, pin_database,
+                          remove_build, snapshot_database)
+from metrics import metrics
+
+
+class TestDataVersion:
+    """Test draining and releasing replaced data versions"""
+
+    def test_idle_version_released_on_retire(self):
+        """Test a version without requests is freed right away"""
+        partitions = Mock()
+        version = DataVersion("db", "v1", catalog=object(), movie_partitions=partitions)
+        released = metrics.counter("reload.released")
+
+        version.retire()
+
+        assert version.released
+        assert version.catalog is None
+        partitions.close.assert_called_once()
+        assert metrics.counter("reload.released") == released + 1
+
+    def test_in_flight_requests_drained_first(self):
+        """Test a retired version stays usable until its last request finishes"""
+        catalog = object()
+        version = DataVersion("db", "v1", catalog=catalog)
+        version.acquire()
+        version.acquire()
+
+        version.retire()
+        assert not version.released
+        assert version.catalog is catalog
+
+        version.release()
+        assert not version.released
+        version.release()
+        assert version.released
+        assert version.catalog is None
+
+    def test_active_version_not_released(self):
+        """Test requests finishing on the current version free nothing"""
+        version = DataVersion("db", "v1", catalog=object())
+        version.acquire().release()
+        assert not version.released
+
+
+class TestRemoveBuild:
+    """Test deleting the catalog build of a released version"""
+
+    def build(self, catalog_dir, name):
+        """Catalog build directory holding a pinned database"""
+        path = catalog_dir / name
+        path.mkdir(parents=True)
+        (path / PINNED_DB_NAME).write_text("db")
+        return str(path)
+
+    def test_released_build_removed(self, tmp_path):
+        """Test the build goes away with the last request on its version"""
+        old, new = self.build(tmp_path, "v1"), self.build(tmp_path, "v2")
+        (tmp_path / "CURRENT").write_text("v2")
+        version = DataVersion(os.path.join(old, PINNED_DB_NAME), "v1", build_dir=old)
+        version.acquire()
+
+        version.retire()
+        assert os.path.exists(old)
+        version.release()
+
+        assert not os.path.exists(old)
+        assert os.path.exists(new)
+
+    def test_current_build_kept(self, tmp_path):
+        """Test a build that is current again, e.g. the same file reloaded, is not deleted"""
+        build = self.build(tmp_path, "v1")
+        (tmp_path / "CURRENT").write_text("v1")
+        assert not remove_build(build)
+        assert os.path.exists(os.path.join(build, PINNED_DB_NAME))
+
+
+class TestPinDatabase:
+    """Test keeping each version's database file"""
+
+    def test_snapshot_survives_replacement(self, tmp_path):
+        """Test moving a new file into place leaves the pinned copy unchanged"""
+        db = tmp_path / "movies.db"
+        db.write_text("old")
+        build = tmp_path / "catalog" / "build"
+        build.mkdir(parents=True)
+
+        staged = snapshot_database(str(db), str(tmp_path / "catalog"))
+        pinned = pin_database(staged, str(build))
+        (tmp_path / "new.db").write_text("new")
+        os.replace(tmp_path / "new.db", db)
+
+        assert pinned == str(build / PINNED_DB_NAME)
+        assert open(pinned).read() == "old"
+        assert not os.path.exists(staged)
+
+    def test_already_pinned(self, tmp_path):
+        """Test a second worker reuses the pinned file and drops its snapshot"""
+        db = tmp_path / "movies.db"
+        db.write_text("data")
+        build = tmp_path / "build"
+        build.mkdir()
+        pinned = pin_database(snapshot_database(str(db), str(tmp_path)), str(build))
+
+        second = snapshot_database(str(db), str(tmp_path))
+        assert pin_database(second, str(build)) == pinned
+        assert not os.path.exists(second)
+
+    def test_missing_database(self, tmp_path):
+        """Test a missing file gives no snapshot"""
+        assert snapshot_database(str(tmp_path / "missing.db"), str(tmp_path)) is None
+
+
+class TestDatabaseWatcher:
+    """Test reloading when the database file changes"""
+
+    @pytest.fixture
+    def db(self, tmp_path):
+        """Database file path with some content"""
+        path = tmp_path / "movies.db"
+        path.write_text("v1")
+        return path
+
+    def replace(self, db, content):
+        """Moves a new file into the database path"""
+        new = db.with_name("incoming.db")
+        new.write_text(content)
+        os.replace(new, db)
+
+    def test_reload_after_file_settles(self, db):
+        """Test a changed file is reloaded once it looks the same on two polls"""
+        reload = Mock()
+        watcher = DatabaseWatcher(str(db), reload)
+        assert not watcher.poll()
+
+        self.replace(db, "v2 with more rows")
+        assert not watcher.poll()
+        assert watcher.poll()
+        reload.assert_called_once()
+        assert not watcher.poll()
+
+    def test_missing_file_ignored(self, db):
+        """Test a file that is briefly gone does not trigger a reload"""
+        reload = Mock()
+        watcher = DatabaseWatcher(str(db), reload)
+        os.remove(db)
+        assert not watcher.poll()
+        assert not watcher.poll()
+        reload.assert_not_called()
+
+    def test_retried_while_reload_running(self, db):
+        """Test a change is picked up again when another reload was running"""
+        reload = Mock(side_effect=[ReloadInProgress("busy"), None])
+        watcher = DatabaseWatcher(str(db), reload)
+        self.replace(db, "v2 with more rows")
+        watcher.poll()
+        assert not watcher.poll()
+        watcher.poll()
+        assert watcher.poll()
+        assert reload.call_count == 2
+
+    def test_failed_reload_not_retried(self, db):
+        """Test a broken file is not rebuilt on every poll"""
+        reload = Mock(side_effect=RuntimeError("not a database"))
+        watcher = DatabaseWatcher(str(db), reload)
+        self.replace(db, "v2 with more rows")
+        watcher.poll()
+        assert not watcher.poll()
+        assert not watcher.poll()
+        assert reload.call_count == 1
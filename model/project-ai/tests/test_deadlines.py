@@ -0,0 +1,130 @@
+import sqlite3
+import threading
+import time
+import pytest
+import pandas as pd
+from concurrent.futures import Future
+from deadlines import DEADLINE, DISCONNECTED, Cancelled, Deadline
+
+
+@pytest.fixture
+def conn():
+    """In-memory database with a query that runs for a long time"""
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    yield conn
+    conn.close()
+
+
+SLOW_QUERY = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+              "SELECT COUNT(*) FROM n")
+
+
+class TestDeadline:
+    """Test deadline expiry and cancellation"""
+
+    def test_not_cancelled(self):
+        """Test a fresh deadline passes its checks"""
+        deadline = Deadline(10)
+        deadline.check()
+        assert not deadline.cancelled
+        assert 0 < deadline.remaining() <= 10
+
+    def test_no_timeout(self):
+        """Test a deadline without timeout only ends when cancelled"""
+        deadline = Deadline(None)
+        assert deadline.remaining() is None
+        assert not deadline.cancelled
+
+    def test_expired(self):
+        """Test checks raise once the deadline passed"""
+        deadline = Deadline(0.01)
+        time.sleep(0.02)
+        with pytest.raises(Cancelled) as error:
+            deadline.check()
+        assert error.value.reason == DEADLINE
+        assert deadline.remaining() == 0.0
+
+    def test_cancel_keeps_first_reason(self):
+        """Test a disconnect is not reported as a deadline later"""
+        deadline = Deadline(10)
+        deadline.cancel(DISCONNECTED)
+        deadline.cancel(DEADLINE)
+        with pytest.raises(Cancelled) as error:
+            deadline.check()
+        assert error.value.reason == DISCONNECTED
+
+
+class TestSqliteInterrupt:
+    """Test long queries are interrupted through the progress handler"""
+
+    def test_query_interrupted(self, conn):
+        """Test a cancelled request aborts its running query"""
+        deadline = Deadline(10)
+        threading.Timer(0.05, deadline.cancel).start()
+
+        started = time.monotonic()
+        with pytest.raises(Cancelled):
+            with deadline.sqlite(conn):
+                conn.execute(SLOW_QUERY).fetchone()
+        assert time.monotonic() - started < 5
+
+    def test_pandas_query_interrupted(self, conn):
+        """Test a query read through pandas is reported as cancelled, not as a database error"""
+        deadline = Deadline(10)
+        threading.Timer(0.05, deadline.cancel).start()
+
+        with pytest.raises(Cancelled):
+            with deadline.sqlite(conn):
+                pd.read_sql_query(SLOW_QUERY, conn)
+
+    def test_handler_removed(self, conn):
+        """Test the connection is usable without the handler afterwards"""
+        deadline = Deadline(10)
+        with deadline.sqlite(conn):
+            assert conn.execute("SELECT 1").fetchone() == (1,)
+        deadline.cancel()
+        assert conn.execute("SELECT 2").fetchone() == (2,)
+
+    def test_other_errors_raised(self, conn):
+        """Test SQL errors of a live request are not turned into cancellations"""
+        with pytest.raises(sqlite3.OperationalError):
+            with Deadline(10).sqlite(conn):
+                conn.execute("SELECT * FROM missing")
+
+
+class TestCancellableCalls:
+    """Test waiting on blocking calls"""
+
+    def test_call_result(self):
+        """Test results and errors of the call pass through"""
+        deadline = Deadline(10)
+        assert deadline.call(lambda x: x * 2, 21) == 42
+        with pytest.raises(ZeroDivisionError):
+            deadline.call(lambda: 1 / 0)
+
+    def test_call_abandoned_on_cancel(self):
+        """Test the request stops waiting for a call when cancelled"""
+        deadline = Deadline(10)
+        release = threading.Event()
+        threading.Timer(0.05, deadline.cancel).start()
+
+        started = time.monotonic()
+        with pytest.raises(Cancelled):
+            deadline.call(release.wait, 5)
+        assert time.monotonic() - started < 2
+        release.set()
+
+    def test_cancelled_before_call(self):
+        """Test nothing is started for a cancelled request"""
+        deadline = Deadline(10)
+        deadline.cancel()
+        calls = []
+        with pytest.raises(Cancelled):
+            deadline.call(calls.append, 1)
+        assert calls == []
+
+    def test_wait_on_deadline(self):
+        """Test waiting on a future ends at the deadline"""
+        with pytest.raises(Cancelled) as error:
+            Deadline(0.05).wait(Future())
+        assert error.value.reason == DEADLINE
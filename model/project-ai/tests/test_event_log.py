@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import time
+import pytest
+from unittest.mock import Mock
+from event_log import EventLog, Trace, user_key
+from metrics import metrics
+
+
+def event(**fields):
+    """A logged first-page request"""
+    return {"ts": time.time(), "preferences": {"mood": "Happy"}, "first_page": 1, "outcome": "ai", **fields}
+
+
+class TestEventLog:
+    """Test the write-behind recommendation event log"""
+
+    @pytest.fixture
+    def log(self, tmp_path):
+        """Event log in a temporary database"""
+        log = EventLog(str(tmp_path / "logs" / "events.db"), batch_size=3, flush_interval=0.05)
+        yield log
+        log.stop()
+
+    def rows(self, log):
+        """Stored events as dicts"""
+        conn = sqlite3.connect(log.path)
+        conn.row_factory = sqlite3.Row
+        rows = [dict(row) for row in conn.execute("SELECT * FROM events")]
+        conn.close()
+        return rows
+
+    def test_events_written(self, log):
+        """Test queued events reach SQLite with JSON columns encoded"""
+        written = metrics.counter("event_log.written")
+        for i in range(7):
+            assert log.record(event(user_id=f"u{i}", candidates=[i, i + 1], stages={"ranking": 0.5}))
+        log.flush()
+
+        rows = self.rows(log)
+        assert len(rows) == 7
+        assert json.loads(rows[0]["candidates"]) == [0, 1]
+        assert json.loads(rows[0]["stages"]) == {"ranking": 0.5}
+        assert metrics.counter("event_log.written") == written + 7
+
+    def test_full_queue_drops(self, tmp_path):
+        """Test record never blocks and counts events the queue has no room for"""
+        log = EventLog(str(tmp_path / "events.db"), queue_size=2)
+        # No writer draining the queue
+        log._thread = Mock()
+        dropped = metrics.counter("event_log.dropped")
+
+        results = [log.record(event()) for _ in range(5)]
+
+        assert results == [True, True, False, False, False]
+        assert log.pending() == 2
+        assert metrics.counter("event_log.dropped") == dropped + 3
+
+    def test_stop_writes_queued_events(self, log):
+        """Test events still queued at shutdown are written"""
+        for _ in range(5):
+            log.record(event())
+        log.stop()
+        assert len(self.rows(log)) == 5
+        assert log.pending() == 0
+
+    def test_write_error_counted(self, log):
+        """Test a batch that cannot be stored is dropped without stopping the writer"""
+        errors = metrics.counter("event_log.write_errors")
+        log.record(event(candidates={1, 2}))
+        log.flush()
+        log.record(event())
+        log.flush()
+
+        assert metrics.counter("event_log.write_errors") == errors + 1
+        assert len(self.rows(log)) == 1
+
+    def test_top_preferences(self, log):
+        """Test the most requested first pages of the window, without errors and later pages"""
+        for _ in range(3):
+            log.record(event(preferences={"mood": "Sad"}))
+        log.record(event())
+        log.record(event(preferences={"mood": "Tense"}, first_page=0))
+        log.record(event(preferences={"mood": "Tense"}, first_page=0))
+        log.record(event(preferences={"mood": "Calm"}, outcome="error"))
+        log.record(event(preferences={"mood": "Old"}, ts=time.time() - 7200))
+        log.flush()
+
+        assert log.top_preferences(5, window=3600) == [{"mood": "Sad"}, {"mood": "Happy"}]
+        assert log.top_preferences(1, window=3600) == [{"mood": "Sad"}]
+
+    def test_top_preferences_without_log(self, tmp_path):
+        """Test no file means no preferences"""
+        assert EventLog(str(tmp_path / "missing.db")).top_preferences(5) == []
+
+
+class TestTrace:
+    """Test per-request stage timings"""
+
+    def test_stages_between_marks(self, monkeypatch):
+        """Test each mark books the time since the previous one"""
+        clock = iter([10.0, 10.5, 12.0, 12.25, 13.0])
+        monkeypatch.setattr("event_log.time.monotonic", lambda: next(clock))
+        trace = Trace()
+        trace.mark("retrieval")
+        trace.mark("ranking")
+        trace.mark("ranking")
+
+        assert trace.stages == {"retrieval": 0.5, "ranking": 1.75}
+        assert trace.elapsed() == 3.0
+
+    def test_fields(self):
+        """Test fields are merged"""
+        trace = Trace()
+        trace.set(source="sql")
+        trace.set(retrieved=5)
+        assert trace.fields == {"source": "sql", "retrieved": 5}
+
+
+class TestUserKey:
+    """Test pseudonymous user keys"""
+
+    def test_stable_and_not_the_uid(self):
+        """Test a uid maps to the same key every time, anonymous requests to none"""
+        assert user_key("uid-123") == user_key("uid-123") != user_key("uid-124")
+        assert "uid-123" not in user_key("uid-123")
+        assert user_key(None) is None
@@ -0,0 +1,99 @@
+import pytest
+import numpy as np
+import pandas as pd
+from catalog import catalog_from_connection
+from facets import FacetIndex, count, pack
+from filter_utils import filter_dataframe, safe_parse_list
+from sql_utils import build_sql_query
+
+
+def matching_frame(conn, filters):
+    """Rows of the SQL + filter_dataframe path before the popularity split"""
+    query, params = build_sql_query(filters.get("preferred_length"), filters.get("language"), filters.get("era"))
+    data = pd.read_sql_query(query, conn, params=params)
+    filtered = filter_dataframe(data.assign(popularity=0.0), filters.get("mood"), True,
+                                filters.get("selected_genres"), filters.get("country"))
+    return filtered
+
+
+@pytest.fixture
+def index(catalog_conn):
+    """Facet index over the sample catalog"""
+    return FacetIndex(catalog_from_connection(catalog_conn))
+
+
+class TestBitmaps:
+    """Test packed bitmap helpers"""
+
+    def test_count(self):
+        """Test popcount over packed rows"""
+        mask = np.zeros(21, dtype=bool)
+        mask[[0, 7, 8, 20]] = True
+        assert count(pack(mask)) == 4
+        assert list(count(np.stack([pack(mask), pack(~mask)]))) == [4, 17]
+
+
+class TestFacetIndex:
+    """Test facet counts against the dynamic SQL + filter path"""
+
+    @pytest.mark.parametrize("filters", [
+        {},
+        {"mood": "happy"},
+        {"selected_genres": ["Horror"], "era": "actual", "language": "en"},
+        {"mood": "sad", "preferred_length": 120},
+        {"preferred_length": 100, "country": "France"},
+        {"language": "fr", "era": "old", "country": "Japan"},
+    ])
+    def test_total_matches_dynamic_path(self, catalog_conn, index, filters):
+        """Test the total equals the rows the pipeline would filter"""
+        assert index.total(filters) == len(matching_frame(catalog_conn, filters))
+        assert index.counts(filters)["total"] == index.total(filters)
+
+    def test_facets_counted_under_other_filters(self, catalog_conn, index):
+        """Test each value's count is what selecting it would return"""
+        filters = {"language": "en", "era": "actual", "selected_genres": ["Drama"]}
+        facets = index.counts(filters)["facets"]
+
+        for language, n in facets["language"].items():
+            assert n == len(matching_frame(catalog_conn, {**filters, "language": language}))
+        for era, n in facets["era"].items():
+            assert n == len(matching_frame(catalog_conn, {**filters, "era": era}))
+        for length, n in facets["preferred_length"].items():
+            assert n == len(matching_frame(catalog_conn, {**filters, "preferred_length": int(length)}))
+        for country, n in facets["country"].items():
+            assert n == len(matching_frame(catalog_conn, {**filters, "country": country}))
+
+    def test_genre_facet_ignores_genre_filter(self, catalog_conn, index):
+        """Test genre counts are per genre under the non-genre filters"""
+        facets = index.counts({"selected_genres": ["Drama"], "language": "de"})["facets"]
+        frame = matching_frame(catalog_conn, {"language": "de"})
+        for genre, n in facets["genres"].items():
+            assert n == sum(genre in g for g in frame["genres"].apply(safe_parse_list))
+
+    def test_zero_counts_left_out_and_sorted(self, index):
+        """Test values are ordered by count and empty ones omitted"""
+        facets = index.counts({"language": "xx"})["facets"]
+        assert facets["genres"] == {} and facets["era"] == {}
+        assert set(facets["language"]) == {"en", "fr", "de"}
+        for values in facets.values():
+            counts = list(values.values())
+            assert counts == sorted(counts, reverse=True)
+            assert all(n > 0 for n in counts)
+
+    def test_unknown_values_match_nothing(self, index):
+        """Test values missing from the catalog give an empty total"""
+        assert index.total({"language": "xx"}) == 0
+        assert index.total({"selected_genres": ["Western"]}) == 0
+        assert index.total({"country": "Atlantis"}) == 0
+
+    def test_counts_cached(self, index):
+        """Test repeated filter combinations reuse the computed counts"""
+        first = index.counts({"selected_genres": ["Drama", "Action"]})
+        assert index.counts({"selected_genres": ["Action", "Drama"]}) is first
+
+    def test_cache_bounded(self, catalog_conn):
+        """Test old combinations are evicted"""
+        index = FacetIndex(catalog_from_connection(catalog_conn), cache_size=2)
+        for language in ["en", "fr", "de"]:
+            index.counts({"language": language})
+        assert len(index._cache) == 2
@@ -1,7 +1,8 @@
 import pytest
 import pandas as pd
 import numpy as np
-from filter_utils import safe_parse_list, filter_dataframe
+from filter_utils import (ListColumns, Predicate, SELECTIVITY_SAMPLE, build_predicates,
+                          order_by_selectivity, wanted_genre_set, safe_parse_list, filter_dataframe)
 
 
 class TestSafeParseList:
@@ -74,6 +75,17 @@ class TestFilterDataframe:
             'year': [2020, 2019, 2021, 2018, 2022]
         })
     
+    def test_copy_leaves_input_untouched(self, sample_data):
+        """Test the default copy keeps the caller's string columns"""
+        filter_dataframe(sample_data, selected_genres=['Action'])
+        assert sample_data['genres'].iloc[0] == "['Action', 'Thriller']"
+
+    def test_string_dtype_columns(self, sample_data):
+        """Test list columns stored with the pandas string dtype are parsed"""
+        sample_data['genres'] = sample_data['genres'].astype('string')
+        result = filter_dataframe(sample_data, selected_genres=['Action'], mainstream=False)
+        assert all(isinstance(g, list) for g in result['genres'])
+
     def test_empty_dataframe_returns_empty(self):
         """Test that empty DataFrame returns empty"""
         df = pd.DataFrame()
@@ -146,6 +158,54 @@ class TestFilterDataframe:
         assert isinstance(result, pd.DataFrame)
 
 
+def step_by_step_filter(df, mood=None, mainstream=True, selected_genres=None, country=None):
+    """Reference filter that materializes a frame after every step"""
+    filtered = df.copy()
+    filtered["genres"] = filtered["genres"].astype(object).apply(safe_parse_list)
+    filtered["production_countries"] = filtered["production_countries"].astype(object).apply(safe_parse_list)
+    filtered = filtered[filtered["genres"].apply(len) > 0]
+    wanted = wanted_genre_set(mood, selected_genres)
+    if wanted:
+        filtered = filtered[filtered["genres"].apply(lambda g: bool(set(g) & wanted))]
+    if country:
+        filtered = filtered[filtered["production_countries"].apply(lambda c: country in c)]
+    if not filtered.empty:
+        if mainstream:
+            filtered = filtered[filtered["popularity"] >= filtered["popularity"].quantile(0.7)]
+        else:
+            filtered = filtered[filtered["popularity"] <= filtered["popularity"].quantile(0.3)]
+    return filtered
+
+
+class TestPredicateEngine:
+    """Test the single-mask predicate evaluation"""
+
+    @pytest.mark.parametrize("mood", [None, "happy", "scared"])
+    @pytest.mark.parametrize("mainstream", [True, False])
+    @pytest.mark.parametrize("country", [None, "France", "Japan"])
+    def test_matches_step_by_step_filter(self, movies_frame, mood, mainstream, country):
+        """Test the engine returns exactly the rows of the step-by-step filter"""
+        expected = step_by_step_filter(movies_frame, mood, mainstream, None, country)
+        result = filter_dataframe(movies_frame, mood, mainstream, None, country)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_most_selective_first(self, movies_frame):
+        """Test predicates are ordered by their estimated pass rate"""
+        lists = ListColumns(movies_frame)
+        predicates = build_predicates({'Action', 'Comedy', 'Drama', 'Romance'}, 'Japan')
+        ordered = order_by_selectivity(predicates, lists, np.arange(len(movies_frame)))
+        rates = [p.evaluate(lists, np.arange(SELECTIVITY_SAMPLE)).mean() for p in ordered]
+        assert rates == sorted(rates)
+
+    def test_parses_only_rows_still_alive(self, movies_frame):
+        """Test later predicates do not parse rows already filtered out"""
+        lists = ListColumns(movies_frame)
+        rows = np.array([0, 1, 2])
+        Predicate("country", "production_countries", lambda c: True).evaluate(lists, rows)
+        assert lists.done["production_countries"].sum() == 3
+        assert lists.done["genres"].sum() == 0
+
+
 class TestFilterDataframeEdgeCases:
     """Test edge cases and error conditions"""
     
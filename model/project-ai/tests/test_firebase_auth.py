@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import Mock, patch
+import firebase_auth
+from firebase_auth import bearer_token, verified_uid
+
+
+class TestBearerToken:
+    """Test reading the token from an Authorization header"""
+
+    @pytest.mark.parametrize("header,expected", [
+        ("Bearer abc", "abc"),
+        ("bearer  abc ", "abc"),
+        ("Basic abc", None),
+        ("Bearer ", None),
+        ("", None),
+        (None, None),
+    ])
+    def test_parse(self, header, expected):
+        """Test only non-empty bearer tokens are returned"""
+        assert bearer_token(header) == expected
+
+
+class TestVerifiedUid:
+    """Test Firebase ID token verification"""
+
+    def test_not_configured(self):
+        """Test no token verifies without a Firebase project"""
+        with patch.object(firebase_auth, 'FIREBASE_PROJECT_ID', None):
+            assert verified_uid("Bearer abc") is None
+
+    def test_valid_token(self):
+        """Test the uid of a verified token is returned"""
+        auth = Mock()
+        auth.verify_id_token.return_value = {"uid": "u1"}
+        with patch.object(firebase_auth, 'FIREBASE_PROJECT_ID', "project"), \
+                patch.object(firebase_auth, '_app', None), \
+                patch.object(firebase_auth, 'firebase_admin', Mock()), \
+                patch.object(firebase_auth, 'firebase_auth', auth, create=True):
+            assert verified_uid("Bearer abc") == "u1"
+        assert auth.verify_id_token.call_args[0][0] == "abc"
+
+    def test_invalid_token(self):
+        """Test a token Firebase rejects gives no uid"""
+        auth = Mock()
+        auth.verify_id_token.side_effect = ValueError("Token expired")
+        with patch.object(firebase_auth, 'FIREBASE_PROJECT_ID', "project"), \
+                patch.object(firebase_auth, '_app', None), \
+                patch.object(firebase_auth, 'firebase_admin', Mock()), \
+                patch.object(firebase_auth, 'firebase_auth', auth, create=True):
+            assert verified_uid("Bearer abc") is None
@@ -0,0 +1,52 @@
+import pytest
+import pandas as pd
+from frame_dtypes import STRING_DTYPE, bytes_per_row, compact_movies, read_dtypes
+
+
+class TestReadDtypes:
+    """Test the dtype mapping passed to read_sql_query"""
+
+    def test_compact_numeric_dtypes(self):
+        """Test numbers are read with the csv_to_sql.py dtypes"""
+        dtypes = read_dtypes()
+        assert dtypes['popularity'] == 'float32'
+        assert dtypes['runtime'] == 'Int32'
+        assert dtypes['overview'] == STRING_DTYPE
+
+    def test_limited_to_columns(self):
+        """Test only selected columns are mapped"""
+        assert set(read_dtypes(['id', 'year', 'title'])) == {'year', 'title'}
+
+
+class TestCompactMovies:
+    """Test converting a movies frame to compact dtypes"""
+
+    def test_converts_columns(self, movies_frame):
+        """Test numeric, category and string conversions"""
+        frame = compact_movies(movies_frame)
+        assert frame['popularity'].dtype == 'float32'
+        assert frame['year'].dtype == 'Int32'
+        assert isinstance(frame['director'].dtype, pd.CategoricalDtype)
+        assert isinstance(frame['original_language'].dtype, pd.CategoricalDtype)
+        assert frame['title'].dtype == STRING_DTYPE
+        assert frame['genres'].dtype == object
+
+    def test_fewer_bytes_per_row(self, movies_frame):
+        """Test the compact frame uses less memory per row"""
+        before = bytes_per_row(movies_frame)
+        assert bytes_per_row(compact_movies(movies_frame.copy())) < before
+
+    def test_null_runtime(self, movies_frame):
+        """Test missing runtimes survive as <NA>"""
+        movies_frame['runtime'] = movies_frame['runtime'].astype(float)
+        movies_frame.loc[0, 'runtime'] = None
+        frame = compact_movies(movies_frame)
+        assert frame['runtime'].isna().sum() == 1
+
+    def test_empty_frame(self):
+        """Test bytes_per_row of an empty frame"""
+        assert bytes_per_row(pd.DataFrame()) == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,159 @@
+import itertools
+import threading
+import time
+import pytest
+from admission import AdmissionController
+from hedging import Hedger
+from metrics import metrics
+
+names = (f"hedge_test_{i}" for i in itertools.count())
+
+
+def warmed_up(call, latency=0.01, samples=20, **kwargs):
+    """Hedger whose attempt history says calls take `latency` seconds"""
+    hedger = Hedger(call, min_samples=samples, name=next(names), **kwargs)
+    for _ in range(samples):
+        metrics.observe(f"{hedger.name}.attempt.latency", latency)
+    return hedger
+
+
+class TestHedger:
+    """Test backup requests for slow calls"""
+
+    def test_no_hedge_without_history(self):
+        """Test calls are not hedged before enough latencies were seen"""
+        calls = []
+        hedger = Hedger(lambda p: calls.append(p) or time.sleep(0.05) or "ok", name=next(names))
+        assert hedger.hedge_delay() is None
+        assert hedger.invoke("prompt") == "ok"
+        assert calls == ["prompt"]
+
+    def test_fast_call_not_hedged(self):
+        """Test a call answering before the percentile gets no backup"""
+        calls = []
+        hedger = warmed_up(lambda p: calls.append(p) or "ok", latency=1.0, max_fraction=1.0)
+        assert hedger.invoke("prompt") == "ok"
+        assert len(calls) == 1
+        assert hedger.hedge_rate() == 0.0
+
+    def test_backup_wins_slow_call(self):
+        """Test the backup answers when the first call is stuck"""
+        release = threading.Event()
+        attempts = itertools.count()
+
+        def call(prompt):
+            if next(attempts) == 0:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        hedger = warmed_up(call, max_fraction=1.0)
+        started = time.monotonic()
+        assert hedger.invoke("prompt") == "fast"
+        assert time.monotonic() - started < 1
+        assert metrics.counter(f"{hedger.name}.hedge.sent") == 1
+        assert metrics.counter(f"{hedger.name}.hedge.won") == 1
+        release.set()
+
+    def test_first_success_wins_over_failure(self):
+        """Test a failing backup does not fail the call"""
+        attempts = itertools.count()
+
+        def call(prompt):
+            if next(attempts) == 0:
+                time.sleep(0.1)
+                return "primary"
+            raise RuntimeError("backup failed")
+
+        hedger = warmed_up(call, max_fraction=1.0)
+        assert hedger.invoke("prompt") == "primary"
+
+    def test_both_failing_raises(self):
+        """Test the error is raised when no attempt succeeds"""
+        def call(prompt):
+            time.sleep(0.05)
+            raise RuntimeError("model down")
+
+        hedger = warmed_up(call, max_fraction=1.0)
+        with pytest.raises(RuntimeError):
+            hedger.invoke("prompt")
+
+    def test_budget_caps_hedges(self):
+        """Test at most max_fraction of calls are hedged"""
+        calls = []
+        hedger = warmed_up(lambda p: calls.append(p) or time.sleep(0.03) or "ok", latency=0.001, samples=200,
+                           max_fraction=0.25)
+        for _ in range(8):
+            hedger.invoke("prompt")
+        assert hedger.hedged == 2
+        assert hedger.hedge_rate() == 0.25
+        assert metrics.counter(f"{hedger.name}.hedge.over_budget") == 6
+
+    def test_budget_over_recent_calls(self):
+        """Test a burst of slow calls after a calm stretch is capped by the recent calls only"""
+        slow = threading.Event()
+        hedger = warmed_up(lambda p: time.sleep(0.1 if slow.is_set() else 0) or "ok", latency=0.02, samples=400,
+                           max_fraction=0.25, window=8)
+        for _ in range(40):
+            hedger.invoke("prompt")
+        assert hedger.hedged == 0
+
+        slow.set()
+        for _ in range(8):
+            hedger.invoke("prompt")
+        assert hedger.hedged == 2
+        assert metrics.counter(f"{hedger.name}.hedge.over_budget") == 6
+
+    def test_backup_gets_remaining_time(self):
+        """Test the backup's timeout is what is left of the caller's, not the full timeout"""
+        timeouts = []
+        release = threading.Event()
+
+        def call(prompt, timeout):
+            timeouts.append(timeout)
+            if len(timeouts) == 1:
+                release.wait(5)
+            return "ok"
+
+        hedger = warmed_up(call, latency=0.05, max_fraction=1.0)
+        assert hedger.invoke("prompt", 10) == "ok"
+        assert timeouts[0] == 10
+        assert timeouts[1] <= 10 - 0.05
+        release.set()
+
+    def test_backup_holds_admission_slot(self):
+        """Test the backup takes a slot of its own, kept until the losing attempt finishes"""
+        admission = AdmissionController(max_concurrency=2, max_queue=0)
+        release = threading.Event()
+        attempts = itertools.count()
+
+        def call(prompt):
+            if next(attempts) == 0:
+                release.wait(5)
+                return "slow"
+            return "fast"
+
+        hedger = warmed_up(call, max_fraction=1.0, admission=admission)
+        with admission.admit():
+            assert hedger.invoke("prompt") == "fast"
+        # The loser is still running in the backup's slot
+        assert admission.in_flight == 1
+
+        release.set()
+        for _ in range(100):
+            if admission.in_flight == 0:
+                break
+            time.sleep(0.01)
+        assert admission.in_flight == 0
+
+    def test_no_backup_without_free_slot(self):
+        """Test a hedge is skipped and not counted when every slot is busy"""
+        admission = AdmissionController(max_concurrency=1, max_queue=0)
+        calls = []
+        hedger = warmed_up(lambda p: calls.append(p) or time.sleep(0.05) or "ok", max_fraction=1.0,
+                           admission=admission)
+        with admission.admit():
+            assert hedger.invoke("prompt") == "ok"
+        assert len(calls) == 1
+        assert hedger.hedged == 0
+        assert metrics.counter(f"{hedger.name}.hedge.no_slot") == 1
@@ -0,0 +1,66 @@
+import pytest
+from unittest.mock import Mock
+from http_cache import cached_json, etag_matches, make_etag
+
+
+def request_with(if_none_match=None):
+    """Request stub carrying an optional If-None-Match header"""
+    request = Mock()
+    request.headers = {"if-none-match": if_none_match} if if_none_match else {}
+    return request
+
+
+class TestMakeEtag:
+    """Test strong ETags derived from the catalog version"""
+
+    def test_same_inputs_same_etag(self):
+        """Test that ETags are deterministic"""
+        assert make_etag("v1", 1, 2) == make_etag("v1", 1, 2)
+
+    def test_version_changes_etag(self):
+        """Test that a new catalog version invalidates the ETag"""
+        assert make_etag("v1", 1) != make_etag("v2", 1)
+
+    def test_strong_quoted_format(self):
+        """Test that the ETag is a quoted strong validator"""
+        etag = make_etag("v1", 1)
+        assert etag.startswith('"v1-') and etag.endswith('"')
+
+
+class TestEtagMatches:
+    """Test If-None-Match comparison"""
+
+    def test_exact_match(self):
+        assert etag_matches('"a"', '"a"')
+
+    def test_list_and_weak_match(self):
+        assert etag_matches('"x", W/"a"', '"a"')
+
+    def test_star_matches(self):
+        assert etag_matches('*', '"a"')
+
+    def test_no_match(self):
+        assert not etag_matches('"b"', '"a"')
+        assert not etag_matches(None, '"a"')
+
+
+class TestCachedJson:
+    """Test cacheable JSON responses"""
+
+    def test_full_response_with_headers(self):
+        """Test that a fresh request gets the body, ETag and Cache-Control"""
+        response = cached_json(request_with(), {"a": 1}, '"v1-x"', max_age=60)
+        assert response.status_code == 200
+        assert response.headers["etag"] == '"v1-x"'
+        assert response.headers["cache-control"] == "public, max-age=60"
+
+    def test_not_modified(self):
+        """Test that a matching If-None-Match gets an empty 304"""
+        response = cached_json(request_with('"v1-x"'), {"a": 1}, '"v1-x"')
+        assert response.status_code == 304
+        assert response.body == b""
+        assert response.headers["etag"] == '"v1-x"'
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,156 @@
+import threading
+import pytest
+from admission import AdmissionController, Overloaded
+from deadlines import Cancelled, Deadline
+from llm_batcher import LLMBatcher, RankingJob, batch_prompt, parse_batch_response
+
+
+def parse_ids(text):
+    """Space separated ids, like main.get_ids"""
+    return [int(t) for t in text.split() if t.isdigit()]
+
+
+def single_prompt(request_json, number_recommended, matching_text):
+    """Minimal one-user prompt"""
+    return f"SINGLE {number_recommended}\n{matching_text}"
+
+
+def run_concurrently(batcher, jobs):
+    """Rank the jobs from separate threads, returns results in job order"""
+    results = [None] * len(jobs)
+
+    def worker(i, job):
+        results[i] = batcher.rank(*job)
+
+    threads = [threading.Thread(target=worker, args=(i, job)) for i, job in enumerate(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results
+
+
+class TestBatchPrompt:
+    """Test the multi-task prompt and its parsing"""
+
+    def test_one_block_per_task(self):
+        """Test each job gets its own delimited task"""
+        jobs = [RankingJob({"mood": "happy"}, 2, "1 - A"), RankingJob({"mood": "sad"}, 3, "2 - B")]
+        prompt = batch_prompt(jobs)
+        assert prompt.count("It is your job") == 1
+        assert "=== TASK 1 (choose 2) ===" in prompt
+        assert "=== TASK 2 (choose 3) ===" in prompt
+        assert prompt.index("1 - A") < prompt.index("2 - B")
+
+    def test_user_id_not_sent(self):
+        """Test the requesting user's uid stays out of the prompt"""
+        prompt = batch_prompt([RankingJob({"mood": "happy", "user_id": "uid-123"}, 2, "1 - A")])
+        assert "uid-123" not in prompt
+        assert '"mood": "happy"' in prompt
+
+    def test_parse_response(self):
+        """Test task lines are mapped back to their task numbers"""
+        text = "TASK 2: 7 8\nnoise\ntask 1:  3 4 5"
+        assert parse_batch_response(text, parse_ids) == {1: [3, 4, 5], 2: [7, 8]}
+
+
+class TestLLMBatcher:
+    """Test collecting and fanning out ranking jobs"""
+
+    def test_concurrent_jobs_share_one_call(self):
+        """Test jobs in the same window are ranked with one model call"""
+        prompts = []
+        ready = threading.Barrier(3)
+
+        def invoke(prompt):
+            prompts.append(prompt)
+            return "TASK 1: 11\nTASK 2: 22\nTASK 3: 33"
+
+        batcher = LLMBatcher(invoke, single_prompt, parse_ids, AdmissionController(), window_ms=200, max_batch=3)
+
+        def rank(i):
+            ready.wait()
+            return batcher.rank({"i": i}, 1, f"{i}")
+
+        results = [None] * 3
+        threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, rank(i))) for i in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+
+        assert len(prompts) == 1
+        assert sorted(results) == [[11], [22], [33]]
+
+    def test_single_job_uses_regular_prompt(self):
+        """Test a batch of one is sent with the one-user prompt"""
+        prompts = []
+        batcher = LLMBatcher(lambda p: prompts.append(p) or "5 6", single_prompt, parse_ids,
+                             AdmissionController(), window_ms=1)
+        assert batcher.rank({}, 2, "text") == [5, 6]
+        assert prompts[0].startswith("SINGLE 2")
+
+    def test_missing_task_ranked_alone(self):
+        """Test a task left out of the batch response is retried on its own"""
+        def invoke(prompt):
+            if prompt.startswith("SINGLE"):
+                return "99"
+            return "TASK 1: 11"
+
+        batcher = LLMBatcher(invoke, single_prompt, parse_ids, AdmissionController(), window_ms=300, max_batch=2)
+        results = run_concurrently(batcher, [({}, 1, "a"), ({}, 1, "b")])
+        assert sorted(results) == [[11], [99]]
+
+    def test_missing_tasks_retried_in_parallel(self):
+        """Test tasks left out of a batch answer are re-ranked at the same time, each in its own slot"""
+        in_flight = []
+        both_started = threading.Barrier(2, timeout=2)
+        admission = AdmissionController(max_concurrency=3)
+
+        def invoke(prompt):
+            if prompt.startswith("SINGLE"):
+                in_flight.append(admission.in_flight)
+                # Only returns when the other retry is running too
+                both_started.wait()
+                return "99"
+            return "no task lines"
+
+        batcher = LLMBatcher(invoke, single_prompt, parse_ids, admission, window_ms=300, max_batch=2)
+        results = run_concurrently(batcher, [({}, 1, "a"), ({}, 1, "b")])
+        assert results == [[99], [99]]
+        assert max(in_flight) == 2
+
+    def test_errors_reach_every_job(self):
+        """Test a failed model call fails all the jobs of the batch"""
+        def invoke(prompt):
+            raise RuntimeError("model down")
+
+        batcher = LLMBatcher(invoke, single_prompt, parse_ids, AdmissionController(), window_ms=1)
+        with pytest.raises(RuntimeError):
+            batcher.rank({}, 1, "a")
+
+    def test_overload_propagates(self):
+        """Test admission rejections are raised to the waiting request"""
+        admission = AdmissionController(max_concurrency=1, max_queue=0)
+        batcher = LLMBatcher(lambda p: "1", single_prompt, parse_ids, admission, window_ms=1)
+        with admission.admit():
+            with pytest.raises(Overloaded):
+                batcher.rank({}, 1, "a")
+
+    def test_cancelled_job_left_out(self):
+        """Test a request cancelled while waiting for its batch costs no model call"""
+        prompts = []
+        batcher = LLMBatcher(lambda p: prompts.append(p) or "1", single_prompt, parse_ids,
+                             AdmissionController(), window_ms=200)
+        deadline = Deadline(10)
+        threading.Timer(0.02, deadline.cancel).start()
+
+        with pytest.raises(Cancelled):
+            batcher.rank({}, 1, "a", deadline=deadline)
+        assert batcher.rank({}, 1, "b") == [1]
+        assert len(prompts) == 1
+        assert prompts[0].endswith("b")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
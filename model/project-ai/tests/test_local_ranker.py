@@ -0,0 +1,51 @@
+import pytest
+import pandas as pd
+from local_ranker import rank_by_popularity, rank_by_score
+
+
+class TestRankByPopularity:
+    """Test the non-AI fallback ranker"""
+
+    def test_orders_by_popularity_then_rating(self):
+        """Test ordering matches the SQL candidate order"""
+        candidates = pd.DataFrame({
+            'id': [1, 2, 3, 4],
+            'popularity': [50.0, 90.0, 50.0, 10.0],
+            'imdb_rating': [6.0, 7.0, 8.0, 9.0]
+        })
+        assert rank_by_popularity(candidates, 3) == [2, 3, 1]
+
+    def test_fewer_candidates_than_requested(self):
+        """Test that all candidates are returned when there are too few"""
+        candidates = pd.DataFrame({'id': [1], 'popularity': [5.0], 'imdb_rating': [5.0]})
+        assert rank_by_popularity(candidates, 5) == [1]
+
+
+class TestRankByScore:
+    """Test the genre / rating / popularity score ranker"""
+
+    @pytest.fixture
+    def candidates(self):
+        """Candidates with parsed and raw genre lists"""
+        return pd.DataFrame({
+            'id': [1, 2, 3],
+            'genres': [['Drama'], "['Comedy', 'Romance']", ['Comedy']],
+            'popularity': [90.0, 10.0, 10.0],
+            'imdb_rating': [9.0, 6.0, 6.0]
+        })
+
+    def test_genre_overlap_first(self, candidates):
+        """Test movies sharing the wanted genres rank first"""
+        assert rank_by_score(candidates, 3, {"selected_genres": ["Comedy", "Romance"]}) == [2, 3, 1]
+
+    def test_without_genres_uses_rating_and_popularity(self, candidates):
+        """Test ties keep the candidate order"""
+        assert rank_by_score(candidates, 3) == [1, 2, 3]
+
+    def test_limit(self, candidates):
+        """Test only the requested number is returned"""
+        assert rank_by_score(candidates, 1, {"mood": "happy"}) == [2]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
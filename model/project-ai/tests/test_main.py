@@ -1,9 +1,41 @@
+import os
+import json
+import sqlite3
+import threading
+import time
 import pytest
+import numpy as np
 import pandas as pd
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch
+import main
+from admission import Overloaded
+from data_version import ReloadInProgress
+from deadlines import Cancelled, Deadline
+from event_log import EventLog, user_key
+from catalog import catalog_from_connection
+from facets import FacetIndex
+from taste_profiles import ProfileStore
 from main import get_ids, ids_to_json, recommend_movies
 
 
+@pytest.fixture(autouse=True)
+def empty_result_cache():
+    """Every test starts without cached first-page results"""
+    main.result_cache.clear()
+    main.preference_tracker.clear()
+    yield
+    main.result_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def event_log(tmp_path):
+    """Recommendation events go to a temporary database"""
+    log = EventLog(str(tmp_path / "events.db"))
+    with patch.object(main, 'event_log', log):
+        yield log
+    log.stop()
+
+
 class TestGetIds:
     """Test the get_ids function that parses AI responses"""
     
@@ -198,6 +230,1054 @@ class TestRecommendMovies:
         assert len(result['recommended_movies']) <= 2
 
 
+class TestRecommendMoviesCursor:
+    """Test follow-up requests that reuse the cached candidate list"""
+
+    @pytest.fixture
+    def mock_db_data(self):
+        """Mock database query result"""
+        return pd.DataFrame({
+            'id': [1, 2, 3, 4],
+            'title': ['Movie A', 'Movie B', 'Movie C', 'Movie D'],
+            'overview': ['Overview'] * 4,
+            'genres': ["['Action']"] * 4,
+            'production_countries': ["['USA']"] * 4,
+            'popularity': [50.0] * 4,
+            'imdb_rating': [7.5, 7.0, 8.0, 6.5],
+            'runtime': [120, 95, 110, 88],
+            'year': [2020] * 4,
+            'original_language': ['en'] * 4,
+            'director': ['Director'] * 4,
+            'poster_path': ['/poster.jpg'] * 4,
+            'release_date': ['2020-01-01'] * 4
+        })
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_response_contains_cursor(self, mock_llm, mock_sql, mock_db_data):
+        """Test that a cursor is returned with the recommendations"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        result = recommend_movies({"selected_genres": ["Action"], "popularity": False})
+
+        assert isinstance(result.get('cursor'), str)
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_cursor_skips_retrieval(self, mock_llm, mock_sql, mock_db_data):
+        """Test that a follow-up request with the cursor does not query the database"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+        request = {"selected_genres": ["Action"], "popularity": False}
+
+        first = recommend_movies(dict(request))
+        mock_llm.invoke.return_value = Mock(content="2")
+        second = recommend_movies(dict(request), previous_ids=[1], cursor=first['cursor'])
+
+        assert mock_sql.call_count == 1
+        assert second['cursor'] == first['cursor']
+        assert [m['id'] for m in second['recommended_movies']] == [2]
+        prompt = mock_llm.invoke.call_args[0][0]
+        assert "1 - Overview" not in prompt
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_cursor_for_other_preferences_ignored(self, mock_llm, mock_sql, mock_db_data):
+        """Test that a cursor issued for other preferences triggers a new retrieval"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        first = recommend_movies({"selected_genres": ["Action"], "popularity": False})
+        second = recommend_movies({"mood": "excited", "selected_genres": ["Action"], "popularity": False},
+                                  cursor=first['cursor'])
+
+        assert mock_sql.call_count == 2
+        assert second['cursor'] != first['cursor']
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_cursor_exhausted(self, mock_llm, mock_sql, mock_db_data):
+        """Test that no movies are returned once every cached candidate was shown"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+        request = {"selected_genres": ["Action"], "popularity": False}
+
+        first = recommend_movies(dict(request))
+        result = recommend_movies(dict(request), previous_ids=[1, 2, 3, 4],
+                                  cursor=first['cursor'])
+
+        assert result['recommended_movies'] == []
+        assert 'error' in result
+
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_full_ranking_serves_later_pages(self, mock_llm, mock_sql, mock_db_data):
+        """Test the whole window is ranked once and later pages need no AI call"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="3 1 3 99 4 2")
+        request = {"selected_genres": ["Action"], "popularity": False, "number_recommended": 2}
+
+        with patch.object(main, 'FULL_RANKING', True):
+            first = recommend_movies(dict(request))
+            second = recommend_movies(dict(request), previous_ids=[3, 1], cursor=first['cursor'])
+
+        assert "Output exactly 4 movies" in mock_llm.invoke.call_args[0][0]
+        assert mock_llm.invoke.call_count == 1
+        assert [m['id'] for m in first['recommended_movies']] == [3, 1]
+        assert [m['id'] for m in second['recommended_movies']] == [4, 2]
+        assert second['cursor'] == first['cursor']
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_full_ranking_exhausted_asks_ai(self, mock_llm, mock_sql, mock_db_data):
+        """Test a page the stored ranking cannot fill goes back to the AI"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="3 1")
+        request = {"selected_genres": ["Action"], "popularity": False, "number_recommended": 2}
+
+        with patch.object(main, 'FULL_RANKING', True):
+            first = recommend_movies(dict(request))
+            mock_llm.invoke.return_value = Mock(content="2 4")
+            second = recommend_movies(dict(request), previous_ids=[3, 1], cursor=first['cursor'])
+
+        assert mock_llm.invoke.call_count == 2
+        assert [m['id'] for m in second['recommended_movies']] == [2, 4]
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_prefetched_page_served(self, mock_llm, mock_sql, mock_db_data):
+        """Test the follow-up page comes from the background prefetch"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+        request = {"selected_genres": ["Action"], "popularity": False, "number_recommended": 1}
+        prefetcher = main.Prefetcher(main.prefetch_page)
+
+        with patch.object(main, 'PREFETCH_ENABLED', True), patch.object(main, 'prefetcher', prefetcher):
+            first = recommend_movies(dict(request))
+            mock_llm.invoke.return_value = Mock(content="2")
+            assert prefetcher.schedule(dict(request), [], first)
+            # Waits for the prefetch still in flight instead of ranking again
+            second = recommend_movies(dict(request), previous_ids=[1], cursor=first['cursor'])
+
+        assert mock_llm.invoke.call_count == 2
+        assert [m['id'] for m in second['recommended_movies']] == [2]
+
+class TestRecommendMoviesMaterialized:
+    """Test retrieval served from the materialized candidate table"""
+
+    @pytest.fixture
+    def rows(self):
+        """Rows returned by the id lookup query, in database order"""
+        return pd.DataFrame({
+            'id': [3, 1, 2],
+            'title': ['Movie C', 'Movie A', 'Movie B'],
+            'overview': ['Overview C', 'Overview A', 'Overview B'],
+            'genres': ["['Action']"] * 3,
+            'production_countries': ["['USA']"] * 3,
+            'popularity': [70.0, 90.0, 80.0],
+            'imdb_rating': [7.0] * 3,
+            'runtime': [100] * 3,
+            'year': [2020] * 3,
+            'original_language': ['en'] * 3,
+            'director': ['Director'] * 3,
+            'poster_path': ['/poster.jpg'] * 3,
+            'release_date': ['2020-01-01'] * 3
+        })
+
+    @pytest.fixture
+    def table(self):
+        """Candidate table stub returning ids 1, 2, 3"""
+        stub = Mock()
+        stub.lookup.return_value = (np.array([1, 2, 3], dtype=np.int32), True)
+        with patch.object(main, 'candidate_table', stub):
+            yield stub
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_materialized_ids_keep_order(self, mock_llm, mock_sql, table, rows):
+        """Test that candidates come from the id lookup in materialized order"""
+        mock_sql.return_value = rows
+        mock_llm.invoke.return_value = Mock(content="2")
+
+        result = recommend_movies({"mood": "excited"}, previous_ids=[1])
+
+        query = mock_sql.call_args[0][0]
+        assert "WHERE id IN (?,?,?)" in query
+        prompt = mock_llm.invoke.call_args[0][0]
+        assert prompt.index("2 - Overview B") < prompt.index("3 - Overview C")
+        assert "1 - Overview A" not in prompt
+        assert [m['id'] for m in result['recommended_movies']] == [2]
+
+    @patch('main.pd.read_sql_query')
+    def test_empty_materialized_list(self, mock_sql, table):
+        """Test that an empty materialized list answers without querying"""
+        table.lookup.return_value = (np.array([], dtype=np.int32), True)
+
+        result = recommend_movies({"mood": "excited"})
+
+        assert result['recommended_movies'] == []
+        assert 'error' in result
+        mock_sql.assert_not_called()
+
+    def test_truncated_list_falls_back(self, table):
+        """Test that a truncated list without a full window left is not used"""
+        table.lookup.return_value = (np.arange(1, 61, dtype=np.int32), False)
+
+        assert main.lookup_materialized({}, previous_ids=[]) is not None
+        assert main.lookup_materialized({}, previous_ids=list(range(1, 20))) is None
+
+    def test_no_table_falls_back(self):
+        """Test that the dynamic path is used before the table is built"""
+        with patch.object(main, 'candidate_table', None):
+            assert main.lookup_materialized({"mood": "happy"}) is None
+
+
+class TestLoadCatalog:
+    """Test attaching the catalog at startup"""
+
+    def test_load_catalog_sets_table(self, movie_db, tmp_path):
+        """Test that the catalog and materialized table are attached"""
+        with patch.object(main, 'DB_PATH', movie_db), \
+                patch.object(main, 'CATALOG_DIR', str(tmp_path / "catalog")), \
+                patch.object(main, 'catalog', None), \
+                patch.object(main, 'candidate_table', None), \
+                patch.object(main, 'facet_index', None), \
+                patch.object(main, 'overview_store', main.overview_store), \
+                patch.object(main, 'data_version', None):
+            main.load_catalog()
+            assert len(main.catalog) == 120
+            assert main.candidate_table.lookup({"mood": "happy"}) is not None
+            assert main.facet_index.total({}) > 0
+
+    def test_load_catalog_failure_keeps_dynamic_path(self, tmp_path):
+        """Test that a missing database leaves retrieval on the SQL path"""
+        with patch.object(main, 'DB_PATH', str(tmp_path / "missing.db")), \
+                patch.object(main, 'CATALOG_DIR', str(tmp_path / "catalog")), \
+                patch.object(main, 'catalog', None), \
+                patch.object(main, 'candidate_table', None), \
+                patch.object(main, 'facet_index', None), \
+                patch.object(main, 'overview_store', main.overview_store), \
+                patch.object(main, 'data_version', None):
+            main.load_catalog()
+            assert main.catalog is None
+            assert main.candidate_table is None
+            assert main.facet_index is None
+
+
+class TestRecommendMoviesPersonalized:
+    """Test blending the user's taste vector into the candidate order"""
+
+    @pytest.fixture
+    def personalized(self, catalog_conn, tmp_path):
+        """Sample catalog, a temporary profile store and no mood ordering"""
+        catalog = catalog_from_connection(catalog_conn)
+        store = ProfileStore(str(tmp_path / "profiles.db"))
+        with patch.object(main, 'catalog', catalog), patch.object(main, 'candidate_table', None), \
+                patch.object(main, 'profile_store', store), patch.object(main, 'PERSONALIZATION', True):
+            yield catalog
+        store.close()
+
+    def candidates(self, mock_llm):
+        """Candidate ids in the prompt sent to the AI"""
+        prompt = mock_llm.invoke.call_args[0][0]
+        return [int(line.split(" - ")[0]) for line in prompt.splitlines() if " - Overview of movie" in line]
+
+    def test_record_history(self, personalized):
+        """Test saved movies update the user's vector, unknown ids are skipped"""
+        assert main.record_history("u1", [5, 9999]) == 1
+        assert main.profile_store.interactions("u1") == 1
+        assert main.taste_vector({"user_id": "u1"}) is not None
+        assert main.taste_vector({"user_id": "u2"}) is None
+        assert main.taste_vector({}) is None
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_user_id_not_in_prompt(self, mock_llm, mock_sql, movies_frame, personalized):
+        """Test the user's uid is not sent to the model provider"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+        recommend_movies({"mood": "happy", "user_id": "uid-123"})
+        prompt = mock_llm.invoke.call_args[0][0]
+        assert "uid-123" not in prompt
+        assert '"mood": "happy"' in prompt
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_taste_reorders_candidates(self, mock_llm, mock_sql, movies_frame, personalized):
+        """Test a user's history moves similar movies to the front"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+        request = {"popularity": False, "user_id": "u1"}
+        recommend_movies(dict(request))
+        anonymous = self.candidates(mock_llm)
+
+        favourite = anonymous[-1]
+        main.record_history("u1", [favourite] * 3)
+        recommend_movies(dict(request))
+
+        assert self.candidates(mock_llm)[0] == favourite != anonymous[0]
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_personalized_pages_not_cached(self, mock_llm, mock_sql, movies_frame, personalized):
+        """Test pages ranked for one user are not served to others"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+        main.record_history("u1", [1])
+
+        recommend_movies({"user_id": "u1"})
+        assert len(main.result_cache) == 0
+        assert main.preference_tracker.top(1) == []
+
+        recommend_movies({"user_id": "u2"})
+        assert len(main.result_cache) == 1
+        assert "user_id" not in main.preference_tracker.top(1)[0]
+
+
+class TestRecommendationEvents:
+    """Test logging each request through the event log"""
+
+    @pytest.fixture(autouse=True)
+    def enabled(self):
+        """Event logging switched on"""
+        with patch.object(main, 'EVENT_LOG_ENABLED', True):
+            yield
+
+    def rows(self, log):
+        """Logged events as dicts"""
+        log.flush()
+        conn = sqlite3.connect(log.path)
+        conn.row_factory = sqlite3.Row
+        rows = [dict(row) for row in conn.execute("SELECT * FROM events ORDER BY ts")]
+        conn.close()
+        return rows
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_ai_request_logged(self, mock_llm, mock_sql, movies_frame, event_log):
+        """Test preferences, candidates, model answer and stage timings are recorded"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.side_effect = lambda prompt, **kwargs: Mock(content=" ".join(
+            [line.split(" - ")[0] for line in prompt.splitlines() if " - Overview of movie" in line][:2]))
+        with patch.object(main, 'candidate_table', None), patch.object(main, 'facet_index', None):
+            recommend_movies({"mood": "Happy", "user_id": "u1"})
+
+        event, = self.rows(event_log)
+        assert event["user_id"] == user_key("u1") != "u1"
+        assert json.loads(event["preferences"]) == {"mood": "Happy"}
+        assert event["first_page"] == 1
+        assert event["outcome"] == "ai"
+        assert event["source"] == "sql"
+        assert json.loads(event["candidates"]) and event["retrieved"] >= len(json.loads(event["candidates"]))
+        candidates = json.loads(event["candidates"])
+        assert json.loads(event["returned"]) == candidates[:2]
+        assert event["llm_response"] == "{} {}".format(*candidates[:2])
+        assert {"retrieval", "filtering", "candidates", "ranking"} <= set(json.loads(event["stages"]))
+        assert event["total_ms"] > 0
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_cache_hit_and_warming(self, mock_llm, mock_sql, movies_frame, event_log):
+        """Test cache hits are logged with their outcome and warmer runs are not logged"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+        recommend_movies({"mood": "Happy"}, warming=True)
+        recommend_movies({"mood": "Happy"})
+
+        event, = self.rows(event_log)
+        assert event["outcome"] == "result_cache"
+        assert event["candidates"] == "null"
+
+    @patch('main.pd.read_sql_query')
+    def test_failure_logged(self, mock_sql, event_log):
+        """Test a failed request is logged with its error"""
+        mock_sql.side_effect = RuntimeError("database is locked")
+        with patch.object(main, 'candidate_table', None), patch.object(main, 'facet_index', None):
+            recommend_movies({"mood": "Happy"})
+
+        event, = self.rows(event_log)
+        assert event["outcome"] == "error"
+        assert event["error"] == "database is locked"
+
+    def test_disabled_by_default(self, event_log):
+        """Test nothing is logged unless EVENT_LOG_ENABLED is set"""
+        with patch.object(main, 'EVENT_LOG_ENABLED', False), \
+                patch.object(main, 'recommend_pipeline', return_value={"recommended_movies": []}):
+            recommend_movies({"mood": "Happy"})
+        assert event_log.pending() == 0
+        assert not os.path.exists(event_log.path)
+
+    def test_raised_error_logged(self, event_log):
+        """Test a request that raises is logged under the exception name"""
+        with patch.object(main, 'recommend_pipeline', side_effect=Cancelled("deadline")):
+            with pytest.raises(Cancelled):
+                recommend_movies({"mood": "Happy"})
+
+        event, = self.rows(event_log)
+        assert event["outcome"] == "cancelled"
+        assert event["returned"] == "[]"
+
+    def test_full_queue_does_not_block(self, event_log):
+        """Test a full queue drops the event instead of waiting for the writer"""
+        log = EventLog(event_log.path, queue_size=1)
+        log._thread = Mock()
+        dropped = main.metrics.counter("event_log.dropped")
+        with patch.object(main, 'event_log', log):
+            main.log_event({}, None, None, main.Trace(), {"recommended_movies": []}, None)
+            main.log_event({}, None, None, main.Trace(), {"recommended_movies": []}, None)
+        assert log.pending() == 1
+        assert main.metrics.counter("event_log.dropped") == dropped + 1
+
+    def test_warmer_reads_logged_preferences(self, event_log):
+        """Test popular logged preferences are a cache warmer source"""
+        for _ in range(3):
+            event_log.record({"ts": time.time(), "preferences": {"mood": "Sad"}, "first_page": 1, "outcome": "ai"})
+        event_log.flush()
+        with patch.object(main, 'EVENT_LOG_ENABLED', True):
+            sources = [source() for source in main.cache_warmer.sources]
+        assert [{"mood": "Sad"}] in sources
+
+
+class TestReloadData:
+    """Test swapping in a new database file without a restart"""
+
+    @pytest.fixture
+    def loaded(self, movie_db, tmp_path):
+        """Sample database loaded as the active data version"""
+        with patch.object(main, 'DB_PATH', movie_db), \
+                patch.object(main, 'CATALOG_DIR', str(tmp_path / "catalog")), \
+                patch.object(main, 'catalog', None), \
+                patch.object(main, 'candidate_table', None), \
+                patch.object(main, 'facet_index', None), \
+                patch.object(main, 'overview_store', main.overview_store), \
+                patch.object(main, 'data_version', None):
+            main.load_catalog()
+            yield main.data_version
+
+    def replace_database(self, movie_db, frame):
+        """Moves a database with the given movies into place"""
+        incoming = movie_db + ".incoming"
+        conn = sqlite3.connect(incoming)
+        frame.to_sql('movies', conn, index=False)
+        conn.close()
+        os.replace(incoming, movie_db)
+
+    def test_unchanged_database_not_rebuilt(self, loaded):
+        """Test reloading the same file keeps the current version"""
+        assert not main.reload_data()
+        assert main.data_version is loaded
+
+    def test_swap_drains_old_version(self, loaded, movie_db, movies_frame):
+        """Test in-flight requests keep the old data until they finish, new ones get the new data"""
+        in_flight = main.acquire_data()
+        main.result_cache.put("key", {"recommended_movies": []})
+
+        self.replace_database(movie_db, movies_frame.head(60))
+        assert main.reload_data()
+
+        assert main.data_version is not loaded
+        assert len(main.catalog) == 60
+        assert main.facet_index is main.data_version.facet_index
+        assert len(main.result_cache) == 0
+
+        # The pinned request still reads the old file and arrays
+        assert not loaded.released
+        assert len(loaded.catalog) == 120
+        old_conn = sqlite3.connect(in_flight.db_path)
+        assert old_conn.execute("SELECT COUNT(*) FROM movies").fetchone()[0] == 120
+        old_conn.close()
+
+        assert os.path.exists(loaded.build_dir)
+
+        in_flight.release()
+        assert loaded.released
+        assert loaded.catalog is None
+        # The old build and its pinned database are deleted, the current one is kept
+        assert not os.path.exists(loaded.build_dir)
+        assert os.path.exists(main.data_version.db_path)
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_requests_pin_and_release(self, mock_llm, mock_sql, movies_frame, loaded):
+        """Test recommend_movies holds the version only while it runs"""
+        mock_sql.return_value = movies_frame
+        active = []
+        mock_llm.invoke.side_effect = lambda prompt, **kwargs: active.append(loaded.active) or Mock(content="1")
+
+        recommend_movies({"mood": "happy"})
+
+        assert active == [1]
+        assert loaded.active == 0
+
+    @patch('main.llm')
+    def test_request_spanning_reload(self, mock_llm, movies_frame, movie_db, loaded):
+        """Test a request that outlives a reload finishes on its own version and caches nothing stale"""
+        def reload_while_ranking(prompt, **kwargs):
+            """Swaps in a smaller database while the AI is ranking"""
+            self.replace_database(movie_db, movies_frame.head(60))
+            assert main.reload_data()
+            return Mock(content="1")
+
+        mock_llm.invoke.side_effect = reload_while_ranking
+        with patch.object(main, 'AFFINITY_ORDER', False):
+            result = recommend_movies({"popularity": False})
+
+        assert [movie["id"] for movie in result["recommended_movies"]] == [1]
+        assert loaded.released
+        assert len(main.result_cache) == 0
+        key = main.retrieval_key({"popularity": False})
+        assert main.candidate_cache.get(result["cursor"], key, main.data_version.version) is None
+
+    def test_concurrent_reload_rejected(self, loaded):
+        """Test a second reload while one is running is refused"""
+        with main.reload_lock:
+            with pytest.raises(ReloadInProgress):
+                main.reload_data()
+
+    def test_failed_build_keeps_current_version(self, loaded, movie_db):
+        """Test a broken database file leaves the served version in place"""
+        with open(movie_db + ".incoming", "w") as f:
+            f.write("not a database")
+        os.replace(movie_db + ".incoming", movie_db)
+
+        with pytest.raises(Exception):
+            main.reload_data()
+        assert main.data_version is loaded
+        assert not loaded.released
+
+
+class TestRecommendMoviesFacets:
+    """Test skipping retrieval for filters the facet index knows are empty"""
+
+    @pytest.fixture
+    def index(self, catalog_conn):
+        """Facet index over the sample catalog, without a materialized table"""
+        index = FacetIndex(catalog_from_connection(catalog_conn))
+        with patch.object(main, 'facet_index', index), patch.object(main, 'candidate_table', None):
+            yield index
+
+    @patch('main.pd.read_sql_query')
+    def test_empty_combination_skips_query(self, mock_sql, index):
+        """Test a combination without movies answers without SQL"""
+        result = recommend_movies({"language": "xx", "mood": "happy"})
+
+        assert result['recommended_movies'] == []
+        assert result['error'] == "No matching movies."
+        mock_sql.assert_not_called()
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_non_empty_combination_queries(self, mock_llm, mock_sql, movies_frame, index):
+        """Test combinations with movies still run the pipeline"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        recommend_movies({"language": "en"})
+
+        mock_sql.assert_called_once()
+
+
+class TestRecommendMoviesAffinity:
+    """Test ordering candidates by the catalog's mood affinity"""
+
+    @pytest.fixture
+    def affinity_catalog(self, catalog_conn):
+        """Sample catalog with affinity ordering on and no materialized table"""
+        catalog = catalog_from_connection(catalog_conn)
+        with patch.object(main, 'catalog', catalog), patch.object(main, 'candidate_table', None), \
+                patch.object(main, 'AFFINITY_ORDER', True), patch.object(main, 'AFFINITY_WINDOW', 5):
+            yield catalog
+
+    def sent_ids(self, mock_llm):
+        """Candidate ids in the prompt sent to the AI"""
+        prompt = mock_llm.invoke.call_args[0][0]
+        return [int(line.split(" - ")[0]) for line in prompt.splitlines() if " - Overview of movie" in line]
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_best_matches_sent_first(self, mock_llm, mock_sql, movies_frame, affinity_catalog):
+        """Test a smaller window of the highest affinity candidates reaches the AI"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        recommend_movies({"mood": "scared", "popularity": False})
+
+        ids = self.sent_ids(mock_llm)
+        scores = affinity_catalog.mood_affinity_of(ids, "scared").tolist()
+        assert len(ids) == 5
+        assert scores == sorted(scores, reverse=True)
+        assert min(scores) > 0
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_popularity_order_without_mood(self, mock_llm, mock_sql, movies_frame, affinity_catalog):
+        """Test requests without a mood keep the retrieval order and the full window"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        recommend_movies({"language": "en"})
+
+        ids = self.sent_ids(mock_llm)
+        position = {movie_id: i for i, movie_id in enumerate(movies_frame["id"])}
+        assert len(ids) > 5
+        assert [position[i] for i in ids] == sorted(position[i] for i in ids)
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_disabled(self, mock_llm, mock_sql, movies_frame, affinity_catalog):
+        """Test turning the ordering off sends the popularity window"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        with patch.object(main, 'AFFINITY_ORDER', False):
+            recommend_movies({"mood": "scared", "popularity": False})
+
+        assert len(self.sent_ids(mock_llm)) > 5
+
+
+class TestRecommendMoviesAdmission:
+    """Test admission control around the AI ranking call"""
+
+    @pytest.fixture
+    def mock_db_data(self):
+        """Mock database query result"""
+        return pd.DataFrame({
+            'id': [1, 2, 3],
+            'title': ['Movie A', 'Movie B', 'Movie C'],
+            'overview': ['Overview'] * 3,
+            'genres': ["['Action']"] * 3,
+            'production_countries': ["['USA']"] * 3,
+            'popularity': [50.0] * 3,
+            'imdb_rating': [6.0, 8.0, 7.0],
+            'runtime': [100] * 3,
+            'year': [2020] * 3,
+            'original_language': ['en'] * 3,
+            'director': ['Director'] * 3,
+            'poster_path': ['/poster.jpg'] * 3,
+            'release_date': ['2020-01-01'] * 3
+        })
+
+    @pytest.fixture
+    def overloaded(self):
+        """Admission controller that rejects every request"""
+        controller = Mock()
+        controller.run.side_effect = Overloaded("busy", retry_after=3, status_code=429)
+        with patch.object(main, 'llm_admission', controller):
+            yield controller
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_overload_raises(self, mock_llm, mock_sql, mock_db_data, overloaded):
+        """Test that overload is raised instead of returned as an error"""
+        mock_sql.return_value = mock_db_data
+
+        with pytest.raises(Overloaded):
+            recommend_movies({"selected_genres": ["Action"]})
+        mock_llm.invoke.assert_not_called()
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_overload_degrades_to_local_ranker(self, mock_llm, mock_sql, mock_db_data, overloaded):
+        """Test the degrade mode ranks by popularity without the AI"""
+        mock_sql.return_value = mock_db_data
+
+        with patch.object(main, 'LLM_OVERLOAD_MODE', 'degrade'):
+            result = recommend_movies({"selected_genres": ["Action"], "number_recommended": 2})
+
+        assert result['degraded'] is True
+        assert [m['id'] for m in result['recommended_movies']] == [2, 3]
+        mock_llm.invoke.assert_not_called()
+
+
+class TestRecommendMoviesLeanMode:
+    """Test the memory-lean read path against a real database"""
+
+    @pytest.fixture
+    def db(self, movie_db):
+        """Real sample database with the caches disabled"""
+        with patch.object(main, 'DB_PATH', movie_db), \
+             patch.object(main, 'candidate_table', None), \
+             patch.object(main, 'candidate_cache', main.CandidateCache()), \
+             patch.object(main, 'result_cache', main.ResultCache(ttl=0)):
+            yield movie_db
+
+    def test_lean_mode_same_candidates(self, db):
+        """Test lean dtypes send the same candidates to the AI"""
+        request = {"mood": "excited", "popularity": True}
+        prompts = []
+        with patch('main.llm') as mock_llm:
+            mock_llm.invoke.side_effect = lambda prompt, **kwargs: prompts.append(prompt) or Mock(content="1")
+            recommend_movies(dict(request))
+            with patch.object(main, 'LEAN_MODE', True):
+                recommend_movies(dict(request))
+
+        assert len(prompts) == 2
+        assert prompts[0] == prompts[1]
+
+    def test_partitioned_queries_same_candidates(self, db, tmp_path):
+        """Test partitioned scans send the same candidates to the AI"""
+        request = {"mood": "excited", "popularity": True, "era": "actual"}
+        prompts = []
+        with patch('main.llm') as mock_llm:
+            mock_llm.invoke.side_effect = lambda prompt, **kwargs: prompts.append(prompt) or Mock(content="1")
+            recommend_movies(dict(request))
+            with patch.object(main, 'PARTITION_DIR', str(tmp_path / "partitions")), \
+                 patch.object(main, 'movie_partitions', None):
+                main.load_partitions()
+                assert main.movie_partitions is not None
+                recommend_movies(dict(request))
+
+        assert len(prompts) == 2
+        assert prompts[0] == prompts[1]
+
+    def test_lean_read_dtypes(self, db):
+        """Test the lean read uses compact dtypes"""
+        conn = sqlite3.connect(db)
+        with patch.object(main, 'LEAN_MODE', True):
+            movies = main.fetch_movies_by_ids(conn, [3, 1, 2])
+        conn.close()
+        assert list(movies['id']) == [3, 1, 2]
+        assert movies['popularity'].dtype == 'float32'
+        assert isinstance(movies['director'].dtype, pd.CategoricalDtype)
+        assert movies['genres'].apply(lambda g: isinstance(g, list)).all()
+
+
+class TestRecommendMoviesOverviewStore:
+    """Test decoding overviews on demand from the compressed store"""
+
+    @pytest.fixture
+    def db(self, movie_db):
+        """Real sample database with the caches disabled"""
+        with patch.object(main, 'DB_PATH', movie_db), \
+             patch.object(main, 'candidate_table', None), \
+             patch.object(main, 'candidate_cache', main.CandidateCache()), \
+             patch.object(main, 'result_cache', main.ResultCache(ttl=0)):
+            yield movie_db
+
+    def recommend_prompt(self, request):
+        """Prompt sent to the AI for the request"""
+        with patch('main.llm') as mock_llm:
+            mock_llm.invoke.return_value = Mock(content="1")
+            result = recommend_movies(dict(request))
+            return mock_llm.invoke.call_args[0][0], result
+
+    def test_same_prompt_after_migration(self, db):
+        """Test migrated databases build the same prompt and response"""
+        from overview_store import migrate
+        request = {"mood": "excited", "popularity": True}
+        before, before_result = self.recommend_prompt(request)
+
+        conn = sqlite3.connect(db)
+        migrate(conn)
+        conn.close()
+        main.load_overview_store()
+        try:
+            after, after_result = self.recommend_prompt(request)
+        finally:
+            main.overview_store = None
+
+        assert before == after
+        assert before_result["recommended_movies"] == after_result["recommended_movies"]
+
+    def test_lean_mode_with_store(self, db):
+        """Test lean dtypes skip the missing overview column"""
+        from overview_store import migrate
+        conn = sqlite3.connect(db)
+        migrate(conn)
+        main.load_overview_store()
+        try:
+            with patch.object(main, 'LEAN_MODE', True):
+                movies = main.fetch_movies_by_ids(conn, [1, 2])
+        finally:
+            main.overview_store = None
+            conn.close()
+        assert 'overview' not in movies.columns
+        assert movies['title'].dtype != object
+
+
+class TestResultCache:
+    """Test cached first-page results and warming"""
+
+    @pytest.fixture
+    def mock_db_data(self):
+        """Mock database query result"""
+        return pd.DataFrame({
+            'id': [1, 2, 3],
+            'title': ['Movie A', 'Movie B', 'Movie C'],
+            'overview': ['Overview'] * 3,
+            'genres': ["['Action']"] * 3,
+            'production_countries': ["['USA']"] * 3,
+            'popularity': [50.0] * 3,
+            'imdb_rating': [7.5, 7.0, 8.0],
+            'runtime': [120, 95, 110],
+            'year': [2020] * 3,
+            'original_language': ['en'] * 3,
+            'director': ['Director'] * 3,
+            'poster_path': ['/poster.jpg'] * 3,
+            'release_date': ['2020-01-01'] * 3
+        })
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_repeat_request_served_from_cache(self, mock_llm, mock_sql, mock_db_data):
+        """Test identical first-page requests skip retrieval and the AI"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+        request = {"selected_genres": ["Action"], "popularity": False}
+
+        first = recommend_movies(dict(request))
+        second = recommend_movies(dict(request))
+
+        assert first == second
+        assert mock_llm.invoke.call_count == 1
+        assert mock_sql.call_count == 1
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_follow_up_pages_not_cached(self, mock_llm, mock_sql, mock_db_data):
+        """Test requests with previous ids always rank again"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="2")
+        request = {"selected_genres": ["Action"], "popularity": False}
+
+        recommend_movies(dict(request), previous_ids=[1])
+        recommend_movies(dict(request), previous_ids=[1])
+
+        assert mock_llm.invoke.call_count == 2
+        assert len(main.result_cache) == 0
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_warm_hit_counted(self, mock_llm, mock_sql, mock_db_data):
+        """Test a request answered from a warmed entry counts as a warm hit"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+        request = {"selected_genres": ["Action"], "popularity": False}
+        main.metrics.reset()
+
+        main.warm_result(dict(request))
+        result = recommend_movies(dict(request))
+
+        assert result["recommended_movies"][0]["id"] == 1
+        assert mock_llm.invoke.call_count == 1
+        assert main.metrics.counter("result_cache.warm_hit") == 1
+        assert main.warm_hit_rate() == 1.0
+
+    @patch('main.pd.read_sql_query')
+    def test_warm_result_raises_on_error(self, mock_sql):
+        """Test warming a combination without movies is reported as a failure"""
+        mock_sql.return_value = pd.DataFrame()
+        with pytest.raises(RuntimeError):
+            main.warm_result({"mood": "happy"})
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_requests_tracked_for_warmer(self, mock_llm, mock_sql, mock_db_data):
+        """Test first-page requests feed the popularity tracker"""
+        mock_sql.return_value = mock_db_data
+        mock_llm.invoke.return_value = Mock(content="1")
+        recommend_movies({"selected_genres": ["Action"], "popularity": False})
+        assert main.preference_tracker.top(1) == [{"selected_genres": ["Action"], "popularity": False}]
+
+
+class TestRecommendMoviesBatching:
+    """Test ranking through the micro-batcher"""
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_batched_ranking(self, mock_llm, mock_sql):
+        """Test a request ranked through the batcher gets its ids back"""
+        mock_sql.return_value = pd.DataFrame({
+            'id': [1, 2],
+            'title': ['Movie A', 'Movie B'],
+            'overview': ['Overview A', 'Overview B'],
+            'genres': ["['Action']"] * 2,
+            'production_countries': ["['USA']"] * 2,
+            'popularity': [50.0] * 2,
+            'imdb_rating': [7.5, 7.0],
+            'runtime': [120, 95],
+            'year': [2020] * 2,
+            'original_language': ['en'] * 2,
+            'director': ['Director'] * 2,
+            'poster_path': ['/poster.jpg'] * 2,
+            'release_date': ['2020-01-01'] * 2
+        })
+        mock_llm.invoke.return_value = Mock(content="2 1")
+
+        with patch.object(main, 'LLM_BATCHING', True):
+            result = recommend_movies({"selected_genres": ["Action"], "popularity": False, "number_recommended": 2})
+
+        assert [m["id"] for m in result["recommended_movies"]] == [2, 1]
+        assert mock_llm.invoke.call_args[0][0] == main.ranking_prompt(
+            {"selected_genres": ["Action"], "popularity": False, "number_recommended": 2}, 2,
+            "1 - Overview A\n2 - Overview B")
+
+
+class TestRecommendMoviesShadow:
+    """Test the shadow local ranker next to the AI ranking"""
+
+    @pytest.fixture
+    def shadow(self):
+        """Shadow ranker stub"""
+        stub = Mock()
+        stub.start.return_value = "future"
+        with patch.object(main, 'shadow_ranker', stub), patch.object(main, 'candidate_table', None):
+            yield stub
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_compared_with_ai_ids(self, mock_llm, mock_sql, movies_frame, shadow):
+        """Test the shadow ranking gets the AI candidates and answer"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1 2")
+
+        recommend_movies({"number_recommended": 2})
+
+        candidates, request_json = shadow.start.call_args[0]
+        assert 0 < len(candidates) <= main.CANDIDATE_WINDOW
+        future, ids, latency, k = shadow.compare.call_args[0]
+        assert future == "future"
+        assert ids == [1, 2]
+        assert k == 2
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_not_shadowed_when_warming(self, mock_llm, mock_sql, movies_frame, shadow):
+        """Test cache warming runs are not compared"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        recommend_movies({}, warming=True)
+
+        shadow.start.assert_not_called()
+        assert shadow.compare.call_args[0][0] is None
+
+
+class TestRecommendMoviesDeadline:
+    """Test cancellation of abandoned requests"""
+
+    @pytest.fixture(autouse=True)
+    def dynamic_path(self):
+        """Retrieval through the SQL path"""
+        with patch.object(main, 'candidate_table', None), patch.object(main, 'facet_index', None):
+            yield
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_interrupted_query_cancels(self, mock_llm, mock_sql):
+        """Test a query interrupted through pandas ends the request as cancelled, not with an error page"""
+        deadline = Deadline(10)
+
+        def interrupted(*args, **kwargs):
+            """Cancelled mid-query, as the progress handler would report it through pandas"""
+            deadline.cancel()
+            raise pd.errors.DatabaseError("Execution failed on sql 'SELECT ...': interrupted")
+
+        mock_sql.side_effect = interrupted
+        with pytest.raises(Cancelled):
+            recommend_movies({"mood": "happy"}, deadline=deadline)
+        mock_llm.invoke.assert_not_called()
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_cancelled_request_skips_work(self, mock_llm, mock_sql, movies_frame):
+        """Test a request cancelled before retrieval never reaches the AI"""
+        mock_sql.return_value = movies_frame
+        deadline = Deadline(10)
+        deadline.cancel()
+
+        with pytest.raises(Cancelled):
+            recommend_movies({"mood": "happy"}, deadline=deadline)
+        mock_llm.invoke.assert_not_called()
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_llm_call_abandoned(self, mock_llm, mock_sql, movies_frame):
+        """Test the request returns as soon as it is cancelled, the call keeps its slot until it returns"""
+        mock_sql.return_value = movies_frame
+        release = threading.Event()
+        mock_llm.invoke.side_effect = lambda prompt, **kwargs: release.wait(5) and Mock(content="1")
+        deadline = Deadline(10)
+        threading.Timer(0.1, deadline.cancel).start()
+
+        started = time.monotonic()
+        with pytest.raises(Cancelled):
+            recommend_movies({"mood": "happy"}, deadline=deadline)
+        assert time.monotonic() - started < 2
+        assert main.llm_admission.in_flight == 1
+
+        release.set()
+        for _ in range(100):
+            if main.llm_admission.in_flight == 0:
+                break
+            time.sleep(0.01)
+        assert main.llm_admission.in_flight == 0
+
+    @patch('main.pd.read_sql_query')
+    @patch('main.llm')
+    def test_llm_call_bounded_by_deadline(self, mock_llm, mock_sql, movies_frame):
+        """Test the model call gets the time left as its timeout"""
+        mock_sql.return_value = movies_frame
+        mock_llm.invoke.return_value = Mock(content="1")
+
+        recommend_movies({"mood": "happy"}, deadline=Deadline(20))
+
+        assert 0 < mock_llm.invoke.call_args.kwargs["timeout"] <= 20
+
+
+class TestInvokeLLM:
+    """Test the ranking model call"""
+
+    @patch('main.llm')
+    def test_hedged_when_enabled(self, mock_llm):
+        """Test calls go through the hedger with hedging on"""
+        hedger = Mock()
+        hedger.invoke.return_value = "1 2"
+        with patch.object(main, 'LLM_HEDGING', True), patch.object(main, 'llm_hedger', hedger):
+            assert main.invoke_llm("prompt", 5) == "1 2"
+        hedger.invoke.assert_called_once_with("prompt", 5)
+        mock_llm.invoke.assert_not_called()
+
+    @patch('main.llm')
+    def test_direct_call(self, mock_llm):
+        """Test the model is called directly with hedging off"""
+        mock_llm.invoke.return_value = Mock(content="3")
+        with patch.object(main, 'LLM_HEDGING', False):
+            assert main.invoke_llm("prompt") == "3"
+        mock_llm.invoke.assert_called_once_with("prompt")
+
+
+class TestSimilarMovies:
+    """Test the precomputed similar movies lookup"""
+
+    @pytest.fixture
+    def neighbors_db(self, movie_db):
+        """Movie database with the neighbour table built"""
+        from neighbors_job import build_neighbors
+        conn = sqlite3.connect(movie_db)
+        build_neighbors(conn, k=5)
+        conn.close()
+        with patch.object(main, 'DB_PATH', movie_db):
+            yield movie_db
+
+    def test_returns_neighbours_in_rank_order(self, neighbors_db):
+        """Test neighbours come back in rank order with scores"""
+        result = main.similar_movies(1, limit=3)
+        conn = sqlite3.connect(neighbors_db)
+        expected = [r[0] for r in conn.execute(
+            "SELECT neighbor_id FROM movie_neighbors WHERE movie_id = 1 ORDER BY rank LIMIT 3")]
+        conn.close()
+        assert result["movie_id"] == 1
+        assert [m["id"] for m in result["similar_movies"]] == expected
+        assert all("score" in m and "content" in m for m in result["similar_movies"])
+
+    def test_unknown_movie(self, neighbors_db):
+        """Test unknown movies have no neighbours"""
+        assert main.similar_movies(99999)["similar_movies"] == []
+
+
 class TestRecommendMoviesEdgeCases:
     """Test edge cases and error conditions"""
     
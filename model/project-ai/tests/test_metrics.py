@@ -0,0 +1,59 @@
+import pytest
+from metrics import Metrics
+
+
+class TestMetrics:
+    """Test the in-process metrics registry"""
+
+    def test_counters(self):
+        """Test counters accumulate"""
+        m = Metrics()
+        m.incr("requests")
+        m.incr("requests", 2)
+        assert m.counter("requests") == 3
+        assert m.counter("missing") == 0
+        assert m.snapshot()["counters"] == {"requests": 3}
+
+    def test_timings_summary(self):
+        """Test timings report count, mean, percentiles and max in ms"""
+        m = Metrics()
+        for seconds in [0.1, 0.2, 0.3, 0.4]:
+            m.observe("stage", seconds)
+        summary = m.snapshot()["timings"]["stage"]
+        assert summary["count"] == 4
+        assert summary["mean_ms"] == 250.0
+        assert summary["max_ms"] == 400.0
+        assert 100.0 <= summary["p50_ms"] <= 400.0
+
+    def test_percentile_uses_recent_window(self):
+        """Test that percentiles only look at the most recent samples"""
+        m = Metrics(window=2)
+        m.observe("stage", 10.0)
+        m.observe("stage", 1.0)
+        m.observe("stage", 1.0)
+        assert m.percentile("stage", 99) == 1.0
+        assert m.percentile("missing", 99) is None
+        assert m.samples("stage") == 2
+        assert m.samples("missing") == 0
+
+    def test_gauges_evaluated_on_snapshot(self):
+        """Test gauges are read when the snapshot is taken"""
+        m = Metrics()
+        value = {"n": 1}
+        m.gauge("queue", lambda: value["n"])
+        value["n"] = 5
+        assert m.snapshot()["gauges"]["queue"] == 5
+
+    def test_reset(self):
+        """Test reset clears counters and timings"""
+        m = Metrics()
+        m.incr("a")
+        m.observe("b", 1.0)
+        m.reset()
+        snapshot = m.snapshot()
+        assert snapshot["counters"] == {}
+        assert snapshot["timings"] == {}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,215 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from model_registry import (ModelHealth, ModelRegistry, build_chat_model, chat_model_call, configured_models,
+                            parse_model_specs)
+
+
+def fake_model(text="1 2", delay=0.0, fail=False, calls=None):
+    """Ranking call that answers after `delay` seconds or raises"""
+    def call(prompt, timeout=None):
+        if calls is not None:
+            calls.append(prompt)
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("provider down")
+        return text
+    return call
+
+
+@pytest.fixture
+def fake_endpoint():
+    """Local OpenAI compatible chat completions endpoint answering "7 8 9\""""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            body = json.dumps({
+                "id": "fake", "object": "chat.completion", "created": 0, "model": "fake",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "7 8 9"}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+
+
+class TestModelHealth:
+    """Test EWMA tracking and the circuit breaker"""
+
+    def test_ewma(self):
+        """Test averages start at the first value and move by alpha"""
+        health = ModelHealth(alpha=0.5)
+        health.success(1.0)
+        health.success(3.0)
+        assert health.latency == 2.0
+        health.failure(2.0)
+        assert health.error_rate == 0.5
+
+    def test_breaker_opens_and_half_opens(self):
+        """Test consecutive failures open the circuit until the cooldown passes"""
+        health = ModelHealth(failures=2, cooldown=0.05)
+        health.failure(0.1)
+        assert not health.is_open()
+        health.failure(0.1)
+        assert health.is_open()
+        time.sleep(0.06)
+        assert not health.is_open()
+        health.failure(0.1)
+        assert health.is_open()
+        health.success(0.1)
+        assert not health.is_open()
+
+
+class TestModelRegistry:
+    """Test routing and failover across ranking models"""
+
+    def test_untried_models_measured_first(self):
+        """Test every model gets a first call"""
+        registry = ModelRegistry([("a", fake_model("a")), ("b", fake_model("b"))])
+        assert registry.invoke("p") == "a"
+        assert registry.invoke("p") == "b"
+
+    def test_routes_to_fastest(self):
+        """Test calls go to the model with the best recent latency"""
+        registry = ModelRegistry([("slow", fake_model("slow", delay=0.05)), ("fast", fake_model("fast"))])
+        registry.invoke("p")
+        registry.invoke("p")
+        assert [registry.invoke("p") for _ in range(3)] == ["fast"] * 3
+        assert [name for name, _ in registry.order()] == ["fast", "slow"]
+
+    def test_failover(self):
+        """Test a failing model hands the call to the next one"""
+        calls = []
+        registry = ModelRegistry([("down", fake_model(fail=True, calls=calls)), ("up", fake_model("ok"))])
+        assert registry.invoke("p") == "ok"
+        assert calls == ["p"]
+        assert registry.snapshot()["down"]["error_rate"] > 0
+
+    def test_open_circuit_skipped(self):
+        """Test a model with an open circuit is only tried after the others"""
+        calls = []
+        registry = ModelRegistry([("down", fake_model(fail=True, calls=calls)), ("up", fake_model("ok", delay=0.02))],
+                                 failures=1, cooldown=60)
+        registry.invoke("p")
+        for _ in range(3):
+            assert registry.invoke("p") == "ok"
+        assert len(calls) == 1
+        assert registry.snapshot()["down"]["open"]
+
+    def test_all_failing_raises(self):
+        """Test the last error is raised when every model fails"""
+        registry = ModelRegistry([("a", fake_model(fail=True)), ("b", fake_model(fail=True))])
+        with pytest.raises(RuntimeError):
+            registry.invoke("p")
+
+    def test_recovered_model_probed(self):
+        """Test a model left behind after a slow call is tried again once its stats are stale"""
+        registry = ModelRegistry([("a", fake_model("a")), ("b", fake_model("b", delay=0.01))], max_age=0.05)
+        registry.invoke("p")
+        registry.invoke("p")
+        with registry._lock:
+            registry.health["a"].latency = 5.0
+        assert registry.invoke("p") == "b"
+
+        time.sleep(0.06)
+        assert registry.invoke("p") == "a"
+        # The probe restarted the average instead of blending it with the old slow call
+        assert registry.health["a"].latency < registry.health["b"].latency
+
+    def test_one_probe_per_interval(self):
+        """Test a stale model is only moved first for one call"""
+        registry = ModelRegistry([("a", fake_model("a")), ("b", fake_model("b"))], max_age=60)
+        registry.invoke("p")
+        registry.invoke("p")
+        with registry._lock:
+            registry.health["a"].latency = 5.0
+            registry.health["a"].updated_at -= 120
+        assert [name for name, _ in registry.order()] == ["a", "b"]
+        assert [name for name, _ in registry.order()] == ["b", "a"]
+
+    def test_failover_shares_timeout(self):
+        """Test each failover gets what is left of the timeout, not the full one"""
+        timeouts = []
+
+        def slow_failure(prompt, timeout=None):
+            timeouts.append(timeout)
+            time.sleep(0.05)
+            raise RuntimeError("provider down")
+
+        registry = ModelRegistry([("a", slow_failure), ("b", slow_failure)])
+        with pytest.raises(RuntimeError):
+            registry.invoke("p", timeout=1.0)
+        assert timeouts[0] == pytest.approx(1.0, abs=0.01)
+        assert timeouts[1] <= 0.96
+
+    def test_timeout_spent_stops_failover(self):
+        """Test no further model is called once the timeout is used up"""
+        calls = []
+
+        def slow_failure(prompt, timeout=None):
+            calls.append(prompt)
+            time.sleep(0.05)
+            raise RuntimeError("provider down")
+
+        registry = ModelRegistry([("a", slow_failure), ("b", slow_failure)])
+        with pytest.raises(RuntimeError):
+            registry.invoke("p", timeout=0.02)
+        assert len(calls) == 1
+
+    def test_single_model_still_called_when_open(self):
+        """Test a lone model is tried even with its circuit open"""
+        calls = []
+        registry = ModelRegistry([("only", fake_model(fail=True, calls=calls))], failures=1)
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                registry.invoke("p")
+        assert len(calls) == 2
+
+
+class TestModelSpecs:
+    """Test configuring models from LLM_MODELS"""
+
+    def test_parse(self):
+        """Test provider, model and optional base URL are read"""
+        specs = parse_model_specs("openai:gpt-4.1-nano, google:gemini-2.0-flash-lite,openai:fake@http://x/v1,bad")
+        assert specs == [
+            ("openai", "gpt-4.1-nano", None),
+            ("google", "gemini-2.0-flash-lite", None),
+            ("openai", "fake", "http://x/v1"),
+        ]
+
+    def test_unknown_provider_skipped(self):
+        """Test unsupported providers are left out"""
+        assert build_chat_model("acme", "m") is None
+        assert configured_models("acme:m") == []
+
+    def test_fake_endpoint(self, fake_endpoint):
+        """Test an OpenAI compatible local endpoint serves ranking calls"""
+        models = configured_models(f"openai:fake@{fake_endpoint}")
+        assert [name for name, _ in models] == ["openai:fake"]
+        registry = ModelRegistry([("down", fake_model(fail=True))] + models)
+        assert registry.invoke("rank these", timeout=5) == "7 8 9"
+
+    def test_chat_model_call_passes_timeout(self):
+        """Test the remaining deadline reaches the model call"""
+        class Model:
+            def invoke(self, prompt, **kwargs):
+                self.kwargs = kwargs
+                return type("Message", (), {"content": "1"})()
+
+        model = Model()
+        assert chat_model_call(model)("p", 3) == "1"
+        assert model.kwargs == {"timeout": 3}
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from mood_affinity import MOODS, affinity_matrix, mood_column, mood_scores
+
+
+def score(mood, genres, overview="", rating=5.0):
+    """Affinity of one movie to one mood"""
+    return mood_scores(genres, overview, rating)[MOODS.index(mood)]
+
+
+class TestMoodScores:
+    """Test per-mood affinity from genres, overview keywords and rating"""
+
+    def test_pure_genre_match_beats_mixed(self):
+        """Test a movie made only of mood genres scores above one that only partly fits"""
+        assert score("scared", ["Horror"]) > score("scared", ["Horror", "Comedy"]) > score("scared", ["Comedy"])
+
+    def test_keywords_raise_score(self):
+        """Test mood words in the overview add to the genre score"""
+        plain = score("scared", ["Drama"], "A family moves house.")
+        haunted = score("scared", ["Drama"], "A family moves into a haunted house with a ghost.")
+        assert haunted > plain
+
+    def test_rating_only_for_matches(self):
+        """Test the rating breaks ties between matches but does not lift unrelated movies"""
+        assert score("happy", ["Comedy"], rating=9) > score("happy", ["Comedy"], rating=4)
+        assert score("happy", ["Horror"], rating=9) == 0.0
+
+    def test_missing_values(self):
+        """Test movies without genres, overview or rating score zero"""
+        assert mood_scores([], None, float("nan")) == [0.0] * len(MOODS)
+
+    def test_scores_bounded(self):
+        """Test scores stay within [0, 1]"""
+        scores = mood_scores(["Drama", "Romance"], "love loss grief death tragedy romance passion", 10)
+        assert all(0.0 <= s <= 1.0 for s in scores)
+
+
+class TestAffinityMatrix:
+    """Test the compact per-movie matrix"""
+
+    def test_shape_and_dtype(self):
+        """Test one float32 row per movie and one column per mood"""
+        matrix = affinity_matrix([["Comedy"], ["Horror"]], ["fun", "ghost"], [7.0, 6.0])
+        assert matrix.dtype == np.float32
+        assert matrix.shape == (2, len(MOODS))
+        assert matrix[0, mood_column("happy")] > matrix[1, mood_column("happy")]
+
+    @pytest.mark.parametrize("mood,expected", [("happy", 0), ("melancholic", len(MOODS) - 1), ("bored", None)])
+    def test_mood_column(self, mood, expected):
+        """Test moods map to their column and unknown moods to None"""
+        assert mood_column(mood) == expected
@@ -0,0 +1,100 @@
+import sqlite3
+import pytest
+import numpy as np
+from catalog import catalog_from_connection
+from neighbors_job import (build_neighbors, compute_neighbors, overview_vectors,
+                           similarity_block, genre_matrix, top_k)
+
+
+def features_for(catalog):
+    """Feature matrices as built by compute_neighbors"""
+    return {
+        "genres": genre_matrix(catalog),
+        "overview": overview_vectors([catalog.text("overview", r) for r in range(len(catalog))]),
+        "director": np.asarray(catalog.director_codes),
+        "language": np.asarray(catalog.language_codes),
+        "year": np.asarray(catalog.year, dtype=np.float32),
+    }
+
+
+class TestOverviewVectors:
+    """Test hashed TF-IDF overview vectors"""
+
+    def test_unit_length(self):
+        """Test non-empty overviews are L2 normalised"""
+        vectors = overview_vectors(["a space adventure", "a quiet love story"])
+        assert np.allclose(np.linalg.norm(vectors, axis=1), 1)
+
+    def test_empty_overview_is_zero(self):
+        """Test empty overviews do not produce NaNs"""
+        vectors = overview_vectors(["", "robots in space"])
+        assert not vectors[0].any()
+        assert not np.isnan(vectors).any()
+
+    def test_shared_words_are_similar(self):
+        """Test overviews sharing words score higher than unrelated ones"""
+        vectors = overview_vectors(["robots invade space station",
+                                    "space station robots rebel",
+                                    "a family cooks dinner"])
+        assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+class TestSimilarity:
+    """Test the blockwise similarity scores"""
+
+    def test_never_own_neighbour(self, catalog_conn):
+        """Test a movie is excluded from its own neighbours"""
+        catalog = catalog_from_connection(catalog_conn)
+        scores = similarity_block(features_for(catalog), 10, 20)
+        assert np.isneginf(scores[np.arange(10), np.arange(10, 20)]).all()
+
+    def test_blocks_match_full_matrix(self, catalog_conn):
+        """Test block boundaries do not change the neighbours"""
+        catalog = catalog_from_connection(catalog_conn)
+        small_blocks = list(compute_neighbors(catalog, k=5, block_size=7))
+        one_block = list(compute_neighbors(catalog, k=5, block_size=1000))
+        assert [row[:3] for row in small_blocks] == [row[:3] for row in one_block]
+
+    def test_identical_movie_is_nearest(self, movies_frame):
+        """Test a near duplicate is ranked first"""
+        movies_frame.loc[1, ['genres', 'director', 'original_language', 'year', 'overview']] = \
+            movies_frame.loc[0, ['genres', 'director', 'original_language', 'year', 'overview']].values
+        conn = sqlite3.connect(":memory:")
+        movies_frame.to_sql('movies', conn, index=False)
+        rows = [r for r in compute_neighbors(catalog_from_connection(conn), k=3) if r[0] == 1]
+        assert rows[0][2] == 2
+
+    def test_top_k_sorted(self):
+        """Test top_k returns the best columns in descending order"""
+        scores = np.array([[0.1, 0.9, 0.5, 0.7]])
+        best, best_scores = top_k(scores, 2)
+        assert best.tolist() == [[1, 3]]
+        assert best_scores.tolist() == [[0.9, 0.7]]
+
+
+class TestBuildNeighbors:
+    """Test writing the movie_neighbors table"""
+
+    def test_k_rows_per_movie(self, catalog_conn):
+        """Test every movie gets k ranked neighbours"""
+        count = build_neighbors(catalog_conn, k=5)
+        assert count == 120 * 5
+        ranks = catalog_conn.execute(
+            "SELECT rank, score FROM movie_neighbors WHERE movie_id = 1 ORDER BY rank").fetchall()
+        assert [r[0] for r in ranks] == [0, 1, 2, 3, 4]
+        assert [r[1] for r in ranks] == sorted([r[1] for r in ranks], reverse=True)
+
+    def test_rebuild_replaces_table(self, catalog_conn):
+        """Test rerunning the job replaces the previous neighbours"""
+        build_neighbors(catalog_conn, k=5)
+        assert build_neighbors(catalog_conn, k=3) == 120 * 3
+
+    def test_single_movie(self, movies_frame):
+        """Test a catalog with one movie has no neighbours"""
+        conn = sqlite3.connect(":memory:")
+        movies_frame.head(1).to_sql('movies', conn, index=False)
+        assert build_neighbors(conn) == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,80 @@
+import sqlite3
+import pytest
+from overview_store import (OverviewStore, compress, decompress, has_overview_store,
+                            migrate, train_dictionary, write_overview_store)
+
+
+class TestCompression:
+    """Test dictionary compression of overviews"""
+
+    def test_round_trip(self):
+        """Test text survives compression"""
+        zdict = train_dictionary(["a young wizard goes to school", "a young detective solves a case"])
+        text = "A young wizard — détective — solves a case"
+        assert decompress(compress(text, zdict), zdict) == text
+
+    def test_none_stays_none(self):
+        """Test missing overviews are stored as NULL"""
+        assert compress(None, b"") is None
+        assert decompress(None, b"") is None
+
+    def test_empty_dictionary(self):
+        """Test compression works without a dictionary"""
+        assert decompress(compress("plain zlib", b""), b"") == "plain zlib"
+
+    def test_dictionary_helps_short_texts(self):
+        """Test the shared dictionary makes short overviews smaller"""
+        texts = [f"a retired detective returns to the city to hunt a killer number {i}" for i in range(50)]
+        zdict = train_dictionary(texts)
+        with_dict = sum(len(compress(t, zdict)) for t in texts)
+        without_dict = sum(len(compress(t, b"")) for t in texts)
+        assert with_dict < without_dict
+
+    def test_dictionary_size_limit(self):
+        """Test the dictionary fits zlib's 32 KB window"""
+        texts = [" ".join(f"word{i}_{j}" for j in range(200)) for i in range(2)] * 2
+        assert len(train_dictionary(texts, max_bytes=1024)) <= 1024
+
+
+class TestMigrate:
+    """Test moving overviews out of the movies table"""
+
+    def test_migrate_moves_overviews(self, catalog_conn, movies_frame):
+        """Test overviews are dropped from movies and readable from the store"""
+        assert not has_overview_store(catalog_conn)
+        assert migrate(catalog_conn)
+
+        columns = [row[1] for row in catalog_conn.execute("PRAGMA table_info(movies)")]
+        assert "overview" not in columns
+
+        store = OverviewStore.open(catalog_conn)
+        overviews = store.fetch(catalog_conn, [1, 5, 99999])
+        assert overviews == {1: movies_frame.loc[0, 'overview'], 5: movies_frame.loc[4, 'overview']}
+
+    def test_migrate_twice(self, catalog_conn):
+        """Test migrating an already migrated database is a no-op"""
+        migrate(catalog_conn)
+        assert not migrate(catalog_conn)
+
+    def test_open_without_store(self, catalog_conn):
+        """Test databases without the store return None"""
+        assert OverviewStore.open(catalog_conn) is None
+
+    def test_attach_keeps_order(self, catalog_conn, movies_frame):
+        """Test attach fills overviews row by row"""
+        migrate(catalog_conn)
+        store = OverviewStore.open(catalog_conn)
+        frame = movies_frame[['id', 'title']].iloc[[3, 0, 2]]
+        attached = store.attach(catalog_conn, frame)
+        assert list(attached['overview']) == list(movies_frame['overview'].iloc[[3, 0, 2]])
+        assert 'overview' not in frame.columns
+
+    def test_null_overview(self):
+        """Test NULL overviews stay NULL"""
+        conn = sqlite3.connect(":memory:")
+        write_overview_store(conn, [(1, None), (2, "text")])
+        assert OverviewStore.open(conn).fetch(conn, [1, 2]) == {1: None, 2: "text"}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
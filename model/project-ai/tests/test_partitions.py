@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import pytest
+import pandas as pd
+from unittest.mock import patch
+from partitions import build_partitions, open_partitions, partition_languages
+from sql_utils import build_sql_query
+
+
+def patch_languages(n):
+    """Limit the languages that get their own table"""
+    return patch('partitions.partition_languages', lambda conn: partition_languages(conn, n))
+
+
+@pytest.fixture
+def partitioned_db(tmp_path, movies_frame):
+    """Sample database with null years and rare languages, plus its partitions"""
+    movies_frame.loc[::15, 'year'] = None
+    movies_frame.loc[::7, 'original_language'] = 'ja'
+    movies_frame.loc[::11, 'original_language'] = None
+    db_path = str(tmp_path / "movies.db")
+    conn = sqlite3.connect(db_path)
+    movies_frame.to_sql('movies', conn, index=False)
+    conn.close()
+    return db_path, str(tmp_path / "partitions")
+
+
+def single_table(db_path, **filters):
+    """Candidates from the unpartitioned movies table"""
+    query, params = build_sql_query(**filters)
+    conn = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+
+class TestPartitionedQuery:
+    """Test pruned, parallel partition scans against the single table"""
+
+    @pytest.mark.parametrize("era", [None, "old", "actual", "new", "any", "unknown"])
+    @pytest.mark.parametrize("language", [None, "", "en", "ja", "xx"])
+    @pytest.mark.parametrize("preferred_length", [None, 90])
+    def test_same_rows_and_order(self, partitioned_db, era, language, preferred_length):
+        """Test partitioned queries return the single-table result"""
+        db_path, partition_dir = partitioned_db
+        with patch_languages(2):
+            movies = open_partitions(build_partitions(db_path, partition_dir))
+
+        expected = single_table(db_path, preferred_length=preferred_length, language=language, era=era,
+                                previous_ids=[1, 2, 3])
+        result = movies.query(preferred_length, language, era, [1, 2, 3])
+
+        assert list(result['id']) == list(expected['id'])
+        assert list(result.columns) == list(expected.columns)
+
+    def test_pruning(self, partitioned_db):
+        """Test only the partitions a query can match are scanned"""
+        db_path, partition_dir = partitioned_db
+        with patch_languages(2):
+            movies = open_partitions(build_partitions(db_path, partition_dir))
+
+        assert {(p['era'], p['language']) for p in movies.prune('en', 'old')} == {('old', 'en')}
+        assert {p['language'] for p in movies.prune('ja', None)} == {'other'}
+        assert {p['era'] for p in movies.prune(None, 'new')} == {'new'}
+        # Filters the SQL builder ignores prune nothing
+        assert movies.prune('', 'any') == movies.prune(None, None)
+
+    def test_no_matches(self, partitioned_db):
+        """Test an empty result keeps the query columns"""
+        db_path, partition_dir = partitioned_db
+        movies = open_partitions(build_partitions(db_path, partition_dir))
+        result = movies.query(preferred_length=1000)
+        assert result.empty
+        assert 'popularity' in result.columns
+
+    def test_build_is_idempotent(self, partitioned_db):
+        """Test an already partitioned version is reused"""
+        db_path, partition_dir = partitioned_db
+        path = build_partitions(db_path, partition_dir)
+        built_at = os.path.getmtime(os.path.join(path, "manifest.json"))
+        assert build_partitions(db_path, partition_dir) == path
+        assert os.path.getmtime(os.path.join(path, "manifest.json")) == built_at
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,113 @@
+import threading
+from metrics import metrics
+from prefetch import Prefetcher, next_page, page_key
+
+
+def page(*ids, cursor="c1"):
+    """Response with the given movie ids"""
+    return {"recommended_movies": [{"id": i, "content": ""} for i in ids], "cursor": cursor}
+
+
+class TestPageKey:
+    """Test follow-up request keys"""
+
+    def test_previous_ids_order_ignored(self):
+        """Test the same seen ids in any order give the same key"""
+        assert page_key({"mood": "happy"}, [3, 1], "c") == page_key({"mood": "happy"}, [1, 3, 3], "c")
+
+    def test_cursor_and_preferences_matter(self):
+        """Test other cursors or preferences give other keys"""
+        key = page_key({"mood": "happy"}, [1], "c")
+        assert key != page_key({"mood": "happy"}, [1], "d")
+        assert key != page_key({"mood": "sad"}, [1], "c")
+
+    def test_next_page(self):
+        """Test the follow-up excludes everything shown so far"""
+        assert next_page([1, 2], page(3, 4)) == [1, 2, 3, 4]
+        assert next_page(None, page(5)) == [5]
+
+
+class TestPrefetcher:
+    """Test scheduling, storing and handing out prefetched pages"""
+
+    def test_follow_up_served_once(self):
+        """Test the computed next page is a hit for its request, then gone"""
+        calls = []
+
+        def compute(request_json, previous_ids, cursor):
+            calls.append((previous_ids, cursor))
+            return page(3, 4)
+
+        prefetcher = Prefetcher(compute)
+        hits = metrics.counter("prefetch.hit")
+        assert prefetcher.schedule({"mood": "happy"}, [], page(1, 2))
+
+        result = prefetcher.take({"mood": "happy"}, [2, 1], "c1")
+        assert [m["id"] for m in result["recommended_movies"]] == [3, 4]
+        assert calls == [([1, 2], "c1")]
+        assert metrics.counter("prefetch.hit") == hits + 1
+        assert prefetcher.take({"mood": "happy"}, [1, 2], "c1") is None
+
+    def test_in_flight_prefetch_joined(self):
+        """Test a request arriving mid-prefetch waits for it instead of computing again"""
+        release = threading.Event()
+        prefetcher = Prefetcher(lambda *args: release.wait(5) and page(9))
+        prefetcher.schedule({}, [], page(1))
+
+        threading.Timer(0.05, release.set).start()
+        result = prefetcher.take({}, [1], "c1")
+        assert result["recommended_movies"][0]["id"] == 9
+
+    def test_unusable_results_not_stored(self):
+        """Test empty, degraded and failed pages are not kept"""
+        results = iter([{"error": "No matching movies.", "recommended_movies": []},
+                        dict(page(2), degraded=True)])
+        prefetcher = Prefetcher(lambda *args: next(results), workers=1)
+        prefetcher.schedule({}, [], page(1))
+        prefetcher.schedule({"mood": "sad"}, [], page(1))
+        assert prefetcher.take({}, [1], "c1") is None
+        assert prefetcher.take({"mood": "sad"}, [1], "c1") is None
+
+        def fail(*args):
+            raise RuntimeError("model down")
+
+        failing = Prefetcher(fail)
+        failing.schedule({}, [], page(1))
+        assert failing.take({}, [1], "c1") is None
+
+    def test_not_scheduled(self):
+        """Test responses without a cursor, movies or AI ranking are not prefetched"""
+        prefetcher = Prefetcher(lambda *args: page(2))
+        assert not prefetcher.schedule({}, [], page(1, cursor=None))
+        assert not prefetcher.schedule({}, [], {"recommended_movies": [], "cursor": "c1"})
+        assert not prefetcher.schedule({}, [], dict(page(1), degraded=True))
+
+    def test_pending_budget(self):
+        """Test prefetches over the budget are skipped"""
+        release = threading.Event()
+        prefetcher = Prefetcher(lambda *args: release.wait(5) and page(2), max_pending=1)
+        skipped = metrics.counter("prefetch.skipped")
+
+        assert prefetcher.schedule({"mood": "happy"}, [], page(1))
+        assert not prefetcher.schedule({"mood": "sad"}, [], page(1))
+        assert metrics.counter("prefetch.skipped") == skipped + 1
+        release.set()
+
+    def test_expired_pages_counted_as_waste(self):
+        """Test pages nobody asked for count towards the waste rate"""
+        prefetcher = Prefetcher(lambda *args: page(2), ttl=0, workers=1)
+        wasted = metrics.counter("prefetch.wasted")
+        prefetcher.schedule({}, [], page(1))
+        prefetcher._pool.submit(lambda: None).result()
+
+        assert prefetcher.take({}, [1], "c1") is None
+        assert metrics.counter("prefetch.wasted") == wasted + 1
+        assert 0 < prefetcher.waste_rate() <= 1
+
+    def test_max_entries(self):
+        """Test the oldest unused pages are dropped"""
+        prefetcher = Prefetcher(lambda request_json, *args: page(request_json["n"]), max_entries=1, workers=1)
+        prefetcher.schedule({"n": 1}, [], page(1))
+        prefetcher.schedule({"n": 2}, [], page(1))
+        prefetcher._pool.submit(lambda: None).result()
+        assert len(prefetcher) == 1
@@ -0,0 +1,91 @@
+import os
+import pytest
+from profiling import list_profiles, profile_request, prune_profiles, read_profile_report, should_profile
+
+
+def busy_work():
+    """Some CPU work and allocations to profile"""
+    return sum(len(str(i) * 10) for i in range(20000))
+
+
+class TestShouldProfile:
+    """Test the profiling gate"""
+
+    def test_disabled_ignores_header(self):
+        """Test nothing is profiled unless enabled by config"""
+        assert not should_profile("1", enabled=False, sample_rate=1.0)
+
+    def test_header_enables(self):
+        """Test the X-Profile header profiles the request"""
+        assert should_profile("1", enabled=True, sample_rate=0)
+        assert not should_profile("0", enabled=True, sample_rate=0)
+
+    def test_sample_rate(self):
+        """Test sampling without the header"""
+        assert should_profile(None, enabled=True, sample_rate=1.0)
+        assert not should_profile(None, enabled=True, sample_rate=0)
+
+
+class TestProfileRequest:
+    """Test capturing and listing profiles"""
+
+    def test_writes_reports(self, tmp_path):
+        """Test a profile writes the cProfile dump, text report and summary"""
+        with profile_request("test", profile_dir=str(tmp_path)) as profile:
+            busy_work()
+
+        profile_id = profile["id"]
+        assert profile_id is not None
+        assert {f for f in os.listdir(tmp_path)} == {profile_id + s for s in (".prof", ".txt", ".json")}
+
+        report = read_profile_report(profile_id, str(tmp_path))
+        assert "busy_work" in report
+        assert "Top allocations" in report
+        assert report.startswith("CPU profile of the handling thread only")
+
+        summaries = list_profiles(str(tmp_path))
+        assert summaries[0]["id"] == profile_id
+        assert summaries[0]["name"] == "test"
+        assert summaries[0]["duration_ms"] > 0
+
+    def test_disabled_yields_no_id(self, tmp_path):
+        """Test nothing is written when profiling is off"""
+        with profile_request("test", enabled=False, profile_dir=str(tmp_path)) as profile:
+            busy_work()
+        assert profile["id"] is None
+        assert os.listdir(tmp_path) == []
+
+    def test_one_profile_at_a_time(self, tmp_path):
+        """Test a nested request is not profiled while another one is"""
+        with profile_request("outer", profile_dir=str(tmp_path)) as outer:
+            with profile_request("inner", profile_dir=str(tmp_path)) as inner:
+                busy_work()
+        assert inner["id"] is None
+        assert outer["id"] is not None
+
+    def test_saved_when_block_raises(self, tmp_path):
+        """Test failing requests are still profiled"""
+        with pytest.raises(ValueError):
+            with profile_request("failing", profile_dir=str(tmp_path)):
+                raise ValueError("boom")
+        assert len(list_profiles(str(tmp_path))) == 1
+
+    def test_prune_keeps_newest(self, tmp_path):
+        """Test old profiles are deleted beyond the limit"""
+        for name in ["20240101-000000-a", "20240102-000000-b", "20240103-000000-c"]:
+            for suffix in (".json", ".txt", ".prof"):
+                (tmp_path / (name + suffix)).write_text("{}")
+        prune_profiles(str(tmp_path), keep=1)
+        assert sorted(os.listdir(tmp_path)) == ["20240103-000000-c" + s for s in (".json", ".prof", ".txt")]
+
+    def test_rejects_path_traversal(self, tmp_path):
+        """Test report ids cannot escape the profile directory"""
+        assert read_profile_report("../../etc/passwd", str(tmp_path)) is None
+
+    def test_list_missing_dir(self, tmp_path):
+        """Test listing before any profile was taken"""
+        assert list_profiles(str(tmp_path / "missing")) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
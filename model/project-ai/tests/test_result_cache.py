@@ -0,0 +1,85 @@
+import pytest
+from result_cache import PreferenceTracker, ResultCache, result_key
+
+
+class TestResultKey:
+    """Test the result cache key"""
+
+    def test_includes_number_recommended(self):
+        """Test different result counts are cached separately"""
+        assert result_key({"mood": "happy", "number_recommended": 3}) != \
+            result_key({"mood": "happy", "number_recommended": 5})
+
+    def test_genre_order_ignored(self):
+        """Test genre order does not change the key"""
+        assert result_key({"selected_genres": ["Drama", "Action"]}) == \
+            result_key({"selected_genres": ["Action", "Drama"]})
+
+
+class TestResultCache:
+    """Test the first-page result cache"""
+
+    def test_put_get(self):
+        """Test a stored result is returned with its warmed flag"""
+        cache = ResultCache()
+        cache.put("k", {"recommended_movies": [1]}, warmed=True)
+        assert cache.get("k") == ({"recommended_movies": [1]}, True)
+
+    def test_returns_copies(self):
+        """Test callers cannot mutate the cached result"""
+        cache = ResultCache()
+        cache.put("k", {"recommended_movies": [1]})
+        result, _ = cache.get("k")
+        result["recommended_movies"].append(2)
+        assert cache.get("k")[0] == {"recommended_movies": [1]}
+
+    def test_expiry(self):
+        """Test entries expire after the TTL"""
+        cache = ResultCache(ttl=0)
+        cache.put("k", {})
+        assert cache.get("k") is None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted first"""
+        cache = ResultCache(max_entries=2)
+        cache.put("a", {})
+        cache.put("b", {})
+        cache.get("a")
+        cache.put("c", {})
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+
+    def test_ttl_left(self):
+        """Test remaining lifetime of an entry"""
+        cache = ResultCache(ttl=100)
+        assert cache.ttl_left("k") is None
+        cache.put("k", {})
+        assert 99 < cache.ttl_left("k") <= 100
+
+
+class TestPreferenceTracker:
+    """Test counting popular preference payloads"""
+
+    def test_top_in_frequency_order(self):
+        """Test the most requested payloads come first"""
+        tracker = PreferenceTracker()
+        for _ in range(3):
+            tracker.record({"mood": "sad"})
+        tracker.record({"mood": "happy"})
+        assert tracker.top(1) == [{"mood": "sad"}]
+        assert [p["mood"] for p in tracker.top(5)] == ["sad", "happy"]
+
+    def test_bounded_keys(self):
+        """Test rare combinations are dropped beyond the key limit"""
+        tracker = PreferenceTracker(max_keys=4)
+        for _ in range(5):
+            tracker.record({"mood": "sad"})
+        for length in range(10):
+            tracker.record({"preferred_length": length})
+        assert len(tracker.top(100)) <= 4
+        assert tracker.top(1) == [{"mood": "sad"}]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,113 @@
+import json
+import threading
+import pytest
+from concurrent.futures import Future
+from unittest.mock import patch
+import pandas as pd
+from metrics import metrics
+from shadow_ranker import ShadowRanker, overlap_at_k, rank_correlation
+
+
+@pytest.fixture
+def candidates():
+    """Candidates in SQL order"""
+    return pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'genres': [['Drama'], ['Comedy'], ['Comedy'], ['Horror']],
+        'popularity': [40.0, 30.0, 20.0, 10.0],
+        'imdb_rating': [5.0, 5.0, 5.0, 5.0]
+    })
+
+
+def wait_for(ranker):
+    """Block until the single pool worker has run the ranking and then the comparison it queued"""
+    for _ in range(2):
+        done = threading.Event()
+        ranker._pool.submit(done.set)
+        done.wait(timeout=5)
+
+
+class TestComparisonMetrics:
+    """Test overlap@k and rank correlation"""
+
+    def test_overlap_at_k(self):
+        """Test the share of the reference top k found by the candidate"""
+        assert overlap_at_k([1, 2, 3], [3, 2, 1, 4], 3) == 1.0
+        assert overlap_at_k([1, 2, 3], [1, 4, 5], 3) == pytest.approx(1 / 3)
+        assert overlap_at_k([1], [2, 1], 1) == 0.0
+        assert overlap_at_k([], [1], 3) is None
+
+    def test_rank_correlation(self):
+        """Test the Spearman correlation of the shared movies"""
+        assert rank_correlation([1, 2, 3], [1, 2, 3, 4]) == 1.0
+        assert rank_correlation([1, 2, 3], [3, 2, 1]) == -1.0
+        assert rank_correlation([1, 2, 9], [4, 2, 1]) == -1.0
+        assert rank_correlation([1], [1, 2]) is None
+
+
+class TestShadowRanker:
+    """Test running and recording the shadow ranking"""
+
+    def test_disabled_without_ranker(self, candidates):
+        """Test nothing runs when no ranker is configured"""
+        ranker = ShadowRanker(name="")
+        assert not ranker.enabled
+        assert ranker.start(candidates, {}) is None
+        ranker.compare(None, [1], 0.1, 1)
+
+    def test_unknown_ranker_disabled(self, candidates):
+        """Test a misconfigured ranker name disables shadowing"""
+        assert ShadowRanker(name="nope").start(candidates, {}) is None
+
+    def test_records_comparison(self, candidates, tmp_path):
+        """Test metrics and the log line after both rankings are done"""
+        log_path = tmp_path / "logs" / "shadow.jsonl"
+        ranker = ShadowRanker(name="score", log_path=str(log_path), workers=1)
+        compared = metrics.counter("shadow.compared")
+
+        shadow = ranker.start(candidates, {"selected_genres": ["Comedy"]})
+        ranker.compare(shadow, [2, 3], 1.5, 2)
+        wait_for(ranker)
+
+        assert metrics.counter("shadow.compared") == compared + 1
+        assert ranker.mean_overlap() == 1.0
+        assert ranker.mean_correlation() == 1.0
+        entry = json.loads(log_path.read_text().splitlines()[-1])
+        assert entry["ranker"] == "score"
+        assert entry["local_ids"] == [2, 3]
+        assert entry["llm_ms"] == 1500.0
+
+    def test_recorded_off_request_thread(self, tmp_path):
+        """Test a local ranking that finished before the AI is still recorded on the pool"""
+        ranker = ShadowRanker(name="score", log_path=str(tmp_path / "shadow.jsonl"), workers=1)
+        shadow = Future()
+        shadow.set_result(([2, 3], 0.01))
+        threads = []
+        with patch.object(ranker, '_log', side_effect=lambda entry: threads.append(threading.current_thread())):
+            ranker.compare(shadow, [2, 3], 1.5, 2)
+            wait_for(ranker)
+
+        assert len(threads) == 1
+        assert threads[0] is not threading.current_thread()
+
+    def test_sampling(self, candidates):
+        """Test a zero sample rate shadows nothing"""
+        assert ShadowRanker(name="score", sample_rate=0.0).start(candidates, {}) is None
+
+    def test_pending_bound(self, candidates):
+        """Test requests are not shadowed while too many rankings are pending"""
+        ranker = ShadowRanker(name="score", max_pending=0)
+        skipped = metrics.counter("shadow.skipped")
+        assert ranker.start(candidates, {}) is None
+        assert metrics.counter("shadow.skipped") == skipped + 1
+
+    def test_ranker_error_counted(self, candidates, tmp_path):
+        """Test a failing local ranker never reaches the request"""
+        ranker = ShadowRanker(name="score", log_path=str(tmp_path / "shadow.jsonl"), workers=1)
+        failed = metrics.counter("shadow.failed")
+
+        shadow = ranker.start(candidates.drop(columns="genres"), {"mood": "happy"})
+        ranker.compare(shadow, [1], 0.1, 1)
+        wait_for(ranker)
+
+        assert metrics.counter("shadow.failed") == failed + 1
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from taste_profiles import TASTE_DIMS, ProfileStore, era_slot, movie_vector, slot, taste_features
+
+
+def vector(genres=("Horror",), language="en", year=1985, director="Director 1", overview="A haunted house"):
+    """Feature vector of a made up movie"""
+    return movie_vector(list(genres), language, year, director, overview)
+
+
+class TestMovieVector:
+    """Test the hashed movie feature space"""
+
+    def test_unit_length(self):
+        """Test vectors are normalized so dot products compare like cosines"""
+        assert vector().shape == (TASTE_DIMS,)
+        assert vector().dtype == np.float32
+        assert np.linalg.norm(vector()) == pytest.approx(1.0)
+
+    def test_similar_movies_closer(self):
+        """Test movies sharing genres and era score higher than unrelated ones"""
+        horror = vector()
+        other_horror = vector(director="Director 2", overview="A ghost in the attic")
+        comedy = vector(genres=("Comedy",), language="fr", year=2022, director="Director 3", overview="Wedding fun")
+        assert horror @ other_horror > horror @ comedy
+
+    def test_missing_values(self):
+        """Test movies without any features give a zero vector"""
+        assert not movie_vector([], None, float("nan"), None, None).any()
+
+    @pytest.mark.parametrize("year,expected", [(1990, 0), (1991, 1), (2020, 1), (2021, 2), (None, None)])
+    def test_era_slot(self, year, expected):
+        """Test eras use the same bounds as the SQL era filter"""
+        assert era_slot(year) == expected
+
+    def test_slot_stable(self):
+        """Test hashed slots do not depend on the process hash seed"""
+        assert slot("Horror", 24) == slot("Horror", 24)
+        assert 0 <= slot("Horror", 24) < 24
+
+    def test_matrix(self):
+        """Test one row per movie"""
+        matrix = taste_features([["Horror"], []], ["en", None], [1985, float("nan")], ["D", None], ["x", None])
+        assert matrix.shape == (2, TASTE_DIMS)
+        assert matrix.dtype == np.float32
+
+
+class TestProfileStore:
+    """Test incremental taste vectors"""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        """Profile store in a temporary database"""
+        store = ProfileStore(str(tmp_path / "profiles.db"))
+        yield store
+        store.close()
+
+    def test_unknown_user(self, store):
+        """Test users without history have no vector"""
+        assert store.get("nobody") is None
+        assert store.interactions("nobody") == 0
+
+    def test_first_interactions_averaged(self, store):
+        """Test early interactions are a running mean of the movie vectors"""
+        a, b = vector(), vector(genres=("Comedy",))
+        store.update("u1", a)
+        np.testing.assert_allclose(store.get("u1"), a, rtol=1e-6)
+        store.update("u1", b)
+        np.testing.assert_allclose(store.get("u1"), (a + b) / 2, rtol=1e-5, atol=1e-7)
+        assert store.interactions("u1") == 2
+
+    def test_long_history_keeps_learning(self, tmp_path):
+        """Test the rate does not fall below min_rate"""
+        store = ProfileStore(str(tmp_path / "profiles.db"), min_rate=0.5)
+        a, b = vector(), vector(genres=("Comedy",), language="fr", year=2022)
+        store.update("u1", np.stack([a] * 10))
+        store.update("u1", b)
+        np.testing.assert_allclose(store.get("u1"), (a + b) / 2, rtol=1e-5, atol=1e-7)
+
+    def test_negative_weight_moves_away(self, store):
+        """Test disliked movies lower the score of similar movies"""
+        horror = vector()
+        store.update("u1", vector(genres=("Horror", "Thriller")))
+        before = store.get("u1") @ horror
+        store.update("u1", horror, weight=-1.0)
+        assert store.get("u1") @ horror < before
+
+    def test_persisted(self, store):
+        """Test profiles survive a new store on the same file"""
+        store.update("u1", vector())
+        reopened = ProfileStore(store.path)
+        np.testing.assert_allclose(reopened.get("u1"), vector(), rtol=1e-6)
+        reopened.close()
+
+    def test_other_dims_start_over(self, store):
+        """Test a stored vector of another size is ignored"""
+        store.update("u1", vector())
+        resized = ProfileStore(store.path, dims=TASTE_DIMS + 1)
+        assert resized.get("u1") is None
+        resized.close()
+
+    def test_cache_bounded(self, tmp_path):
+        """Test the in-memory profiles are an LRU of max_cached users"""
+        store = ProfileStore(str(tmp_path / "profiles.db"), max_cached=2)
+        for user in ["a", "b", "c"]:
+            store.update(user, vector())
+        assert len(store) == 2
+        assert store.get("a") is not None
+        store.close()
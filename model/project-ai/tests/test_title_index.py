@@ -0,0 +1,72 @@
+import pytest
+from title_index import MAX_KEY_BYTES, build_title_index, normalize_title, search_prefix, title_keys
+
+
+class TestNormalizeTitle:
+    """Test title normalization"""
+
+    def test_case_accents_punctuation(self):
+        """Test case, accents and punctuation are folded"""
+        assert normalize_title("Amélie: Le Fabuleux Destin!") == "amelie le fabuleux destin"
+
+    def test_empty(self):
+        """Test missing titles normalize to an empty key"""
+        assert normalize_title(None) == ""
+        assert normalize_title("!!!") == ""
+
+    def test_leading_article_variant(self):
+        """Test titles are also indexed without a leading article"""
+        assert title_keys("The Dark Knight") == ["the dark knight", "dark knight"]
+        assert title_keys("The") == ["the"]
+
+
+class TestSearchPrefix:
+    """Test prefix lookups on the sorted key array"""
+
+    @pytest.fixture
+    def index(self):
+        """Titles in popularity order, row 0 most popular"""
+        titles = ["Star Wars", "The Dark Knight", "Stardust", "Star Trek", "Dark City", "Starship Troopers", None]
+        return build_title_index(titles)
+
+    def test_popularity_order(self, index):
+        """Test matches come back most popular first"""
+        keys, rows = index
+        assert search_prefix(keys, rows, "star", 10) == [0, 2, 3, 5]
+
+    def test_limit(self, index):
+        """Test results are capped"""
+        keys, rows = index
+        assert search_prefix(keys, rows, "star", 2) == [0, 2]
+
+    def test_article_variant_deduplicated(self, index):
+        """Test a title matched through both keys is returned once"""
+        keys, rows = index
+        assert search_prefix(keys, rows, "dark", 10) == [1, 4]
+        assert search_prefix(keys, rows, "the d", 10) == [1]
+
+    def test_no_match_and_empty_prefix(self, index):
+        """Test unknown and empty prefixes return nothing"""
+        keys, rows = index
+        assert search_prefix(keys, rows, "zzz", 10) == []
+        assert search_prefix(keys, rows, "  ", 10) == []
+
+    def test_word_boundary_normalized(self, index):
+        """Test typed punctuation and case match the normalized keys"""
+        keys, rows = index
+        assert search_prefix(keys, rows, "STAR-W", 10) == [0]
+
+    def test_long_titles_truncated(self):
+        """Test titles longer than the key width still match their prefix"""
+        title = "a" * (MAX_KEY_BYTES + 20)
+        keys, rows = build_title_index([title])
+        assert search_prefix(keys, rows, title, 5) == [0]
+
+    def test_empty_index(self):
+        """Test searching an empty catalog"""
+        keys, rows = build_title_index([])
+        assert search_prefix(keys, rows, "a", 5) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,56 @@
+import re
+import unicodedata
+
+import numpy as np
+
+# Keys are fixed-width byte strings, longer titles are only matched on their start
+MAX_KEY_BYTES = 48
+LEADING_ARTICLES = ("the ", "a ", "an ")
+NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_title(text):
+    """Lowercase ASCII words separated by single spaces ("Amélie!" -> "amelie")"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return NON_ALPHANUMERIC.sub(" ", text.lower()).strip()
+
+
+def title_keys(title):
+    key = normalize_title(title)
+    if not key:
+        return []
+    keys = [key]
+    # "The Dark Knight" is also found by typing "dark"
+    for article in LEADING_ARTICLES:
+        if key.startswith(article) and len(key) > len(article):
+            keys.append(key[len(article):])
+    return keys
+
+
+def build_title_index(titles):
+    """Sorted title keys and the catalog row of each key"""
+    pairs = [(key.encode("ascii")[:MAX_KEY_BYTES], row)
+             for row, title in enumerate(titles) for key in title_keys(title)]
+    pairs.sort()
+    keys = np.array([key for key, _ in pairs], dtype=f"S{MAX_KEY_BYTES}")
+    rows = np.array([row for _, row in pairs], dtype=np.int32)
+    return keys, rows
+
+
+def search_prefix(keys, rows, prefix, limit):
+    """
+    Rows whose title starts with prefix, best first. Catalog rows are in
+    popularity order, so the most popular matches are the lowest rows.
+    """
+    needle = normalize_title(prefix).encode("ascii")[:MAX_KEY_BYTES]
+    if not needle or len(keys) == 0:
+        return []
+    # Keys are ASCII, nothing sorts after a 0xff byte
+    low = np.searchsorted(keys, needle, side="left")
+    high = np.searchsorted(keys, needle + b"\xff", side="left")
+    if low >= high:
+        return []
+    matches = np.unique(rows[low:high])
+    return matches[:limit].tolist()